@@ -108,6 +108,5 @@ def get_reference_agent_args(model_name: str) -> list[AgentArgs]:
         GenericAgentArgsWithSleep(
             chat_model_args=EXTENDED_CHAT_MODEL_ARGS_DICT[model_name],
             flags=prompt_flags,
-            sleep_time=5
         )
     ]
@@ -0,0 +1,223 @@
+"""
+Structural diff of accessibility trees, to show the LLM only what changed between two steps.
+
+The nodes of the AXTree are matched by their bid. Nodes without a bid (e.g. StaticText) are folded
+into their closest ancestor with a bid, so that a change of text shows up as a change of the
+element containing it. Each node gets a hash of its own content and a hash of its whole subtree,
+computed in a single pass, which lets the diff skip the unchanged subtrees entirely.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from browsergym.utils.obs import IGNORED_AXTREE_PROPERTIES, IGNORED_AXTREE_ROLES
+
+
+@dataclass
+class AXNode:
+    """A node of the AXTree with a bid, along with the content of its descendants without bid."""
+
+    bid: str
+    lines: list[str]
+    depth: int
+    children: list[str] = field(default_factory=list)
+    node_hash: int = 0
+    subtree_hash: int = 0
+    subtree_size: int = 1
+
+    def to_str(self, indent: str = "") -> str:
+        inner_indent = indent + "\t"
+        return "\n".join(
+            [f"{indent}{self.lines[0]}"] + [f"{inner_indent}{line}" for line in self.lines[1:]]
+        )
+
+
+@dataclass
+class AXTreeIndex:
+    roots: list[str]
+    nodes: dict[str, AXNode]
+
+
+def _node_str(node: dict) -> str | None:
+    """Short description of an AXTree node, similar to the lines of flatten_axtree_to_str."""
+    role = node.get("role", {}).get("value")
+    name = node.get("name", {}).get("value", "")
+    if role in IGNORED_AXTREE_ROLES or (role == "generic" and not name):
+        return None
+
+    node_str = f"{role} {repr(name.strip())}"
+    value = node.get("value", {}).get("value")
+    if value is not None:
+        node_str += f" value={repr(value)}"
+    for prop in node.get("properties", []):
+        prop_value = prop.get("value", {}).get("value")
+        if prop_value is None or prop["name"] in IGNORED_AXTREE_PROPERTIES:
+            continue
+        if prop["name"] in ("required", "focused", "atomic"):
+            if prop_value:
+                node_str += f", {prop['name']}"
+        else:
+            node_str += f", {prop['name']}={repr(prop_value)}"
+    return node_str
+
+
+def index_axtree(axtree_object: dict) -> AXTreeIndex:
+    """Index the nodes of an AXTree by bid and hash their subtrees, in O(n)."""
+    ax_nodes = axtree_object["nodes"]
+    node_id_to_idx = {node["nodeId"]: idx for idx, node in enumerate(ax_nodes)}
+
+    roots = []
+    nodes: dict[str, AXNode] = {}
+    # nodes with a bid in depth-first order, parents before their children
+    order = []
+    root_lines = []
+    visited = set()
+    # (node index, bid of the closest ancestor with a bid, depth)
+    stack = [(0, None, 0)] if ax_nodes else []
+    while stack:
+        idx, owner, depth = stack.pop()
+        if idx in visited:
+            continue
+        visited.add(idx)
+        node = ax_nodes[idx]
+        node_str = _node_str(node)
+        bid = node.get("browsergym_id")
+
+        if bid is not None and bid not in nodes:
+            nodes[bid] = AXNode(bid=bid, lines=[f"[{bid}] {node_str or ''}".rstrip()], depth=depth)
+            order.append(bid)
+            if owner is None:
+                roots.append(bid)
+            else:
+                nodes[owner].children.append(bid)
+            owner = bid
+            depth += 1
+        elif node_str is not None:
+            (nodes[owner].lines if owner is not None else root_lines).append(node_str)
+
+        for child_id in reversed(node.get("childIds", [])):
+            child_idx = node_id_to_idx.get(child_id)
+            if child_idx is not None and child_idx not in visited:
+                stack.append((child_idx, owner, depth))
+
+    # children come after their parent in the depth-first order, hash them first
+    for bid in reversed(order):
+        node = nodes[bid]
+        node.node_hash = hash(tuple(node.lines))
+        children = [nodes[child] for child in node.children]
+        node.subtree_hash = hash((node.node_hash, tuple(child.subtree_hash for child in children)))
+        node.subtree_size = 1 + sum(child.subtree_size for child in children)
+
+    return AXTreeIndex(roots=roots, nodes=nodes)
+
+
+@dataclass
+class TreeDiff:
+    """Nodes added, removed and changed between two AXTrees."""
+
+    added: list[AXNode]
+    removed: list[AXNode]
+    changed: list[tuple[AXNode, AXNode]]
+    n_unchanged: int
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    @property
+    def n_changes(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def to_str(self, max_lines: int = None) -> str:
+        """Format the diff, keeping at most max_lines nodes."""
+        if self.is_empty:
+            return "Identical"
+
+        lines = []
+        if self.added:
+            lines.append("Added:")
+            lines.extend(node.to_str("\t" * node.depth) for node in self.added)
+        if self.removed:
+            lines.append("Removed:")
+            lines.extend(node.to_str("\t" * node.depth) for node in self.removed)
+        if self.changed:
+            lines.append("Changed:")
+            for previous, current in self.changed:
+                lines.append(previous.to_str("- "))
+                lines.append(current.to_str("+ "))
+
+        header = (
+            f"{len(self.added)} nodes added, {len(self.removed)} removed, "
+            f"{len(self.changed)} changed and {self.n_unchanged} unchanged:"
+        )
+        if max_lines is not None and len(lines) > max_lines:
+            n_hidden = len(lines) - max_lines
+            lines = lines[:max_lines] + [f"Diff truncated, {n_hidden} changes not shown."]
+        return "\n".join([header] + lines)
+
+
+def diff_indexes(previous: AXTreeIndex, current: AXTreeIndex) -> TreeDiff:
+    """Diff two indexed AXTrees. The subtrees whose hash is unchanged are not visited."""
+    added, changed = [], []
+    n_unchanged = 0
+
+    stack = list(reversed(current.roots))
+    while stack:
+        node = current.nodes[stack.pop()]
+        previous_node = previous.nodes.get(node.bid)
+        if previous_node is not None and previous_node.subtree_hash == node.subtree_hash:
+            n_unchanged += node.subtree_size
+            continue
+
+        if previous_node is None:
+            added.append(node)
+        elif previous_node.node_hash != node.node_hash:
+            changed.append((previous_node, node))
+        else:
+            n_unchanged += 1
+        stack.extend(reversed(node.children))
+
+    removed = [node for bid, node in previous.nodes.items() if bid not in current.nodes]
+    return TreeDiff(added=added, removed=removed, changed=changed, n_unchanged=n_unchanged)
+
+
+# indexes and diffs of the last trees, the prompt of each step diffs the whole history again. The
+# trees are kept alongside, so that their ids are not reused while they are cached.
+_CACHE_SIZE = 64
+_index_cache: OrderedDict = OrderedDict()
+_diff_cache: OrderedDict = OrderedDict()
+
+
+def _get_cached(cache: OrderedDict, key, objects, compute):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key][1]
+    value = compute()
+    cache[key] = (objects, value)
+    if len(cache) > _CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+def get_axtree_index(axtree_object: dict) -> AXTreeIndex:
+    return _get_cached(
+        _index_cache, id(axtree_object), axtree_object, lambda: index_axtree(axtree_object)
+    )
+
+
+def diff_axtrees(previous_axtree: dict, current_axtree: dict) -> TreeDiff:
+    """Diff two AXTree objects (obs["axtree_object"]), by bid.
+
+    Args:
+        previous_axtree: The AXTree of the previous observation.
+        current_axtree: The AXTree of the current observation.
+
+    Returns:
+        TreeDiff: The nodes added, removed and changed in the current AXTree.
+    """
+    return _get_cached(
+        _diff_cache,
+        (id(previous_axtree), id(current_axtree)),
+        (previous_axtree, current_axtree),
+        lambda: diff_indexes(get_axtree_index(previous_axtree), get_axtree_index(current_axtree)),
+    )
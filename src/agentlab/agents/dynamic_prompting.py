@@ -1,8 +1,11 @@
 import abc
+import hashlib
 import logging
+import pickle
 import platform
 import time
 from copy import copy, deepcopy
+from itertools import accumulate
 from dataclasses import asdict, dataclass
 from textwrap import dedent
 from typing import Literal
@@ -17,6 +20,8 @@ from browsergym.utils.obs import (
     prune_html,
 )
 
+from agentlab.agents.axtree_diff import diff_axtrees
+from agentlab.llm.tokenizer_registry import calibrate_estimate, estimate_tokens
 from agentlab.llm.llm_utils import (
     BaseMessage,
     ParseError,
@@ -62,7 +67,8 @@ class ObsFlags(Flags):
         use_past_error_logs (bool): If use_history is True, expose all previous errors in the history.
         use_action_history (bool): If use_history is True, include the actions in the history.
         use_think_history (bool): If use_history is True, include all previous chains of thoughts in the history.
-        use_diff (bool): Add a diff of the current and previous HTML to the prompt.
+        use_diff (bool): If use_history is True, add the diff of the AXTree with the previous step to each step of the history.
+        use_ax_tree_diff (bool): Show the AXTree of the current step as a diff with the previous step, unless most of the page changed.
         html_type (str): Type of HTML to use in the prompt, may depend on preprocessing of observation.
         use_screenshot (bool): Add a screenshot of the page to the prompt, following OpenAI's API. This will be automatically disabled if the model does not have vision capabilities.
         use_som (bool): Add a set of marks to the screenshot.
@@ -82,6 +88,7 @@ class ObsFlags(Flags):
     use_action_history: bool = False
     use_think_history: bool = False
     use_diff: bool = False  #
+    use_ax_tree_diff: bool = False
     html_type: str = "pruned_html"
     use_screenshot: bool = True
     use_som: bool = False
@@ -174,6 +181,27 @@ class PromptElement:
             visible = visible()
         return visible
 
+    def n_tokens(self, model_name="openai/gpt-4", exact=True) -> int:
+        """Number of tokens of the prompt.
+
+        The count is cached, and only recomputed when the prompt changes, e.g. after a shrink.
+        Only use this on elements whose _prompt is an attribute, a _prompt property renders a new
+        object at each access and is always recounted.
+
+        Args:
+            model_name (str, optional): The name of the model used when tokenizing.
+            exact (bool, optional): If False, return the fast estimate of estimate_tokens instead.
+        """
+        prompt = self.prompt
+        if not hasattr(self, "_n_tokens_cache"):
+            self._n_tokens_cache = {}
+        cached = self._n_tokens_cache.get((model_name, exact))
+        if cached is not None and cached[0] is prompt:
+            return cached[1]
+        n_tokens = _count_tokens(_prompt_to_str(prompt), model_name, exact) if prompt else 0
+        self._n_tokens_cache[(model_name, exact)] = (prompt, n_tokens)
+        return n_tokens
+
     def _parse_answer(self, text_answer):
         """Override to actually extract elements from the answer."""
         return {}
@@ -185,6 +213,28 @@ class PromptElement:
             return {}
 
 
+def _count_tokens(text: str, model_name: str, exact: bool) -> int:
+    if exact:
+        return count_tokens(text, model=model_name)
+    return estimate_tokens(text, model_name)
+
+
+def _prompt_to_str(prompt) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    elif isinstance(prompt, list):
+        # warn deprecated
+        warn(
+            "Using list of prompts is deprecated. Use a Discussion object instead.",
+            DeprecationWarning,
+        )
+        return "\n".join([p["text"] for p in prompt if p["type"] == "text"])
+    elif isinstance(prompt, BaseMessage):
+        return prompt.__str__(warn_if_image=False)
+    else:
+        raise ValueError(f"Unrecognized type for prompt: {type(prompt)}")
+
+
 class Shrinkable(PromptElement, abc.ABC):
     @abc.abstractmethod
     def shrink(self) -> None:
@@ -216,10 +266,111 @@ class Trunkater(Shrinkable):
             new_line_count = int(len(lines) * (1 - self.shrink_speed))
             self.deleted_lines += len(lines) - new_line_count
             self._prompt = "\n".join(lines[:new_line_count])
-            self._prompt += f"\n... Deleted {self.deleted_lines} lines to reduce prompt size."
+            self._prompt += self._deleted_lines_note(self.deleted_lines)
 
         self.shrink_calls += 1
 
+    @staticmethod
+    def _deleted_lines_note(deleted_lines: int) -> str:
+        return f"\n... Deleted {deleted_lines} lines to reduce prompt size."
+
+    def _line_offsets(self) -> list[int]:
+        """Character offset of the end of each line of the prompt, cached until it changes."""
+        prompt = self._prompt
+        cached = getattr(self, "_line_offsets_cache", None)
+        if cached is None or cached[0] is not prompt:
+            # +1 for the line break
+            cached = (prompt, list(accumulate(len(line) + 1 for line in prompt.splitlines())))
+            self._line_offsets_cache = cached
+        return cached[1]
+
+    def estimate_n_tokens(self, n_shrinks: int, model_name="openai/gpt-4", exact=True) -> int:
+        """Estimate the number of tokens of the prompt after n_shrinks more calls to shrink.
+
+        The lines kept by the next shrinks are computed exactly, and their number of tokens is
+        estimated from the cached token count of the current prompt, pro rata of the characters
+        kept. This way, no prompt has to be tokenized.
+        """
+        n_tokens = self.n_tokens(model_name, exact)
+        if n_tokens == 0 or n_shrinks == 0:
+            return n_tokens
+
+        line_offsets = self._line_offsets()
+        n_lines = n_kept = len(line_offsets)
+        shrink_calls, deleted_lines = self.shrink_calls, self.deleted_lines
+        for _ in range(n_shrinks):
+            if shrink_calls >= self.start_trunkate_iteration:
+                new_line_count = int(n_lines * (1 - self.shrink_speed))
+                deleted_lines += n_lines - new_line_count
+                n_kept = min(n_kept, new_line_count)
+                # the note of the deleted lines is appended as a new line
+                n_lines = max(new_line_count, 1) + 1
+            shrink_calls += 1
+
+        if n_kept == len(line_offsets):
+            return n_tokens
+        n_chars = line_offsets[n_kept - 1] if n_kept > 0 else 0
+        n_chars += len(self._deleted_lines_note(deleted_lines))
+        return round(n_tokens * n_chars / max(line_offsets[-1], 1))
+
+
+def _visible_shrinkables(element: PromptElement) -> list[Shrinkable]:
+    """Find the visible elements nested in a prompt element whose shrinks can be estimated, i.e.
+    the Trunkater (AXTree, HTML, ...) and AXTreeDiff elements, including those of the History."""
+    shrinkables = []
+    visited = set()
+    stack = [element]
+    while stack:
+        element = stack.pop()
+        if id(element) in visited:
+            continue
+        visited.add(id(element))
+        if not element.is_visible:
+            continue
+        if isinstance(element, (Trunkater, AXTreeDiff)):
+            shrinkables.append(element)
+            continue
+        for value in vars(element).values():
+            if isinstance(value, PromptElement):
+                stack.append(value)
+            elif isinstance(value, (list, tuple)):
+                stack.extend(v for v in value if isinstance(v, PromptElement))
+    return shrinkables
+
+
+def plan_shrink(
+    shrinkables: list[Shrinkable],
+    n_tokens_to_remove: int,
+    max_iterations=20,
+    model_name="openai/gpt-4",
+    exact=True,
+) -> int:
+    """Compute in one pass the number of shrink iterations needed to remove n_tokens_to_remove.
+
+    Each iteration shrinks the visible elements (AXTree, HTML, AXTree diffs, ...) by their own
+    schedule, so the lines removed after n iterations are known in advance. The token counts are
+    estimated from the cached counts of the elements, see Trunkater.estimate_n_tokens.
+
+    Args:
+        shrinkables (list[Shrinkable]): The visible elements of the prompt, see
+            _visible_shrinkables.
+        n_tokens_to_remove (int): The number of tokens above the maximum.
+        max_iterations (int, optional): The maximum number of shrink iterations, by default 20.
+        model_name (str, optional): The name of the model used when tokenizing.
+        exact (bool, optional): If False, start from the fast estimates of the element counts.
+
+    Returns:
+        int: the number of shrink iterations, at least 1 and at most max_iterations.
+    """
+    current = sum(element.n_tokens(model_name, exact) for element in shrinkables)
+    for n_shrinks in range(1, max_iterations):
+        estimated = sum(
+            element.estimate_n_tokens(n_shrinks, model_name, exact) for element in shrinkables
+        )
+        if current - estimated >= n_tokens_to_remove:
+            return n_shrinks
+    return max(max_iterations, 1)
+
 
 def fit_tokens(
     shrinkable: Shrinkable,
@@ -230,6 +381,13 @@ def fit_tokens(
 ):
     """Shrink a prompt element until it fits `max_prompt_tokens`.
 
+    The number of shrink iterations is planned from the token counts of the shrunk elements
+    (see plan_shrink), and the total is updated from their cached counts. The early iterations are
+    planned with the fast estimate of estimate_tokens. Then, the prompt is tokenized once, which
+    also calibrates the estimate, and the last iterations are planned with exact counts of the
+    elements. The shrunk prompt is tokenized once more to confirm that it fits, the remaining
+    iterations are then counted on the whole prompt.
+
     Args:
         shrinkable (Shrinkable): The prompt element to shrink.
         max_prompt_tokens (int): The maximum number of tokens allowed.
@@ -253,33 +411,58 @@ def fit_tokens(
     for prompt in additional_prompts:
         max_prompt_tokens -= count_tokens(prompt, model=model_name) + 1  # +1 because why not ?
 
-    for _ in range(max_iterations):
+    n_iterations = 0
+    for exact in (False, True):
         prompt = shrinkable.prompt
-        if isinstance(prompt, str):
-            prompt_str = prompt
-        elif isinstance(prompt, list):
-            # warn deprecated
-            warn(
-                "Using list of prompts is deprecated. Use a Discussion object instead.",
-                DeprecationWarning,
+        prompt_str = _prompt_to_str(prompt)
+        n_token = _count_tokens(prompt_str, model_name, exact)
+        if exact:
+            calibrate_estimate(model_name, prompt_str, n_token)
+
+        while n_token > max_prompt_tokens and n_iterations < max_iterations:
+            shrinkables = _visible_shrinkables(shrinkable)
+            if not shrinkables:
+                break
+            n_shrinks = plan_shrink(
+                shrinkables,
+                n_token - max_prompt_tokens,
+                max_iterations - n_iterations,
+                model_name,
+                exact,
             )
-            prompt_str = "\n".join([p["text"] for p in prompt if p["type"] == "text"])
-        elif isinstance(prompt, BaseMessage):
-            prompt_str = prompt.__str__(warn_if_image=False)
-        else:
-            raise ValueError(f"Unrecognized type for prompt: {type(prompt)}")
-        n_token = count_tokens(prompt_str, model=model_name)
-        if n_token <= max_prompt_tokens:
-            return prompt
+            if not exact:
+                # stop one iteration short of the estimate, the last one is planned exactly
+                n_shrinks -= 1
+                if n_shrinks == 0:
+                    break
+            n_before = sum(element.n_tokens(model_name, exact) for element in shrinkables)
+            for _ in range(n_shrinks):
+                shrinkable.shrink()
+            n_after = sum(element.n_tokens(model_name, exact) for element in shrinkables)
+            n_token -= n_before - n_after
+            n_iterations += n_shrinks
+            prompt = None
+
+    if prompt is None:
+        # the counts of the elements don't account for the other changes of the prompt
+        prompt = shrinkable.prompt
+        n_token = count_tokens(_prompt_to_str(prompt), model=model_name)
+
+    # no element to plan with, or the plan fell short: count the whole prompt at each iteration
+    while n_token > max_prompt_tokens and n_iterations < max_iterations:
         shrinkable.shrink()
+        n_iterations += 1
+        prompt = shrinkable.prompt
+        n_token = count_tokens(_prompt_to_str(prompt), model=model_name)
 
-    logging.info(
-        dedent(
-            f"""\
-            After {max_iterations} shrink iterations, the prompt is still
-            {count_tokens(prompt_str)} tokens (greater than {max_prompt_tokens}). Returning the prompt as is."""
+    if n_token > max_prompt_tokens:
+        logging.info(
+            dedent(
+                f"""\
+                After {max_iterations} shrink iterations, the prompt is still
+                {n_token} tokens (greater than {max_prompt_tokens}). Returning the prompt as is."""
+            )
         )
-    )
     return prompt
 
 
@@ -342,6 +525,68 @@ present, the element is not visible on the page.
         self._prompt = f"\n{prefix}AXTree:\n{bid_info}{coord_note}{visible_elements_note}{vsible_tag_note}{ax_tree}\n"
 
 
+class AXTreeDiff(Shrinkable):
+    """Changes of the AXTree since the previous observation, see agents.axtree_diff."""
+
+    def __init__(
+        self,
+        previous_axtree: dict,
+        current_axtree: dict,
+        prefix="",
+        max_lines=None,
+        shrink_speed=0.3,
+        visible: bool = True,
+    ) -> None:
+        super().__init__(visible=visible)
+        self.previous_axtree = previous_axtree
+        self.current_axtree = current_axtree
+        self.prefix = prefix
+        self.max_lines = max_lines
+        self.shrink_speed = shrink_speed
+
+    @property
+    def diff(self):
+        return diff_axtrees(self.previous_axtree, self.current_axtree)
+
+    def _shrunk_max_lines(self, max_lines):
+        if max_lines is None:
+            max_lines = self.diff.n_changes + 3
+        return max(1, int(max_lines * (1 - self.shrink_speed)))
+
+    def shrink(self):
+        if not self.is_visible:
+            return
+        self.max_lines = self._shrunk_max_lines(self.max_lines)
+
+    def _render(self, max_lines) -> str:
+        diff_str = self.diff.to_str(max_lines)
+        return f"\n{self.prefix}AXTree changes since the previous step:\n{diff_str}\n"
+
+    @property
+    def _prompt(self) -> str:
+        # by implementing this as a property, it's only computed if visible. It is cached until
+        # the next shrink, so that its token count is cached too
+        rendered = getattr(self, "_rendered", None)
+        if rendered is None or rendered[0] != self.max_lines:
+            rendered = (self.max_lines, self._render(self.max_lines))
+            self._rendered = rendered
+        return rendered[1]
+
+    def estimate_n_tokens(self, n_shrinks: int, model_name="openai/gpt-4", exact=True) -> int:
+        """Estimate the number of tokens of the prompt after n_shrinks more calls to shrink.
+
+        The diff is rendered with the lines kept by the next shrinks, and its number of tokens is
+        estimated from the cached token count of the current prompt, pro rata of the characters.
+        """
+        n_tokens = self.n_tokens(model_name, exact)
+        if n_tokens == 0 or n_shrinks == 0:
+            return n_tokens
+        max_lines = self.max_lines
+        for _ in range(n_shrinks):
+            max_lines = self._shrunk_max_lines(max_lines)
+        return round(n_tokens * len(self._render(max_lines)) / max(len(self.prompt), 1))
+
+
 class Error(PromptElement):
     def __init__(self, error: str, visible: bool = True, prefix="", limit_logs=True) -> None:
         logs_separator = "Call log:"
@@ -399,10 +644,11 @@ class Observation(Shrinkable):
     Contains the html, the accessibility tree and the error logs.
     """
 
-    def __init__(self, obs, flags: ObsFlags) -> None:
+    def __init__(self, obs, flags: ObsFlags, previous_obs=None) -> None:
         super().__init__()
         self.flags = flags
         self.obs = obs
+        previous_axtree = previous_obs.get("axtree_object") if previous_obs else None
 
         self.tabs = Tabs(
             obs,
@@ -411,15 +657,21 @@ class Observation(Shrinkable):
         )
 
         self.html = HTML(
-            obs[flags.html_type],
+            obs.get(flags.html_type, ""),
             visible_elements_only=flags.filter_visible_elements_only,
             visible=lambda: flags.use_html,
             prefix="## ",
         )
+        self.ax_tree_diff = AXTreeDiff(
+            previous_axtree,
+            obs.get("axtree_object"),
+            prefix="## ",
+            visible=lambda: flags.use_ax_tree and self._use_ax_tree_diff(),
+        )
         self.ax_tree = AXTree(
-            obs["axtree_txt"],
+            obs.get("axtree_txt", ""),
             visible_elements_only=flags.filter_visible_elements_only,
-            visible=lambda: flags.use_ax_tree,
+            visible=lambda: flags.use_ax_tree and not self._use_ax_tree_diff(),
             coord_type=flags.extract_coords,
             visible_tag=flags.extract_visible_tag,
             prefix="## ",
@@ -435,15 +687,25 @@ class Observation(Shrinkable):
             prefix="## ",
         )
 
+    def _use_ax_tree_diff(self) -> bool:
+        """Show the AXTree diff instead of the AXTree, unless most of the nodes changed."""
+        if not self.flags.use_ax_tree_diff:
+            return False
+        if self.ax_tree_diff.previous_axtree is None or self.ax_tree_diff.current_axtree is None:
+            return False
+        diff = self.ax_tree_diff.diff
+        return diff.n_changes <= diff.n_unchanged
+
     def shrink(self):
         self.ax_tree.shrink()
+        self.ax_tree_diff.shrink()
         self.html.shrink()
 
     @property
     def _prompt(self) -> str:
         return f"""
 # Observation of current step:
-{self.tabs.prompt}{self.html.prompt}{self.ax_tree.prompt}{self.focused_element.prompt}{self.error.prompt}
+{self.tabs.prompt}{self.html.prompt}{self.ax_tree.prompt}{self.ax_tree_diff.prompt}{self.focused_element.prompt}{self.error.prompt}
 
 """
 
@@ -751,20 +1013,18 @@ class HistoryStep(Shrinkable):
         self, previous_obs, current_obs, action, memory, thought, flags: ObsFlags, shrink_speed=1
     ) -> None:
         super().__init__()
-        # self.html_diff = Diff(
-        #     previous_obs[flags.html_type],
-        #     current_obs[flags.html_type],
-        #     prefix="\n### HTML diff:\n",
-        #     shrink_speed=shrink_speed,
-        #     visible=lambda: flags.use_html and flags.use_diff,
-        # )
-        # self.ax_tree_diff = Diff(
-        #     previous_obs["axtree_txt"],
-        #     current_obs["axtree_txt"],
-        #     prefix=f"\n### Accessibility tree diff:\n",
-        #     shrink_speed=shrink_speed,
-        #     visible=lambda: flags.use_ax_tree and flags.use_diff,
-        # )
+        previous_axtree = previous_obs.get("axtree_object")
+        current_axtree = current_obs.get("axtree_object")
+        self.ax_tree_diff = AXTreeDiff(
+            previous_axtree,
+            current_axtree,
+            prefix="### ",
+            max_lines=20,
+            visible=lambda: flags.use_ax_tree
+            and flags.use_diff
+            and previous_axtree is not None
+            and current_axtree is not None,
+        )
         self.error = Error(
             current_obs["last_action_error"],
             visible=(
@@ -782,8 +1042,7 @@ class HistoryStep(Shrinkable):
 
     def shrink(self):
         super().shrink()
-        # self.html_diff.shrink()
-        # self.ax_tree_diff.shrink()
+        self.ax_tree_diff.shrink()
 
     @property
     def _prompt(self) -> str:
@@ -795,8 +1054,7 @@ class HistoryStep(Shrinkable):
         if self.flags.use_action_history:
             prompt += f"\n<action>\n{self.action}\n</action>\n"
 
-        # prompt += f"{self.error.prompt}{self.html_diff.prompt}{self.ax_tree_diff.prompt}"
-        prompt += f"{self.error.prompt}"
+        prompt += f"{self.error.prompt}{self.ax_tree_diff.prompt}"
 
         if self.memory is not None:
             prompt += f"\n<memory>\n{self.memory}\n</memory>\n"
@@ -845,23 +1103,45 @@ class History(Shrinkable):
         return "\n".join(prompts) + "\n"
 
 
+def _structural_hash(*objects) -> bytes:
+    """Hash of the content of nested observation objects (dicts, lists, arrays)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for obj in objects:
+        if hasattr(obj, "tobytes"):
+            # numpy arrays, e.g. the screenshot
+            digest.update(repr((obj.shape, obj.dtype)).encode())
+            digest.update(obj.tobytes())
+        else:
+            digest.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.digest()
+
+
 def make_obs_preprocessor(flags: ObsFlags):
+    """Make the observation preprocessor of the prompt.
+
+    Only the fields consumed by the flags are computed: dom_txt and pruned_html for the HTML,
+    axtree_txt for the AXTree and screenshot_som for the set of marks. The flags are read at each
+    call, so they can still be changed after this. The fields of the previous step are reused when
+    the page did not change (e.g. after a failed click or a noop), based on a hash of the DOM,
+    AXTree, screenshot and extra element properties, and of the flags they are computed with.
+    """
+    # field -> (hash of its inputs, value) for the previous observation
+    previous = {}
+
+    def memoize(field, inputs, compute):
+        key = _structural_hash(*inputs)
+        if field in previous and previous[field][0] == key:
+            return previous[field][1]
+        value = compute()
+        previous[field] = (key, value)
+        return value
+
     def obs_mapping(obs: dict):
         obs = copy(obs)
-        obs["dom_txt"] = flatten_dom_to_str(
-            obs["dom_object"],
-            extra_properties=obs["extra_element_properties"],
-            with_visible=flags.extract_visible_tag,
-            with_clickable=flags.extract_clickable_tag,
-            with_center_coords=flags.extract_coords == "center",
-            with_bounding_box_coords=flags.extract_coords == "box",
-            filter_visible_only=flags.filter_visible_elements_only,
-            filter_with_bid_only=flags.filter_with_bid_only,
-            filter_som_only=flags.filter_som_only,
-        )
-        obs["axtree_txt"] = flatten_axtree_to_str(
-            obs["axtree_object"],
-            extra_properties=obs["extra_element_properties"],
+        extra_properties = obs["extra_element_properties"]
+        # the flags are part of the memo keys, the fields change with them
+        flatten_kwargs = dict(
+            extra_properties=extra_properties,
             with_visible=flags.extract_visible_tag,
             with_clickable=flags.extract_clickable_tag,
             with_center_coords=flags.extract_coords == "center",
@@ -870,10 +1150,31 @@ def make_obs_preprocessor(flags: ObsFlags):
             filter_with_bid_only=flags.filter_with_bid_only,
             filter_som_only=flags.filter_som_only,
         )
-        obs["pruned_html"] = prune_html(obs["dom_txt"])
-        obs["screenshot_som"] = overlay_som(
-            obs["screenshot"], extra_properties=obs["extra_element_properties"]
-        )
+
+        if flags.use_html and flags.html_type in ("dom_txt", "pruned_html"):
+            obs["dom_txt"] = memoize(
+                "dom_txt",
+                (obs["dom_object"], flatten_kwargs),
+                lambda: flatten_dom_to_str(obs["dom_object"], **flatten_kwargs),
+            )
+            if flags.html_type == "pruned_html":
+                obs["pruned_html"] = memoize(
+                    "pruned_html", (obs["dom_txt"],), lambda: prune_html(obs["dom_txt"])
+                )
+
+        if flags.use_ax_tree:
+            obs["axtree_txt"] = memoize(
+                "axtree_txt",
+                (obs["axtree_object"], flatten_kwargs),
+                lambda: flatten_axtree_to_str(obs["axtree_object"], **flatten_kwargs),
+            )
+
+        if flags.use_screenshot and flags.use_som:
+            obs["screenshot_som"] = memoize(
+                "screenshot_som",
+                (obs["screenshot"], extra_properties),
+                lambda: overlay_som(obs["screenshot"], extra_properties=extra_properties),
+            )
 
         return obs
 
@@ -30,6 +30,8 @@ class GenericAgentArgs(AgentArgs):
     chat_model_args: BaseModelArgs = None
     flags: GenericPromptFlags = None
     max_retry: int = 4
+    # stream the answer and stop generating once a valid <action> is complete
+    early_stop_on_action: bool = False
 
     def __post_init__(self):
         try:  # some attributes might be temporarily args.CrossProd for hyperparameter generation
@@ -66,7 +68,10 @@ class GenericAgentArgs(AgentArgs):
 
     def make_agent(self):
         return GenericAgent(
-            chat_model_args=self.chat_model_args, flags=self.flags, max_retry=self.max_retry
+            chat_model_args=self.chat_model_args,
+            flags=self.flags,
+            max_retry=self.max_retry,
+            early_stop_on_action=self.early_stop_on_action,
         )
 
 
@@ -77,11 +82,13 @@ class GenericAgent(Agent):
         chat_model_args: BaseModelArgs,
         flags: GenericPromptFlags,
         max_retry: int = 4,
+        early_stop_on_action: bool = False,
     ):
 
         self.chat_llm = chat_model_args.make_model()
         self.chat_model_args = chat_model_args
         self.max_retry = max_retry
+        self.early_stop_on_action = early_stop_on_action
 
         self.flags = flags
         self.action_set = self.flags.action.action_set.make_action_set()
@@ -129,6 +136,7 @@ class GenericAgent(Agent):
                 chat_messages,
                 n_retry=self.max_retry,
                 parser=main_prompt._parse_answer,
+                early_stop_tag="action" if self.early_stop_on_action else None,
             )
             ans_dict["busted_retry"] = 0
             # inferring the number of retries, TODO: make this less hacky
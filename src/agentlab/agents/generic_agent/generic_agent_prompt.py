@@ -31,6 +31,7 @@ class GenericPromptFlags(dp.Flags):
         be_cautious (bool): Instruct the agent to be cautious about its actions.
         extra_instructions (Optional[str]): Extra instructions to provide to the agent.
         add_missparsed_messages (bool): When retrying, add the missparsed messages to the prompt.
+        use_prompt_caching (bool): Put the parts of the prompt that don't change between steps first, and mark them as cache breakpoints, so that providers can serve them from their prompt cache.
         flag_group (Optional[str]): Group of flags used.
     """
 
@@ -49,6 +50,7 @@ class GenericPromptFlags(dp.Flags):
     extra_instructions: str | None = None
     add_missparsed_messages: bool = True
     max_trunc_itr: int = 20
+    use_prompt_caching: bool = False
     flag_group: str = None
 
 
@@ -83,6 +85,7 @@ class MainPrompt(dp.Shrinkable):
         self.obs = dp.Observation(
             obs_history[-1],
             self.flags.obs,
+            previous_obs=obs_history[-2] if len(obs_history) > 1 else None,
         )
 
         self.action_prompt = dp.ActionPrompt(action_set, action_flags=flags.action)
@@ -102,6 +105,9 @@ class MainPrompt(dp.Shrinkable):
 
     @property
     def _prompt(self) -> HumanMessage:
+        if self.flags.use_prompt_caching:
+            return self._cache_friendly_prompt()
+
         prompt = HumanMessage(self.instructions.prompt)
         prompt.add_text(
             f"""\
@@ -118,8 +124,53 @@ class MainPrompt(dp.Shrinkable):
         )
 
         if self.flags.use_abstract_example:
-            prompt.add_text(
-                f"""
+            prompt.add_text(self._abstract_example())
+
+        if self.flags.use_concrete_example:
+            prompt.add_text(self._concrete_example())
+        return self.obs.add_screenshot(prompt)
+
+    def _cache_friendly_prompt(self) -> HumanMessage:
+        """Same content as _prompt, ordered from the most to the least stable parts.
+
+        The parts that are the same for all tasks come first, then the instructions of the task,
+        then the history (which only grows from one step to the next) and the observation. A cache
+        breakpoint is marked after the first two, so the prompt of each step starts with a
+        byte-identical prefix that the provider can serve from its prompt cache.
+        """
+        prompt = HumanMessage(
+            f"""\
+{self.action_prompt.prompt}\
+{self.hints.prompt}\
+{self.be_cautious.prompt}\
+{self.think.prompt}\
+{self.memory.prompt}\
+{self.criticise.prompt}\
+"""
+        )
+        if self.flags.use_abstract_example:
+            prompt.add_text(self._abstract_example())
+        if self.flags.use_concrete_example:
+            prompt.add_text(self._concrete_example())
+        prompt.add_cache_breakpoint()
+
+        instructions = self.instructions.prompt
+        if isinstance(instructions, str):
+            instructions = [dict(type="text", text=instructions)]
+        prompt["content"] += instructions
+        prompt.add_cache_breakpoint()
+
+        prompt.add_text(
+            f"""\
+{self.history.prompt}\
+{self.obs.prompt}\
+{self.plan.prompt}\
+"""
+        )
+        return self.obs.add_screenshot(prompt)
+
+    def _abstract_example(self) -> str:
+        return f"""
 # Abstract Example
 
 Here is an abstract version of the answer with description of the content of
@@ -131,11 +182,9 @@ answer:
 {self.criticise.abstract_ex}\
 {self.action_prompt.abstract_ex}\
 """
-            )
 
-        if self.flags.use_concrete_example:
-            prompt.add_text(
-                f"""
+    def _concrete_example(self) -> str:
+        return f"""
 # Concrete Example
 
 Here is a concrete example of how to format your answer.
@@ -146,8 +195,6 @@ Make sure to follow the template with proper tags:
 {self.criticise.concrete_ex}\
 {self.action_prompt.concrete_ex}\
 """
-            )
-        return self.obs.add_screenshot(prompt)
 
     def shrink(self):
         self.history.shrink()
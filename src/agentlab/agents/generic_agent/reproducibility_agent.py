@@ -14,7 +14,6 @@ answers. Load the this reproducibility study in agent-xray to compare the result
 import difflib
 import logging
 import time
-from copy import copy
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -47,7 +46,11 @@ class ReproChatModel:
         self.delay = delay
 
     def __call__(self, messages: list | Discussion):
-        self.new_messages = copy(messages)
+        # only the list of messages is copied, the messages are shared with the agent
+        if isinstance(messages, Discussion):
+            self.new_messages = messages.copy()
+        else:
+            self.new_messages = list(messages)
 
         if len(messages) >= len(self.old_messages):
             # if for some reason the llm response was not saved
@@ -1,14 +1,19 @@
+import json
 import logging
 import os
+import pickle
 import signal
 import sys
 from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from time import sleep, time
 
-from browsergym.experiments.loop import ExpArgs, yield_all_exp_results
+from browsergym.experiments.loop import EnvArgs, ExpArgs, yield_all_exp_results
 from tqdm import tqdm
 
+from agentlab.llm.tokenizer_registry import warm_up_tokenizers
+
 logger = logging.getLogger(__name__)  # Get logger based on module name
 
 
@@ -31,7 +36,19 @@ def run_exp(exp_arg: ExpArgs, *dependencies, avg_step_timeout=60):
     # logger.warning(f"Running {exp_arg.exp_id} with timeout of {episode_timeout} seconds.")
     # with timeout_manager(seconds=episode_timeout):
     # this timeout method is not robust enough. using ray.cancel instead
-    return exp_arg.run()
+    chat_model_args = getattr(getattr(exp_arg, "agent_args", None), "chat_model_args", None)
+    warm_up_tokenizers([getattr(chat_model_args, "model_name", None)])
+    result = exp_arg.run()
+
+    exp_dir = getattr(exp_arg, "exp_dir", None)
+    if exp_dir is not None and not getattr(exp_arg, "is_dummy", False):
+        from agentlab.experiments.results_log import append_result
+
+        try:
+            append_result(exp_dir)
+        except Exception as e:
+            logger.warning(f"Could not append the results of {exp_dir} to the results log: {e}")
+    return result
 
 
 def _episode_timeout(exp_arg: ExpArgs, avg_step_timeout=60):
@@ -152,6 +169,47 @@ class MockedExpArgs:
         return self
 
 
+class MockedAgentArgs:
+    agent_name = "mocked_agent"
+
+    def prepare(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@dataclass
+class MockedEpisodeExpArgs(ExpArgs):
+    """Writes the directory and the results of an episode, to test the relaunch of studies.
+
+    With fail_once, the first trial of the experiment ends with an error.
+    """
+
+    fail_once: bool = False
+    is_dummy = False
+
+    def prepare(self, exp_root):
+        self.exp_name = self.exp_name or f"exp_{self.exp_id}"
+        n_trials = len(list(Path(exp_root).glob(f"{self.exp_name}_*")))
+        self.exp_dir = Path(exp_root) / f"{self.exp_name}_{n_trials}"
+        self.exp_dir.mkdir()
+        with open(self.exp_dir / "exp_args.pkl", "wb") as f:
+            pickle.dump(self, f)
+
+    def run(self):
+        failed = self.fail_once and self.exp_dir.name.endswith("_0")
+        summary_info = {
+            "cum_reward": 0 if failed else 1,
+            "n_steps": 1,
+            "err_msg": "Error" if failed else None,
+            "terminated": not failed,
+            "truncated": False,
+        }
+        (self.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+        return self
+
+
 def make_seeds(n, offset=42):
     raise DeprecationWarning("This function will be removed. Comment out this error if needed.")
     return [seed + offset for seed in range(n)]
@@ -2,25 +2,90 @@
 
 # # Disable Ray log deduplication
 # os.environ["RAY_DEDUP_LOGS"] = "0"
+import asyncio
+import heapq
 import logging
 import time
+from collections import defaultdict
 
 import bgym
 import ray
-from ray.util import state
 
-from agentlab.experiments.exp_utils import _episode_timeout, run_exp
+from agentlab.experiments.exp_utils import _episode_timeout
+from agentlab.experiments.exp_utils import run_exp as _run_exp
+from agentlab.experiments.scheduling import plan_schedule
 
 logger = logging.getLogger(__name__)
 
-run_exp = ray.remote(run_exp)
 
+@ray.remote
+class TaskMonitor:
+    """Collects the start time of the tasks, reported by the tasks themselves.
 
-def execute_task_graph(exp_args_list: list[bgym.ExpArgs], avg_step_timeout=60):
-    """Execute a task graph in parallel while respecting dependencies using Ray."""
+    The driver waits for the new start times with a single pending call to wait_for_starts, instead
+    of querying the state of every task.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._new_starts = asyncio.Event()
+
+    async def task_started(self, task_id: str, start_time: float):
+        self._starts.append((task_id, start_time))
+        self._new_starts.set()
+
+    async def wait_for_starts(self, timeout: float = None) -> list[tuple[str, float]]:
+        """Return the (task_id, start_time) reported since the last call, waiting for at least one."""
+        if not self._starts:
+            try:
+                await asyncio.wait_for(self._new_starts.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        starts, self._starts = self._starts, []
+        self._new_starts.clear()
+        return starts
+
+
+@ray.remote
+def run_exp(exp_arg: bgym.ExpArgs, *dependencies, avg_step_timeout=60, monitor=None):
+    """Run the experiment, after reporting its start time to the monitor."""
+    if monitor is not None:
+        monitor.task_started.remote(exp_arg.exp_id, time.time())
+    return _run_exp(exp_arg, *dependencies, avg_step_timeout=avg_step_timeout)
+
+
+def execute_task_graph(
+    exp_args_list: list[bgym.ExpArgs],
+    avg_step_timeout=60,
+    n_workers: int = None,
+    task_durations: dict[str, float] = None,
+):
+    """Execute a task graph in parallel while respecting dependencies using Ray.
+
+    Ray doesn't follow the priorities of plan_schedule, the expected makespan is only logged to
+    compare with the ray_pool backend.
+
+    Args:
+        exp_args_list: list[ExpArgs]
+            The experiments to run, with their depends_on set.
+        avg_step_timeout: int
+            Average time per step, used to compute the timeout of each episode.
+        n_workers: int
+            Number of experiments running in parallel, for the expected makespan. Defaults to the
+            number of CPUs of the Ray cluster.
+        task_durations: dict[str, float]
+            Past duration of each task, see scheduling.load_task_durations.
+
+    Returns:
+        dict[str, Any]: Dictionary of exp_id: result, or the exception raised by the experiment
+    """
+    if n_workers is None:
+        n_workers = int(ray.cluster_resources().get("CPU", 1))
+    plan_schedule(exp_args_list, n_workers, task_durations)
 
     exp_args_map = {exp_args.exp_id: exp_args for exp_args in exp_args_list}
     task_map = {}
+    monitor = TaskMonitor.remote()
 
     def get_task(exp_arg: bgym.ExpArgs):
         if exp_arg.exp_id not in task_map:
@@ -29,7 +94,7 @@ def execute_task_graph(exp_args_list: list[bgym.ExpArgs], avg_step_timeout=60):
 
             # Create new task that depends on the dependency results
             task_map[exp_arg.exp_id] = run_exp.options(name=f"{exp_arg.exp_name}").remote(
-                exp_arg, *dependency_tasks, avg_step_timeout=avg_step_timeout
+                exp_arg, *dependency_tasks, avg_step_timeout=avg_step_timeout, monitor=monitor
             )
         return task_map[exp_arg.exp_id]
 
@@ -37,65 +102,305 @@ def execute_task_graph(exp_args_list: list[bgym.ExpArgs], avg_step_timeout=60):
     for exp_arg in exp_args_list:
         get_task(exp_arg)
 
-    max_timeout = max([_episode_timeout(exp_args, avg_step_timeout) for exp_args in exp_args_list])
+    timeouts = {
+        exp_args.exp_id: _episode_timeout(exp_args, avg_step_timeout) for exp_args in exp_args_list
+    }
 
-    return poll_for_timeout(task_map, max_timeout, poll_interval=max_timeout * 0.1)
+    try:
+        return monitor_tasks(task_map, timeouts, monitor)
+    finally:
+        ray.kill(monitor)
 
 
-def poll_for_timeout(tasks: dict[str, ray.ObjectRef], timeout: float, poll_interval: float = 1.0):
-    """Cancel tasks that exceeds the timeout
+def monitor_tasks(
+    tasks: dict[str, ray.ObjectRef],
+    timeouts: dict[str, float],
+    monitor: "ray.actor.ActorHandle",
+    grace_period: float = 60,
+):
+    """Wait for the tasks to finish and cancel the ones that exceed their timeout.
 
-    I tried various different methods for killing a job that hangs. so far it's
-    the only one that seems to work reliably (hopefully)
+    The deadlines of the running tasks are kept in a heap, from the start times reported to the
+    monitor, and the driver sleeps until the next deadline, the next start or the next task
+    completion. A task exceeding its deadline is cancelled, and force killed if it is still running
+    after the grace period. I tried various different methods for killing a job that hangs, so far
+    ray.cancel is the only one that seems to work reliably.
 
     Args:
         tasks: dict[str, ray.ObjectRef]
             Dictionary of task_id: task_ref
-        timeout: float
-            Timeout in seconds
-        poll_interval: float
-            Polling interval in seconds
+        timeouts: dict[str, float]
+            Dictionary of task_id: timeout in seconds, counted from the start of the task
+        monitor: ray.actor.ActorHandle
+            The TaskMonitor to which the tasks report their start time
+        grace_period: float
+            Time in seconds given to a cancelled task before force killing it
 
     Returns:
-        dict[str, Any]: Dictionary of task_id: result
+        dict[str, Any]: Dictionary of task_id: result, or the exception raised by the task
+    """
+    pending = {task_ref: task_id for task_id, task_ref in tasks.items()}
+    results = {}
+    # (deadline, task_id, force)
+    deadlines = []
+
+    max_timeout = max(timeouts.values(), default=0)
+    logger.warning(f"Any task exceeding {max_timeout} seconds will be cancelled.")
+
+    starts_ref = monitor.wait_for_starts.remote()
+    while pending:
+        timeout = max(0, deadlines[0][0] - time.time()) if deadlines else None
+        ready, _ = ray.wait(
+            [starts_ref, *pending], num_returns=1, timeout=timeout, fetch_local=False
+        )
+
+        if ready:
+            # collect everything that is ready, not only the first one
+            ready, _ = ray.wait(
+                [starts_ref, *pending], num_returns=len(pending) + 1, timeout=0, fetch_local=False
+            )
+        for ref in ready:
+            if ref == starts_ref:
+                for task_id, start_time in ray.get(starts_ref):
+                    if task_id not in results:
+                        heapq.heappush(deadlines, (start_time + timeouts[task_id], task_id, False))
+                starts_ref = monitor.wait_for_starts.remote()
+                continue
+            task_id = pending.pop(ref)
+            try:
+                results[task_id] = ray.get(ref)
+            except Exception as e:
+                results[task_id] = e
+
+        now = time.time()
+        while deadlines and deadlines[0][0] <= now:
+            deadline, task_id, force = heapq.heappop(deadlines)
+            if task_id in results:
+                continue
+            msg = f"Task {task_id} exceeded its timeout of {timeouts[task_id]}s."
+            if force:
+                logger.warning(msg + " Force killing.")
+                ray.cancel(tasks[task_id], force=True, recursive=False)
+            else:
+                logger.warning(msg + " Cancelling task.")
+                ray.cancel(tasks[task_id], force=False, recursive=False)
+                heapq.heappush(deadlines, (deadline + grace_period, task_id, True))
+
+    return {task_id: results[task_id] for task_id in tasks}
+
+
+@ray.remote(num_cpus=1)
+class ExpWorker:
+    """A long-lived worker running experiments one after the other.
+
+    The imports, the Playwright instance of browsergym, the tokenizers and the clients cached by the
+    process (e.g. the Neo4j drivers and embedding cache of graph grounding) stay warm across
+    episodes, instead of being created again by each task.
+    """
+
+    def run(self, exp_arg: bgym.ExpArgs, avg_step_timeout=60):
+        return _run_exp(exp_arg, avg_step_timeout=avg_step_timeout)
+
+
+class ExpWorkerPool:
+    """A pool of persistent ExpWorker actors running a graph of experiments that can grow.
+
+    An experiment is sent to an idle worker once all its dependencies are finished, the ready
+    experiments with the highest priority first. The experiments depending on a failed one are not
+    run and get its error. A worker running an experiment past its timeout is killed and replaced
+    by a new one, as running actor tasks can't be cancelled, and so is a worker that died (e.g.
+    killed by the OOM killer). New experiments can be added while others are running, so the
+    workers don't wait for a whole graph to finish.
+
+    Args:
+        n_workers: int
+            Number of workers in the pool.
+        avg_step_timeout: int
+            Average time per step, used to compute the timeout of each episode.
     """
-    task_list = list(tasks.values())
-    task_ids = list(tasks.keys())
-
-    logger.warning(f"Any task exceeding {timeout} seconds will be cancelled.")
-
-    while True:
-        ready, not_ready = ray.wait(task_list, num_returns=len(task_list), timeout=poll_interval)
-        for task in not_ready:
-            elapsed_time = get_elapsed_time(task)
-            # print(f"Task {task.task_id().hex()} elapsed time: {elapsed_time}")
-            if elapsed_time is not None and elapsed_time > timeout:
-                msg = f"Task {task.task_id().hex()} hase been running for {elapsed_time}s, more than the timeout: {timeout}s."
-                if elapsed_time < timeout + 60 + poll_interval:
-                    logger.warning(msg + " Cancelling task.")
-                    ray.cancel(task, force=False, recursive=False)
+
+    def __init__(self, n_workers: int, avg_step_timeout=60):
+        self.avg_step_timeout = avg_step_timeout
+        self.idle_workers = [ExpWorker.remote() for _ in range(n_workers)]
+        self.exp_args_map = {}
+        self.avg_step_timeouts = {}
+        self.timeouts = {}
+        self.sort_keys = {}
+        self.dependents = defaultdict(list)
+        self.n_pending_dependencies = {}
+        self.results = {}
+        self.unfinished = set()
+        # (sort key, exp_id) of the experiments whose dependencies are finished
+        self.ready = []
+        # task_ref: (exp_id, worker)
+        self.running = {}
+        # (deadline, exp_id, task_ref)
+        self.deadlines = []
+        self._n_added = 0
+
+    @property
+    def n_unfinished(self) -> int:
+        return len(self.unfinished)
+
+    def add(
+        self, exp_args_list: list[bgym.ExpArgs], priorities: dict[str, float], avg_step_timeout=None
+    ):
+        """Add experiments to run, closed under their dependencies.
+
+        Args:
+            exp_args_list: list[ExpArgs]
+                The experiments, with their depends_on set. An experiment added again (e.g.
+                relaunched) replaces the previous one.
+            priorities: dict[str, float]
+                The priority of each experiment, by exp_id, see scheduling.plan_schedule.
+            avg_step_timeout: int
+                Average time per step of these experiments, defaults to the one of the pool.
+        """
+        avg_step_timeout = avg_step_timeout or self.avg_step_timeout
+        for exp_args in exp_args_list:
+            exp_id = exp_args.exp_id
+            self.exp_args_map[exp_id] = exp_args
+            self.avg_step_timeouts[exp_id] = avg_step_timeout
+            self.timeouts[exp_id] = _episode_timeout(exp_args, avg_step_timeout)
+            # by priority, then in the order they were added
+            self.sort_keys[exp_id] = (-priorities[exp_id], self._n_added)
+            self._n_added += 1
+            self.dependents[exp_id] = []
+            self.results.pop(exp_id, None)
+            self.unfinished.add(exp_id)
+
+        for exp_args in exp_args_list:
+            for dep_key in exp_args.depends_on:
+                self.dependents[dep_key].append(exp_args.exp_id)
+            self.n_pending_dependencies[exp_args.exp_id] = len(exp_args.depends_on)
+            if not exp_args.depends_on:
+                heapq.heappush(self.ready, (self.sort_keys[exp_args.exp_id], exp_args.exp_id))
+        self._dispatch()
+
+    def wait(self, timeout: float = None) -> dict:
+        """Wait for experiments to finish, at most until the next deadline or the timeout.
+
+        Returns:
+            dict[str, Any]: The experiments finished since the last call, exp_id: result, or the
+                exception raised by the experiment
+        """
+        finished = {}
+        if not self.running:
+            return finished
+
+        wait_timeout = max(0, self.deadlines[0][0] - time.time())
+        if timeout is not None:
+            wait_timeout = min(wait_timeout, timeout)
+        done, _ = ray.wait(
+            list(self.running), num_returns=1, timeout=wait_timeout, fetch_local=False
+        )
+        for task_ref in done:
+            exp_id, worker = self.running.pop(task_ref)
+            try:
+                result = ray.get(task_ref)
+            except ray.exceptions.RayActorError as e:
+                # e.g. killed by the OOM killer, or by a crash of the browser
+                logger.warning(f"The worker of task {exp_id} died. Replacing it.")
+                ray.kill(worker)
+                worker = ExpWorker.remote()
+                result = e
+            except Exception as e:
+                result = e
+            self.idle_workers.append(worker)
+            self._finish(exp_id, result, finished)
+
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, exp_id, task_ref = heapq.heappop(self.deadlines)
+            if task_ref not in self.running:
+                continue
+            _, worker = self.running.pop(task_ref)
+            msg = f"Task {exp_id} exceeded its timeout of {self.timeouts[exp_id]}s."
+            logger.warning(msg + " Killing its worker.")
+            ray.kill(worker)
+            self.idle_workers.append(ExpWorker.remote())
+            self._finish(exp_id, TimeoutError(msg), finished)
+
+        self._dispatch()
+        return finished
+
+    def close(self):
+        for worker in self.idle_workers + [worker for _, worker in self.running.values()]:
+            ray.kill(worker)
+        self.idle_workers = []
+        self.running = {}
+
+    def _dispatch(self):
+        while self.ready and self.idle_workers:
+            _, exp_id = heapq.heappop(self.ready)
+            exp_args = self.exp_args_map[exp_id]
+            worker = self.idle_workers.pop()
+            task_ref = worker.run.options(name=exp_args.exp_name).remote(
+                exp_args, avg_step_timeout=self.avg_step_timeouts[exp_id]
+            )
+            self.running[task_ref] = (exp_id, worker)
+            heapq.heappush(self.deadlines, (time.time() + self.timeouts[exp_id], exp_id, task_ref))
+
+    def _finish(self, exp_id, result, finished: dict):
+        to_finish = [(exp_id, result)]
+        while to_finish:
+            exp_id, result = to_finish.pop()
+            self.results[exp_id] = result
+            self.unfinished.discard(exp_id)
+            finished[exp_id] = result
+            for dependent in self.dependents[exp_id]:
+                self.n_pending_dependencies[dependent] -= 1
+                if self.n_pending_dependencies[dependent] > 0:
+                    continue
+                errors = [
+                    self.results[dep_key]
+                    for dep_key in self.exp_args_map[dependent].depends_on
+                    if isinstance(self.results[dep_key], Exception)
+                ]
+                if errors:
+                    to_finish.append((dependent, errors[0]))
                 else:
-                    logger.warning(msg + " Force killing.")
-                    ray.cancel(task, force=True, recursive=False)
-        if len(ready) == len(task_list):
-            results = []
-            for task in ready:
-                try:
-                    result = ray.get(task)
-                except Exception as e:
-                    result = e
-                results.append(result)
-
-            return {task_id: result for task_id, result in zip(task_ids, results)}
-
-
-def get_elapsed_time(task_ref: ray.ObjectRef):
-    task_id = task_ref.task_id().hex()
-    task_info = state.get_task(task_id, address="auto")
-    if task_info and task_info.start_time_ms is not None:
-        start_time_s = task_info.start_time_ms / 1000.0  # Convert ms to s
-        current_time_s = time.time()
-        elapsed_time = current_time_s - start_time_s
-        return elapsed_time
-    else:
-        return None  # Task has not started yet
+                    heapq.heappush(self.ready, (self.sort_keys[dependent], dependent))
+
+
+def execute_task_graph_with_pool(
+    exp_args_list: list[bgym.ExpArgs],
+    n_workers: int,
+    avg_step_timeout=60,
+    task_durations: dict[str, float] = None,
+):
+    """Execute a task graph on a pool of persistent Ray workers while respecting dependencies.
+
+    The ready experiments with the longest chain of dependents (weighted by task_durations) are
+    run first, see ExpWorkerPool. Like with execute_task_graph, the experiments depending on a
+    failed one are not run and get its error.
+
+    Args:
+        exp_args_list: list[ExpArgs]
+            The experiments to run, with their depends_on set.
+        n_workers: int
+            Number of workers in the pool.
+        avg_step_timeout: int
+            Average time per step, used to compute the timeout of each episode.
+        task_durations: dict[str, float]
+            Past duration of each task, see scheduling.load_task_durations. If None, all experiments
+            are assumed to take the same time.
+
+    Returns:
+        dict[str, Any]: Dictionary of exp_id: result, or the exception raised by the experiment
+
+    Raises:
+        ValueError: If the dependencies are unknown or circular.
+    """
+    priorities = plan_schedule(exp_args_list, n_workers, task_durations)
+
+    pool = ExpWorkerPool(min(n_workers, len(exp_args_list)), avg_step_timeout)
+    results = {}
+    try:
+        pool.add(exp_args_list, priorities)
+        while pool.n_unfinished:
+            results.update(pool.wait())
+    finally:
+        pool.close()
+
+    return {exp_args.exp_id: results[exp_args.exp_id] for exp_args in exp_args_list}
@@ -6,6 +6,7 @@ import bgym
 from browsergym.experiments.loop import ExpArgs, yield_all_exp_results
 
 from agentlab.experiments.exp_utils import run_exp
+from agentlab.experiments.results_log import ResultsLog
 
 
 def run_experiments(
@@ -14,6 +15,7 @@ def run_experiments(
     study_dir,
     parallel_backend="ray",
     avg_step_timeout=60,
+    task_durations: dict[str, float] = None,
 ):
     """Run a list of ExpArgs in parallel.
 
@@ -28,10 +30,16 @@ def run_experiments(
         study_dir: Path
             Directory where the experiments will be saved.
         parallel_backend: str
-            Parallel backend to use. Either "joblib", "ray" or "sequential".
-            The only backend that supports webarena graph dependencies correctly is ray or sequential.
+            Parallel backend to use. Either "joblib", "ray", "ray_pool" or "sequential".
+            The only backends that support webarena graph dependencies correctly are ray, ray_pool
+            or sequential. ray_pool runs the experiments on persistent workers, which keep their
+            browser driver and clients warm across episodes.
         avg_step_timeout: int
             Will raise a TimeoutError if the episode is not finished after env_args.max_steps * avg_step_timeout seconds.
+        task_durations: dict[str, float]
+            Past duration of each task, used by the ray_pool backend to start the longest chains of
+            dependencies first, and by the ray backends to log the expected makespan. See
+            scheduling.load_task_durations.
 
     Raises:
         ValueError: If the parallel_backend is not recognized.
@@ -84,7 +92,25 @@ def run_experiments(
 
             ray.init(num_cpus=n_jobs)
             try:
-                execute_task_graph(exp_args_list, avg_step_timeout=avg_step_timeout)
+                execute_task_graph(
+                    exp_args_list,
+                    avg_step_timeout=avg_step_timeout,
+                    n_workers=n_jobs,
+                    task_durations=task_durations,
+                )
+            finally:
+                ray.shutdown()
+        elif parallel_backend == "ray_pool":
+            from agentlab.experiments.graph_execution_ray import execute_task_graph_with_pool, ray
+
+            ray.init(num_cpus=n_jobs)
+            try:
+                execute_task_graph_with_pool(
+                    exp_args_list,
+                    n_workers=n_jobs,
+                    avg_step_timeout=avg_step_timeout,
+                    task_durations=task_durations,
+                )
             finally:
                 ray.shutdown()
         elif parallel_backend == "sequential":
@@ -150,6 +176,32 @@ def find_incomplete(study_dir: str | Path, include_errors=True):
     return exp_args_list
 
 
+def find_incomplete_from_log(
+    exp_args_list: list[ExpArgs], results_log: ResultsLog, include_errors=True
+):
+    """Find the incomplete experiments of a list, from the results log of the study.
+
+    Unlike find_incomplete, the experiment directories are not reloaded. Completed experiments are
+    replaced by dummy exp_args in the same way.
+
+    Args:
+        exp_args_list: list[ExpArgs]
+            The experiments of the study, prepared in its directory.
+        results_log: ResultsLog
+            The results log of the study, updated with the last results.
+        include_errors: bool
+            If True, experiments that errored are relaunched too.
+
+    Returns:
+        list[ExpArgs]
+            List of ExpArgs objects to relaunch.
+    """
+    return [
+        _hide_if_completed(exp_args, results_log.status(exp_args), include_errors)
+        for exp_args in exp_args_list
+    ]
+
+
 def non_dummy_count(exp_args_list: list[ExpArgs]) -> int:
     return sum([not exp_args.is_dummy for exp_args in exp_args_list])
 
@@ -175,15 +227,18 @@ def _hide_completed(exp_result: bgym.ExpResult, include_errors: bool = True):
             The ExpArgs object hidden if the experiment is completed.
     """
 
+    return _hide_if_completed(exp_result.exp_args, exp_result.status, include_errors)
+
+
+def _hide_if_completed(exp_args: ExpArgs, status: str, include_errors: bool = True):
     hide = False
-    if exp_result.status == "done":
+    if status == "done":
         hide = True
-    if exp_result.status == "error" and (not include_errors):
+    if status == "error" and (not include_errors):
         hide = True
 
-    exp_args = exp_result.exp_args
     exp_args.is_dummy = hide  # just to keep track
-    exp_args.status = exp_result.status
+    exp_args.status = status
     if hide:
         # make those function do nothing since they are finished.
         exp_args.run = noop
@@ -0,0 +1,144 @@
+"""
+Append-only log of the results of a study.
+
+Each experiment appends its record (flattened exp_args and summary_info) to a JSONL file in the
+study directory as soon as it finishes. The summary of the study and the search for incomplete
+experiments are then folds over the new lines of the log, instead of reloading every experiment
+directory after each trial.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+from browsergym.experiments.loop import get_exp_result
+
+logger = logging.getLogger(__name__)
+
+RESULTS_LOG_NAME = "results_log.jsonl"
+
+
+def append_result(exp_dir: str | Path):
+    """Append the record of a finished experiment to the results log of its study.
+
+    The record is written in a single write to a file opened in append mode, so that the workers of
+    a study can log concurrently.
+    """
+    exp_dir = Path(exp_dir)
+    record = get_exp_result(exp_dir).get_exp_record()
+    line = json.dumps(record, default=str) + "\n"
+    with open(exp_dir.parent / RESULTS_LOG_NAME, "a") as f:
+        f.write(line)
+
+
+def _to_hashable(value):
+    """JSON turns the tuples of the records into lists, turn them back for pandas."""
+    if isinstance(value, list):
+        return tuple(_to_hashable(item) for item in value)
+    return value
+
+
+class ResultsLog:
+    """Incremental view of the results log of a study.
+
+    Args:
+        study_dir: Path
+            The directory of the study.
+    """
+
+    def __init__(self, study_dir: str | Path):
+        self.path = Path(study_dir) / RESULTS_LOG_NAME
+        self.records: dict[str, dict] = {}
+        self._offset = 0
+
+    def update(self) -> int:
+        """Read the records appended since the last update. Returns the number of new records."""
+        if not self.path.exists():
+            return 0
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # an experiment may be writing its record, keep the incomplete last line for the next update
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+
+        n_new = 0
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping a corrupted line of {self.path}.")
+                continue
+            record = {key: _to_hashable(value) for key, value in record.items()}
+            record["exp_dir"] = Path(record["exp_dir"])
+            # the last record of a relaunched experiment replaces the previous ones
+            self.records[record["exp_id"]] = record
+            n_new += 1
+        return n_new
+
+    def get_record(self, exp_args) -> dict | None:
+        """The last record of an experiment, or None if it is not from its current directory.
+
+        A relaunched experiment gets a new directory (the previous one is renamed), so the records
+        of its previous trials are ignored.
+        """
+        record = self.records.get(exp_args.exp_id)
+        exp_dir = getattr(exp_args, "exp_dir", None)
+        if record is None or exp_dir is None:
+            return None
+        if record["exp_dir"] != Path(exp_dir):
+            return None
+        return record
+
+    def status(self, exp_args) -> str:
+        """Status of an experiment, like ExpResult.status: "done", "error" or "incomplete".
+
+        Experiments without record for their current directory, e.g. killed before logging their
+        result, get the status of their directory.
+        """
+        record = self.get_record(exp_args)
+        if record is None:
+            exp_dir = getattr(exp_args, "exp_dir", None)
+            return "incomplete" if exp_dir is None else get_exp_result(exp_dir).status
+        if record.get("err_msg", None) is not None:
+            return "error"
+        if record.get("terminated", False) or record.get("truncated", False):
+            return "done"
+        return "incomplete"
+
+    def result_df(self, exp_args_list: list = None, set_index=True) -> pd.DataFrame:
+        """The result dataframe of the study, like inspect_results.load_result_df.
+
+        Args:
+            exp_args_list: list[ExpArgs]
+                The experiments of the study. The ones without record for their current directory
+                are loaded from it, so that they are counted as incomplete. If None, only the
+                records of the log are used.
+            set_index: bool
+                If True, set the index to env.task_name and the variables of the agent.
+
+        Returns:
+            pd.DataFrame: The result dataframe, or None if there are no results.
+        """
+        if exp_args_list is None:
+            records = list(self.records.values())
+        else:
+            records = [
+                self.get_record(exp_args) or get_exp_result(exp_args.exp_dir).get_exp_record()
+                for exp_args in exp_args_list
+            ]
+        if len(records) == 0:
+            return None
+
+        # inspect_results is slow to import, the workers only append to the log
+        from agentlab.analyze import inspect_results
+
+        df = pd.DataFrame(records)
+        df.columns = [col.replace("_args", "") for col in df.columns]
+        if set_index:
+            inspect_results.set_index_from_variables(df)
+        return df
@@ -0,0 +1,277 @@
+"""
+Critical-path scheduling of a graph of experiments on a limited number of workers or servers.
+
+Each experiment gets the duration of the longest chain of experiments starting with it (its critical
+path), using the durations of the same tasks in past studies. Dispatching the ready experiments by
+decreasing critical path starts the long chains of dependencies (e.g. on WebArena) first, so they
+don't end up dominating the makespan.
+"""
+
+import heapq
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from agentlab.analyze import inspect_results
+
+logger = logging.getLogger(__name__)
+
+# duration of an experiment when no past duration is known, only the ratios between durations matter
+DEFAULT_DURATION = 1.0
+
+# time spent in the environment and in the agent during an episode
+ELAPSED_COLUMNS = ("stats.cum_step_elapsed", "stats.cum_agent_elapsed")
+
+
+def load_task_durations(study_dirs: list[str | Path]) -> dict[str, float]:
+    """Median duration in seconds of each task over the episodes of past studies."""
+    durations = {}
+    for study_dir in study_dirs:
+        result_df = inspect_results.load_result_df(study_dir, progress_fn=None, set_index=False)
+        if result_df is None:
+            continue
+        columns = [col for col in ELAPSED_COLUMNS if col in result_df.columns]
+        if not columns:
+            continue
+        elapsed = result_df[columns].sum(axis=1, min_count=1)
+        for task_name, duration in zip(result_df[inspect_results.TASK_KEY], elapsed):
+            if np.isfinite(duration) and duration > 0:
+                durations.setdefault(task_name, []).append(duration)
+    return {task_name: float(np.median(values)) for task_name, values in durations.items()}
+
+
+def estimate_durations(exp_args_list: list, task_durations: dict[str, float] = None):
+    """Expected duration of each experiment, by exp_id.
+
+    Experiments of a task without past duration get the median of the known durations. The dummy
+    experiments left by find_incomplete have nothing to run and take no time.
+    """
+    task_durations = task_durations or {}
+    default = DEFAULT_DURATION
+    if task_durations:
+        default = float(np.median(list(task_durations.values())))
+
+    durations = {}
+    for exp_args in exp_args_list:
+        if getattr(exp_args, "is_dummy", False):
+            durations[exp_args.exp_id] = 0.0
+        else:
+            task_name = getattr(getattr(exp_args, "env_args", None), "task_name", None)
+            durations[exp_args.exp_id] = task_durations.get(task_name, default)
+    return durations
+
+
+def critical_path_priorities(exp_args_list: list, durations: dict[str, float]) -> dict[str, float]:
+    """Duration of the longest chain of experiments starting with each experiment.
+
+    Raises:
+        ValueError: If the dependencies are unknown or circular.
+    """
+    exp_args_map = {exp_args.exp_id: exp_args for exp_args in exp_args_list}
+    n_dependents = {exp_id: 0 for exp_id in exp_args_map}
+    for exp_args in exp_args_list:
+        for dep_key in exp_args.depends_on:
+            if dep_key not in exp_args_map:
+                raise ValueError(f"Unknown dependency {dep_key} of {exp_args.exp_id}.")
+            n_dependents[dep_key] += 1
+
+    # from the experiments without dependents up to their dependencies
+    priorities = {exp_id: durations[exp_id] for exp_id in exp_args_map}
+    stack = [exp_id for exp_id, count in n_dependents.items() if count == 0]
+    n_visited = 0
+    while stack:
+        exp_id = stack.pop()
+        n_visited += 1
+        for dep_key in exp_args_map[exp_id].depends_on:
+            priorities[dep_key] = max(priorities[dep_key], durations[dep_key] + priorities[exp_id])
+            n_dependents[dep_key] -= 1
+            if n_dependents[dep_key] == 0:
+                stack.append(dep_key)
+
+    if n_visited < len(exp_args_map):
+        raise ValueError("Circular dependencies between the experiments.")
+    return priorities
+
+
+def expected_makespan(
+    exp_args_list: list, durations: dict[str, float], priorities: dict[str, float], n_workers: int
+) -> float:
+    """Simulate the dispatch of the experiments by priority on n_workers and return its duration."""
+    remaining = {exp_args.exp_id: len(exp_args.depends_on) for exp_args in exp_args_list}
+    dependents = {exp_args.exp_id: [] for exp_args in exp_args_list}
+    for exp_args in exp_args_list:
+        for dep_key in exp_args.depends_on:
+            dependents[dep_key].append(exp_args.exp_id)
+
+    ready = [(-priorities[exp_id], exp_id) for exp_id, count in remaining.items() if count == 0]
+    heapq.heapify(ready)
+    # (end time, exp_id)
+    running = []
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < n_workers:
+            _, exp_id = heapq.heappop(ready)
+            heapq.heappush(running, (now + durations[exp_id], exp_id))
+        now, exp_id = heapq.heappop(running)
+        for dependent in dependents[exp_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, (-priorities[dependent], dependent))
+    return now
+
+
+def plan_schedule(exp_args_list: list, n_workers: int, task_durations: dict[str, float] = None):
+    """Compute the priorities of the experiments and log the expected makespan.
+
+    Args:
+        exp_args_list: list[ExpArgs]
+            The experiments to run, with their depends_on set.
+        n_workers: int
+            Number of experiments running in parallel.
+        task_durations: dict[str, float]
+            Past duration of each task, e.g. from load_task_durations. If None, all experiments are
+            assumed to take the same time.
+
+    Returns:
+        dict[str, float]: The priority of each experiment, by exp_id.
+    """
+    durations = estimate_durations(exp_args_list, task_durations)
+    priorities = critical_path_priorities(exp_args_list, durations)
+    if exp_args_list:
+        makespan = expected_makespan(exp_args_list, durations, priorities, n_workers)
+        unit = "s" if task_durations else " episodes"
+        logger.warning(
+            f"Expected makespan on {n_workers} workers: {makespan:.0f}{unit}, "
+            f"longest chain of dependencies: {max(priorities.values()):.0f}{unit}, "
+            f"total work: {sum(durations.values()):.0f}{unit}."
+        )
+    return priorities
+
+
+def split_components(exp_args_list: list) -> list[list]:
+    """Split experiments into the groups connected by their dependencies, keeping their order."""
+    exp_ids = [exp_args.exp_id for exp_args in exp_args_list]
+    parents = {exp_id: exp_id for exp_id in exp_ids}
+
+    def find(exp_id):
+        while parents[exp_id] != exp_id:
+            parents[exp_id] = parents[parents[exp_id]]
+            exp_id = parents[exp_id]
+        return exp_id
+
+    for exp_args in exp_args_list:
+        for dep_key in exp_args.depends_on:
+            parents[find(dep_key)] = find(exp_args.exp_id)
+
+    components = {}
+    for exp_args in exp_args_list:
+        components.setdefault(find(exp_args.exp_id), []).append(exp_args)
+    return list(components.values())
+
+
+@dataclass
+class WorkUnit:
+    """Experiments of a study that can run on any server, as they don't depend on the others."""
+
+    study_idx: int
+    exp_args_list: list
+    work: float
+    priority: float
+    # set when the unit is relaunched, the finished experiments may have changed the server
+    needs_reset: bool = False
+
+
+def make_work_units(
+    exp_args_list: list, n_units: int, study_idx: int = 0, task_durations: dict[str, float] = None
+) -> list[WorkUnit]:
+    """Pack the dependency components of a study into at most n_units balanced work units.
+
+    Args:
+        exp_args_list: list[ExpArgs]
+            The experiments of the study, with their depends_on set.
+        n_units: int
+            Maximum number of work units.
+        study_idx: int
+            Index of the study, stored in the work units.
+        task_durations: dict[str, float]
+            Past duration of each task, see load_task_durations.
+
+    Returns:
+        list[WorkUnit]: The work units, by decreasing priority.
+    """
+    durations = estimate_durations(exp_args_list, task_durations)
+    priorities = critical_path_priorities(exp_args_list, durations)
+
+    components = split_components(exp_args_list)
+    # longest processing time first, each component goes to the least loaded unit
+    components.sort(key=lambda component: -sum(durations[e.exp_id] for e in component))
+    units = [WorkUnit(study_idx, [], 0.0, 0.0) for _ in range(min(n_units, len(components)))]
+    for component in components:
+        unit = min(units, key=lambda unit: unit.work)
+        unit.exp_args_list.extend(component)
+        unit.work += sum(durations[exp_args.exp_id] for exp_args in component)
+        unit.priority = max(unit.priority, *(priorities[exp_args.exp_id] for exp_args in component))
+
+    order = {exp_args.exp_id: i for i, exp_args in enumerate(exp_args_list)}
+    for unit in units:
+        unit.exp_args_list.sort(key=lambda exp_args: order[exp_args.exp_id])
+    return sorted(units, key=lambda unit: -unit.priority)
+
+
+class ServerDispatcher:
+    """Assign the work units of several studies to servers, stealing work from the busiest study.
+
+    A server runs the experiments of one study at a time, and is reset before running the ones of
+    another study, as the experiments of a study modify the state of the server (e.g. WebArena). A
+    server keeps taking the units of its current study, then starts a study that no server has
+    started yet, and then steals units from the study with the most remaining work.
+
+    Args:
+        units_per_study: list[list[WorkUnit]]
+            The work units of each study, by decreasing priority.
+        n_servers: int
+            Number of servers.
+    """
+
+    def __init__(self, units_per_study: list[list[WorkUnit]], n_servers: int):
+        self.pending = [list(units) for units in units_per_study]
+        self.server_studies = [None] * n_servers
+        self.started = set()
+
+    def remaining_work(self, study_idx: int) -> float:
+        return sum(unit.work for unit in self.pending[study_idx])
+
+    def next_unit(self, server_idx: int) -> tuple[WorkUnit, bool] | None:
+        """Return the next work unit of a server and whether the server must be reset before it,
+        or None if there is nothing left to run."""
+        study_idx = self.server_studies[server_idx]
+        if study_idx is None or not self.pending[study_idx]:
+            candidates = [i for i, units in enumerate(self.pending) if units]
+            if not candidates:
+                return None
+            not_started = [i for i in candidates if i not in self.started]
+            if not_started:
+                study_idx = not_started[0]
+            else:
+                study_idx = max(candidates, key=self.remaining_work)
+
+        unit = self.pending[study_idx].pop(0)
+        reset = unit.needs_reset or study_idx != self.server_studies[server_idx]
+        unit.needs_reset = False
+        self.server_studies[server_idx] = study_idx
+        self.started.add(study_idx)
+        return unit, reset
+
+    def requeue(self, unit: WorkUnit):
+        """Put back a work unit to run again first, e.g. to relaunch its failed experiments.
+
+        Like a new trial of a Study, the server is reset before running it again.
+        """
+        unit.needs_reset = True
+        self.pending[unit.study_idx].insert(0, unit)
+
+    def cancel(self, study_idx: int):
+        """Drop the pending work units of a study."""
+        self.pending[study_idx].clear()
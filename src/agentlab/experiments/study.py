@@ -1,8 +1,10 @@
 from concurrent.futures import ProcessPoolExecutor
 import gzip
+import itertools
 import logging
 import os
 import pickle
+import queue
 import uuid
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
@@ -17,8 +19,22 @@ from agentlab.agents.agent_args import AgentArgs
 from agentlab.analyze import inspect_results
 from agentlab.experiments import reproducibility_util as repro
 from agentlab.experiments.exp_utils import RESULTS_DIR, add_dependencies
-from agentlab.experiments.launch_exp import find_incomplete, non_dummy_count, run_experiments
+from agentlab.experiments.launch_exp import (
+    find_incomplete,
+    find_incomplete_from_log,
+    non_dummy_count,
+    run_experiments,
+)
 from agentlab.experiments.multi_server import BaseServer, WebArenaInstanceVars
+from agentlab.experiments.results_log import ResultsLog
+from agentlab.experiments.scheduling import (
+    ServerDispatcher,
+    WorkUnit,
+    critical_path_priorities,
+    estimate_durations,
+    load_task_durations,
+    make_work_units,
+)
 from multiprocessing import Pool, Manager, Queue
 
 logger = logging.getLogger(__name__)
@@ -143,9 +159,16 @@ class AbstractStudy(ABC):
         with gzip.open(self.dir / "study.pkl.gz", "wb") as f:
             pickle.dump(self, f)
 
-    def get_results(self, suffix="", also_save=True):
-        """Recursively load all results from the study directory and summarize them."""
-        result_df = inspect_results.load_result_df(self.dir)
+    def get_results(self, suffix="", also_save=True, results_log: ResultsLog = None):
+        """Recursively load all results from the study directory and summarize them.
+
+        If a results_log is given, the results are taken from the log instead of the directories of
+        the experiments.
+        """
+        if results_log is not None:
+            result_df = results_log.result_df(self.exp_args_list)
+        else:
+            result_df = inspect_results.load_result_df(self.dir)
         error_report = inspect_results.error_report(result_df, max_stack_trace=3, use_log=True)
         summary_df = inspect_results.summarize_study(result_df)
 
@@ -207,6 +230,9 @@ class Study(AbstractStudy):
         demo_mode: bool
             If True, the experiments will be run in demo mode, which will record videos, and enable
             visual effects for actions.
+        past_study_dirs: list[Path]
+            Directories of past studies on the same benchmark. With the ray_pool backend, the
+            duration of their episodes is used to start the longest chains of dependent tasks first.
     """
 
     agent_args: list[AgentArgs] = None
@@ -221,6 +247,7 @@ class Study(AbstractStudy):
     ignore_dependencies: bool = False
     avg_step_timeout: int = 60
     demo_mode: bool = False
+    past_study_dirs: list[Path] = None
 
     def __post_init__(self):
         """Initialize the study. Set the uuid, and generate the exp_args_list."""
@@ -242,18 +269,26 @@ class Study(AbstractStudy):
             demo_mode=self.demo_mode,
         )
 
-    def find_incomplete(self, include_errors=True):
+    def find_incomplete(self, include_errors=True, results_log: ResultsLog = None):
         """Find incomplete or errored experiments in the study directory for relaunching.
 
         Args:
             include_errors: bool
                 If True, include errored experiments in the list.
+            results_log: ResultsLog
+                If given, the status of the experiments of exp_args_list is taken from this log
+                instead of reloading the study directory.
 
         Returns:
             list[ExpArgs]: The list of all experiments with completed ones replaced by a
                 dummy exp_args to keep the task dependencies.
         """
-        self.exp_args_list = find_incomplete(self.dir, include_errors=include_errors)
+        if results_log is not None:
+            self.exp_args_list = find_incomplete_from_log(
+                self.exp_args_list, results_log, include_errors=include_errors
+            )
+        else:
+            self.exp_args_list = find_incomplete(self.dir, include_errors=include_errors)
         n_incomplete = non_dummy_count(self.exp_args_list)
         n_error = [
             getattr(exp_args, "status", "incomplete") == "error" for exp_args in self.exp_args_list
@@ -307,16 +342,21 @@ class Study(AbstractStudy):
 
         n_exp = len(self.exp_args_list)
         last_error_count = None
+        # the experiments append their results to the log, only the new ones are read after a trial
+        results_log = ResultsLog(self.dir)
 
         for i in range(n_relaunch):
             logger.info(f"Launching study {self.name} - trial {i + 1} / {n_relaunch}")
             self._run(n_jobs, parallel_backend, strict_reproducibility)
+            results_log.update()
 
             suffix = f"trial_{i + 1}_of_{n_relaunch}"
-            _, summary_df, _ = self.get_results(suffix=suffix)
+            _, summary_df, _ = self.get_results(suffix=suffix, results_log=results_log)
             logger.info("\n" + str(summary_df))
 
-            n_incomplete, n_error = self.find_incomplete(include_errors=relaunch_errors)
+            n_incomplete, n_error = self.find_incomplete(
+                include_errors=relaunch_errors, results_log=results_log
+            )
 
             if n_error / n_exp > 0.3:
                 logger.warning(f"More than 30% of the experiments errored. Stopping the study.")
@@ -359,12 +399,17 @@ class Study(AbstractStudy):
         self.benchmark.prepare_backends()
         logger.info("Backends ready.")
 
+        task_durations = None
+        if self.past_study_dirs:
+            task_durations = load_task_durations(self.past_study_dirs)
+
         run_experiments(
             n_jobs,
             self.exp_args_list,
             self.dir,
             parallel_backend=parallel_backend,
             avg_step_timeout=self.avg_step_timeout,
+            task_durations=task_durations,
         )
 
     def append_to_journal(self, strict_reproducibility=True):
@@ -488,32 +533,130 @@ class SequentialStudies(AbstractStudy):
             study.append_to_journal(strict_reproducibility=strict_reproducibility)
 
 
-def _init_worker(server_queue: Queue):
-    """Run once at the initialization of the worker in the multiprocessing.Pool.
+def _init_server(server: BaseServer):
+    """Initialize the server of the single worker of a ProcessPoolExecutor."""
+    logger.warning(f"Initializing server instance {server} from process {os.getpid()}")
+    server.init()
 
-    This is typically used to initialize different environment variables of the WebArena server for
-    multiple instances in parallel.
 
-    Args:
-        server_queue: Queue
-            A queue of object implementing BaseServer to initialize (or anything with a init
-            method).
-    """
-    print("initializing server instance with on process", os.getpid())
-    print(f"using queue {server_queue}")
-    server_instance = server_queue.get()  # type: "WebArenaInstanceVars"
-    logger.warning(f"Initializing server instance {server_instance} from process {os.getpid()}")
-    server_instance.init()
+# work units in flight on each server, the next unit is sent before the current one is done
+MAX_UNITS_PER_SERVER_QUEUE = 2
 
 
-def _run_study(study: Study, n_jobs, parallel_backend, strict_reproducibility, n_relaunch):
-    """Wrapper to run a study remotely."""
-    study.run(n_jobs, parallel_backend, strict_reproducibility, n_relaunch)
+@dataclass
+class _WorkUnitRun:
+    """A work unit sent to the process of a server."""
+
+    unit_id: int
+    exp_args_list: list[ExpArgs]
+    reset: bool
+    benchmark: Benchmark
+    study_dir: Path
+    avg_step_timeout: int
+    task_durations: dict[str, float] = None
+
+
+def _serve_work_units(unit_queue: Queue, done_queue: Queue, server_idx: int, n_jobs: int):
+    """Run the work units sent to the server of this process on a single pool of Ray workers.
+
+    The units are added to the pool as they arrive, so the workers don't wait for the end of a unit
+    to start the next one. A unit that resets the server waits for the pool to be empty first.
+    Each finished unit is reported to done_queue with its experiments, as prepared in their
+    directory. A None unit stops the server once the pool is empty.
+
+    Args:
+        unit_queue: Queue
+            The _WorkUnitRun to run, in order.
+        done_queue: Queue
+            Receives (server_idx, unit_id, exp_args_list) for each finished unit.
+        server_idx: int
+            Index of the server, sent back with the finished units.
+        n_jobs: int
+            Number of experiments running in parallel on the server.
+    """
+    from agentlab.experiments.graph_execution_ray import ExpWorkerPool, ray
+
+    ray.init(num_cpus=n_jobs)
+    pool = ExpWorkerPool(n_jobs)
+    # unit_id: (unit, exp_ids of the unit not finished yet)
+    units = {}
+    unit_of_exp = {}
+    held_unit = None
+    stopping = False
+
+    def start(unit: _WorkUnitRun):
+        if unit.reset:
+            logger.info("Preparing backends...")
+            unit.benchmark.prepare_backends()
+            logger.info("Backends ready.")
+        for exp_args in unit.exp_args_list:
+            exp_args.agent_args.prepare()
+            exp_args.prepare(exp_root=unit.study_dir)
+            unit_of_exp[exp_args.exp_id] = unit.unit_id
+        units[unit.unit_id] = (unit, {exp_args.exp_id for exp_args in unit.exp_args_list})
+        durations = estimate_durations(unit.exp_args_list, unit.task_durations)
+        priorities = critical_path_priorities(unit.exp_args_list, durations)
+        pool.add(unit.exp_args_list, priorities, avg_step_timeout=unit.avg_step_timeout)
+
+    try:
+        while True:
+            while held_unit is None and not stopping:
+                try:
+                    # only block when there is nothing to run
+                    unit = unit_queue.get(block=pool.n_unfinished == 0)
+                except queue.Empty:
+                    break
+                if unit is None:
+                    stopping = True
+                elif unit.reset and pool.n_unfinished > 0:
+                    held_unit = unit
+                else:
+                    start(unit)
+
+            if pool.n_unfinished == 0:
+                if held_unit is not None:
+                    start(held_unit)
+                    held_unit = None
+                    continue
+                if stopping:
+                    return
+
+            # wake up regularly to add the units that arrived meanwhile
+            for exp_id in pool.wait(timeout=1):
+                unit, remaining = units[unit_of_exp.pop(exp_id)]
+                remaining.discard(exp_id)
+                if remaining:
+                    continue
+                del units[unit.unit_id]
+                for exp_args in unit.exp_args_list:
+                    exp_args.agent_args.close()
+                done_queue.put((server_idx, unit.unit_id, unit.exp_args_list))
+    finally:
+        pool.close()
+        ray.shutdown()
 
 
 @dataclass
 class ParallelStudies(SequentialStudies):
+    """Studies dispatched on a pool of servers.
+
+    Each study is split in work units that don't depend on each other, e.g. the chains of dependent
+    tasks of WebArena, and the units are dispatched on the servers by a ServerDispatcher. A server
+    done with its study steals units from the others, after a reset. Each server runs its units on
+    a single pool of persistent Ray workers (like the ray_pool backend), fed with the next unit
+    before the current one is done. The failed experiments of a unit are relaunched as a new unit,
+    after a reset of the server, and a study is stopped when more than 30% of its experiments
+    errored.
+
+    Attributes:
+        parallel_servers: list[BaseServer] | int
+            The servers, or a number of servers that don't need to be initialized.
+        units_per_server: int
+            Each study is split in at most units_per_server * len(parallel_servers) work units.
+    """
+
     parallel_servers: list[BaseServer] | int = None
+    units_per_server: int = 4
 
     def _run(
         self,
@@ -525,26 +668,160 @@ class ParallelStudies(SequentialStudies):
         parallel_servers = self.parallel_servers
         if isinstance(parallel_servers, int):
             parallel_servers = [BaseServer() for _ in range(parallel_servers)]
+        if parallel_backend not in ("ray", "ray_pool"):
+            logger.warning(
+                f"ParallelStudies runs the experiments on Ray worker pools, "
+                f"ignoring parallel_backend={parallel_backend}."
+            )
 
-        server_queue = Manager().Queue()
-        for server in parallel_servers:
-            server_queue.put(server)
+        units_per_study = []
+        task_durations = []
+        for study_idx, study in enumerate(self.studies):
+            study.set_reproducibility_info(
+                strict_reproducibility=strict_reproducibility, comment=study.comment
+            )
+            study.save()
+            durations = None
+            if study.past_study_dirs:
+                durations = load_task_durations(study.past_study_dirs)
+            task_durations.append(durations)
+            units_per_study.append(
+                make_work_units(
+                    study.exp_args_list,
+                    n_units=self.units_per_server * len(parallel_servers),
+                    study_idx=study_idx,
+                    task_durations=durations,
+                )
+            )
+        dispatcher = ServerDispatcher(units_per_study, n_servers=len(parallel_servers))
+        exp_positions = [
+            {exp_args.exp_id: i for i, exp_args in enumerate(study.exp_args_list)}
+            for study in self.studies
+        ]
+        results_logs = [ResultsLog(study.dir) for study in self.studies]
+
+        manager = Manager()
+        unit_queues = [manager.Queue() for _ in parallel_servers]
+        done_queue = manager.Queue()
+        # one process per server, so that each work unit runs on a known server
+        executors = [
+            ProcessPoolExecutor(max_workers=1, initializer=_init_server, initargs=(server,))
+            for server in parallel_servers
+        ]
+        server_futures = [
+            executor.submit(
+                _serve_work_units, unit_queues[server_idx], done_queue, server_idx, n_jobs
+            )
+            for server_idx, executor in enumerate(executors)
+        ]
+        # unit_id: (unit, number of trials)
+        running = {}
+        n_queued = [0] * len(parallel_servers)
+        n_trials = {}
+        unit_ids = itertools.count()
+
+        def feed():
+            """Fill the queues of the servers, one unit at a time to each server in turn."""
+            for server_idx in itertools.chain(
+                *[range(len(parallel_servers))] * MAX_UNITS_PER_SERVER_QUEUE
+            ):
+                if n_queued[server_idx] >= MAX_UNITS_PER_SERVER_QUEUE:
+                    continue
+                assignment = dispatcher.next_unit(server_idx)
+                if assignment is None:
+                    return
+                unit, reset = assignment
+                unit_id = next(unit_ids)
+                study = self.studies[unit.study_idx]
+                running[unit_id] = unit
+                n_queued[server_idx] += 1
+                unit_queues[server_idx].put(
+                    _WorkUnitRun(
+                        unit_id,
+                        unit.exp_args_list,
+                        reset,
+                        study.benchmark,
+                        study.dir,
+                        study.avg_step_timeout,
+                        task_durations[unit.study_idx],
+                    )
+                )
+
+        def finish(unit: WorkUnit, trial: int):
+            """Relaunch the failed experiments of a unit, or stop its study if too many errored."""
+            study = self.studies[unit.study_idx]
+            results_log = results_logs[unit.study_idx]
+            results_log.update()
+            unit.exp_args_list = find_incomplete_from_log(
+                unit.exp_args_list, results_log, include_errors=True
+            )
+            statuses = [results_log.status(exp_args) for exp_args in study.exp_args_list]
+            if statuses.count("error") / len(statuses) > 0.3:
+                if dispatcher.pending[unit.study_idx]:
+                    logger.warning(
+                        f"More than 30% of the experiments of {study.name} errored. "
+                        f"Stopping the study."
+                    )
+                    dispatcher.cancel(unit.study_idx)
+                return
+            if non_dummy_count(unit.exp_args_list) > 0 and trial < n_relaunch:
+                n_trials[id(unit)] = trial + 1
+                dispatcher.requeue(unit)
+
+        try:
+            feed()
+            while running:
+                try:
+                    server_idx, unit_id, exp_args_list = done_queue.get(timeout=10)
+                except queue.Empty:
+                    for server_future in server_futures:
+                        if server_future.done():
+                            # raise the exception of a crashed server
+                            server_future.result()
+                            raise RuntimeError("A server stopped before running all its units.")
+                    continue
+
+                unit = running.pop(unit_id)
+                n_queued[server_idx] -= 1
+                # the experiments were prepared (name, directory, seed...) in the process of the
+                # server, the relaunched ones must keep them
+                study = self.studies[unit.study_idx]
+                for exp_args in exp_args_list:
+                    study.exp_args_list[exp_positions[unit.study_idx][exp_args.exp_id]] = exp_args
+                unit.exp_args_list = exp_args_list
+                finish(unit, n_trials.get(id(unit), 1))
+                feed()
+        finally:
+            for unit_queue in unit_queues:
+                unit_queue.put(None)
+            for executor in executors:
+                executor.shutdown(cancel_futures=True)
+
+        for study in self.studies:
+            study.get_results()
+
+
+def _init_worker(server_queue: Queue):
+    """Run once at the initialization of the worker in the multiprocessing.Pool.
 
-        with ProcessPoolExecutor(
-            max_workers=len(parallel_servers), initializer=_init_worker, initargs=(server_queue,)
-        ) as executor:
-            # Create list of arguments for each study
-            study_args = [
-                (study, n_jobs, parallel_backend, strict_reproducibility, n_relaunch)
-                for study in self.studies
-            ]
-
-            # Submit all tasks and wait for completion
-            futures = [executor.submit(_run_study, *args) for args in study_args]
-
-            # Wait for all futures to complete and raise any exceptions
-            for future in futures:
-                future.result()
+    This is typically used to initialize different environment variables of the WebArena server for
+    multiple instances in parallel.
+
+    Args:
+        server_queue: Queue
+            A queue of object implementing BaseServer to initialize (or anything with a init
+            method).
+    """
+    print("initializing server instance with on process", os.getpid())
+    print(f"using queue {server_queue}")
+    server_instance = server_queue.get()  # type: "WebArenaInstanceVars"
+    logger.warning(f"Initializing server instance {server_instance} from process {os.getpid()}")
+    server_instance.init()
+
+
+def _run_study(study: Study, n_jobs, parallel_backend, strict_reproducibility, n_relaunch):
+    """Wrapper to run a study remotely."""
+    study.run(n_jobs, parallel_backend, strict_reproducibility, n_relaunch)
 
 
 @dataclass
@@ -4,16 +4,31 @@ import re
 import time
 from dataclasses import dataclass
 from functools import partial
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 import openai
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient, InferenceClient
 from openai import AzureOpenAI, OpenAI
 
 import agentlab.llm.tracking as tracking
 from agentlab.llm.base_api import AbstractChatModel, BaseModelArgs
 from agentlab.llm.huggingface_utils import HFBaseChatModel
-from agentlab.llm.llm_utils import AIMessage, Discussion
+from agentlab.llm.llm_utils import (
+    AIMessage,
+    Discussion,
+    StreamingTagParser,
+    strip_cache_breakpoints,
+)
+from agentlab.llm.response_cache import ResponseCache, get_response_cache_from_env
+from agentlab.llm.retry_policy import (
+    ENDPOINT_FAILURES,
+    RetryPolicy,
+    default_retry_policies,
+    get_circuit_breaker,
+    get_retry_after,
+    get_retry_policy,
+)
+from agentlab.llm.tokenizer_registry import estimate_tokens
 
 
 def make_system_message(content: str) -> dict:
@@ -180,39 +195,79 @@ class ChatModelArgs(BaseModelArgs):
         pass
 
 
-def _extract_wait_time(error_message, min_retry_wait_time=60):
-    """Extract the wait time from an OpenAI RateLimitError message."""
-    match = re.search(r"try again in (\d+(\.\d+)?)s", error_message)
-    if match:
-        return max(min_retry_wait_time, float(match.group(1)))
-    return min_retry_wait_time
-
-
 class RetryError(Exception):
     pass
 
 
-def handle_error(error, itr, min_retry_wait_time, max_retry):
+def handle_error(error, itr, max_retry, retry_policies, previous_wait_time=0.0):
+    """Log an API error and sleep according to its retry policy.
+
+    Args:
+        error: The error raised by the API.
+        itr: The index of the failed attempt.
+        max_retry: The maximum number of attempts.
+        retry_policies: The retry policy of each error class, see default_retry_policies.
+        previous_wait_time: The wait time after the previous failed attempt.
+
+    Returns:
+        The error type and the time waited, in seconds.
+
+    Raises:
+        The error itself if it is not retryable.
+    """
     if not isinstance(error, openai.OpenAIError):
         raise error
+    policy = get_retry_policy(error, retry_policies)
+    if not policy.retryable:
+        raise error
+
     logging.warning(
         f"Failed to get a response from the API: \n{error}\n" f"Retrying... ({itr+1}/{max_retry})"
     )
-    wait_time = _extract_wait_time(
-        error.args[0],
-        min_retry_wait_time=min_retry_wait_time,
-    )
-    logging.info(f"Waiting for {wait_time} seconds")
+    error_type = error.args[0] if error.args else type(error).__name__
+    if itr == max_retry - 1:
+        # no attempt left, don't wait for nothing
+        return error_type, 0.0
+
+    wait_time = policy.wait_time(previous_wait_time, retry_after=get_retry_after(error))
+    logging.info(f"Waiting for {wait_time:.1f} seconds")
     time.sleep(wait_time)
-    error_type = error.args[0]
-    return error_type
+    return error_type, wait_time
 
 
 class OpenRouterError(openai.OpenAIError):
     pass
 
 
+def get_cached_tokens(usage) -> int:
+    """Number of input tokens served from the prompt cache of the provider, 0 if not reported."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is None:
+        # anthropic style usage
+        cached_tokens = getattr(usage, "cache_read_input_tokens", None)
+    return cached_tokens or 0
+
+
+def estimate_prompt_tokens(messages: list[dict], model_name: str) -> int:
+    """Fast estimate of the input tokens of the messages, from their text parts only.
+
+    The images are not counted, as their base64 urls are not billed as text.
+    """
+    texts = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(part["text"] for part in content if part["type"] == "text")
+    return estimate_tokens("\n".join(texts), model_name)
+
+
 class ChatModel(AbstractChatModel):
+    # whether the API accepts the cache breakpoints marked with BaseMessage.add_cache_breakpoint
+    supports_cache_breakpoints = False
+
     def __init__(
         self,
         model_name,
@@ -220,11 +275,14 @@ class ChatModel(AbstractChatModel):
         temperature=0.5,
         max_tokens=100,
         max_retry=4,
-        min_retry_wait_time=60,
+        min_retry_wait_time=5,
+        max_retry_wait_time=60,
         api_key_env_var=None,
         client_class=OpenAI,
         client_args=None,
         pricing_func=None,
+        response_cache: ResponseCache = None,
+        retry_policies: dict[type, RetryPolicy] = None,
     ):
         assert max_retry > 0, "max_retry should be greater than 0"
 
@@ -233,6 +291,15 @@ class ChatModel(AbstractChatModel):
         self.max_tokens = max_tokens
         self.max_retry = max_retry
         self.min_retry_wait_time = min_retry_wait_time
+        self.max_retry_wait_time = max_retry_wait_time
+        # opt-in, defaults to the cache given by the AGENTLAB_LLM_CACHE environment variable
+        if response_cache is None:
+            response_cache = get_response_cache_from_env()
+        self.response_cache = response_cache
+        self.retry_policies = retry_policies or default_retry_policies(
+            min_retry_wait_time, max_retry_wait_time
+        )
+        self._reset_stats()
 
         # Get the API key from the environment variable if not provided
         if api_key_env_var:
@@ -260,61 +327,216 @@ class ChatModel(AbstractChatModel):
             api_key=api_key,
             **client_args,
         )
+        # shared by all the models of the process calling the same endpoint
+        base_url = getattr(self.client, "base_url", None)
+        self.circuit_breaker = get_circuit_breaker(f"{base_url}:{model_name}")
 
     def __call__(self, messages: list[dict], n_samples: int = 1, temperature: float = None) -> dict:
-        # Initialize retry tracking attributes
+        self._reset_stats()
+        temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(
+                self.model_name, messages, temperature, self.max_tokens, n_samples
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                self.success = True
+                return self._make_answer(cached["contents"], n_samples)
+
+        def request():
+            completion = self._create_completion(messages, n_samples, temperature)
+            if completion.usage is None:
+                raise OpenRouterError(
+                    "The completion object does not contain usage information. This is likely a bug in the OpenRouter API."
+                )
+            return completion
+
+        completion = self._request_with_retry(request)
+
+        input_tokens = completion.usage.prompt_tokens
+        output_tokens = completion.usage.completion_tokens
+        self._track_usage(input_tokens, output_tokens, get_cached_tokens(completion.usage))
+
+        contents = [c.message.content for c in completion.choices]
+        if cache_key is not None:
+            self.response_cache.put(cache_key, contents, input_tokens, output_tokens)
+
+        return self._make_answer(contents, n_samples)
+
+    def stream(self, messages: list[dict], temperature: float = None) -> Iterator[str]:
+        """Generate a single answer and yield its text as it is generated.
+
+        Closing the generator before the end cancels the generation, and only the tokens generated
+        so far are paid. Only complete answers are stored in the response cache.
+
+        Args:
+            messages: The messages of the conversation.
+            temperature: The sampling temperature, defaults to the temperature of the model.
+
+        Yields:
+            The successive chunks of text of the answer.
+        """
+        self._reset_stats()
+        temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(
+                self.model_name, messages, temperature, self.max_tokens, 1
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.cache_hit = True
+                self.success = True
+                yield cached["contents"][0]
+                return
+
+        stream = self._request_with_retry(
+            lambda: self._create_completion(
+                messages, 1, temperature, stream=True, stream_options={"include_usage": True}
+            )
+        )
+
+        chunks = []
+        usage = None
+        complete = False
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunks[-1]
+            complete = True
+        finally:
+            stream.close()
+            content = "".join(chunks)
+            cached_tokens = 0
+            if usage is not None:
+                input_tokens, output_tokens = usage.prompt_tokens, usage.completion_tokens
+                cached_tokens = get_cached_tokens(usage)
+            else:
+                # the usage is only sent at the end of the stream, estimate it
+                input_tokens = estimate_prompt_tokens(messages, self.model_name)
+                output_tokens = estimate_tokens(content, self.model_name)
+            self._track_usage(input_tokens, output_tokens, cached_tokens)
+            if complete and cache_key is not None:
+                self.response_cache.put(cache_key, [content], input_tokens, output_tokens)
+
+    def complete_until(
+        self,
+        messages: list[dict],
+        should_stop: Callable[[str, list[str]], bool],
+        temperature: float = None,
+    ) -> AIMessage:
+        """Stream an answer and stop generating as soon as should_stop returns True.
+
+        Args:
+            messages: The messages of the conversation.
+            should_stop: Called with the answer so far and the tags that were just closed, each
+                time an HTML-like tag (e.g. </action>) is closed.
+            temperature: The sampling temperature, defaults to the temperature of the model.
+
+        Returns:
+            The answer, possibly cut after the tag that stopped the generation.
+        """
+        tag_parser = StreamingTagParser()
+        answer = ""
+        chunks = self.stream(messages, temperature=temperature)
+        try:
+            for chunk in chunks:
+                answer += chunk
+                closed_tags = tag_parser.feed(chunk)
+                if closed_tags and should_stop(answer, closed_tags):
+                    self.stopped_early = True
+                    break
+        finally:
+            chunks.close()
+        return AIMessage(answer)
+
+    def _reset_stats(self):
         self.retries = 0
         self.success = False
         self.error_types = []
-
-        completion = None
-        e = None
+        self.cache_hit = False
+        self.stopped_early = False
+        self.retry_wait_time = 0.0
+        self.attempt_latencies = []
+
+    def _request_with_retry(self, request: Callable):
+        """Send a request, retrying on API errors according to the retry policies."""
+        wait_time = 0.0
         for itr in range(self.max_retry):
             self.retries += 1
-            temperature = temperature if temperature is not None else self.temperature
+            start = time.time()
+            is_probe = False
             try:
-                completion = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    n=n_samples,
-                    temperature=temperature,
-                    max_tokens=self.max_tokens,
-                )
-
-                if completion.usage is None:
-                    raise OpenRouterError(
-                        "The completion object does not contain usage information. This is likely a bug in the OpenRouter API."
-                    )
-
+                is_probe = self.circuit_breaker.before_request()
+                response = request()
+                self.attempt_latencies.append(time.time() - start)
+                self.circuit_breaker.record_success()
                 self.success = True
-                break
+                return response
             except openai.OpenAIError as e:
-                error_type = handle_error(e, itr, self.min_retry_wait_time, self.max_retry)
+                self.attempt_latencies.append(time.time() - start)
+                if isinstance(e, ENDPOINT_FAILURES):
+                    self.circuit_breaker.record_failure()
+                elif is_probe:
+                    # e.g. a rate limit, the endpoint is not known to be healthy yet
+                    self.circuit_breaker.release_probe()
+                error_type, wait_time = handle_error(
+                    e, itr, self.max_retry, self.retry_policies, previous_wait_time=wait_time
+                )
                 self.error_types.append(error_type)
+                self.retry_wait_time += wait_time
+            except BaseException:
+                if is_probe:
+                    self.circuit_breaker.release_probe()
+                raise
+
+        raise RetryError(
+            f"Failed to get a response from the API after {self.max_retry} retries\n"
+            f"Last error: {error_type}"
+        )
 
-        if not completion:
-            raise RetryError(
-                f"Failed to get a response from the API after {self.max_retry} retries\n"
-                f"Last error: {error_type}"
-            )
-
-        input_tokens = completion.usage.prompt_tokens
-        output_tokens = completion.usage.completion_tokens
+    def _track_usage(self, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0):
         cost = input_tokens * self.input_cost + output_tokens * self.output_cost
 
         if hasattr(tracking.TRACKER, "instance") and isinstance(
             tracking.TRACKER.instance, tracking.LLMTracker
         ):
-            tracking.TRACKER.instance(input_tokens, output_tokens, cost)
+            tracking.TRACKER.instance(input_tokens, output_tokens, cost, cached_input_tokens)
+
+    def _create_completion(self, messages, n_samples: int, temperature: float, **kwargs):
+        """Send one request to the API. Subclasses can override this to wrap each request."""
+        if not self.supports_cache_breakpoints:
+            messages = strip_cache_breakpoints(messages)
+        return self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            n=n_samples,
+            temperature=temperature,
+            max_tokens=self.max_tokens,
+            **kwargs,
+        )
 
+    @staticmethod
+    def _make_answer(contents: list[str], n_samples: int):
         if n_samples == 1:
-            return AIMessage(completion.choices[0].message.content)
+            return AIMessage(contents[0])
         else:
-            return [AIMessage(c.message.content) for c in completion.choices]
+            return [AIMessage(content) for content in contents]
 
     def get_stats(self):
         return {
             "n_retry_llm": self.retries,
+            "n_llm_cache_hit": int(self.cache_hit),
+            "n_llm_early_stop": int(self.stopped_early),
+            "llm_retry_wait_time": self.retry_wait_time,
+            "llm_attempt_latency": sum(self.attempt_latencies),
             # "busted_retry_llm": int(not self.success), # not logged if it occurs anyways
         }
 
@@ -327,7 +549,8 @@ class OpenAIChatModel(ChatModel):
         temperature=0.5,
         max_tokens=100,
         max_retry=4,
-        min_retry_wait_time=60,
+        min_retry_wait_time=5,
+        max_retry_wait_time=60,
     ):
         super().__init__(
             model_name=model_name,
@@ -336,6 +559,7 @@ class OpenAIChatModel(ChatModel):
             max_tokens=max_tokens,
             max_retry=max_retry,
             min_retry_wait_time=min_retry_wait_time,
+            max_retry_wait_time=max_retry_wait_time,
             api_key_env_var="OPENAI_API_KEY",
             client_class=OpenAI,
             pricing_func=tracking.get_pricing_openai,
@@ -343,6 +567,9 @@ class OpenAIChatModel(ChatModel):
 
 
 class OpenRouterChatModel(ChatModel):
+    # forwarded to the providers with explicit prompt caching, e.g. Anthropic and Gemini
+    supports_cache_breakpoints = True
+
     def __init__(
         self,
         model_name,
@@ -350,7 +577,8 @@ class OpenRouterChatModel(ChatModel):
         temperature=0.5,
         max_tokens=100,
         max_retry=4,
-        min_retry_wait_time=60,
+        min_retry_wait_time=5,
+        max_retry_wait_time=60,
     ):
         client_args = {
             "base_url": "https://openrouter.ai/api/v1",
@@ -362,6 +590,7 @@ class OpenRouterChatModel(ChatModel):
             max_tokens=max_tokens,
             max_retry=max_retry,
             min_retry_wait_time=min_retry_wait_time,
+            max_retry_wait_time=max_retry_wait_time,
             api_key_env_var="OPENROUTER_API_KEY",
             client_class=OpenAI,
             client_args=client_args,
@@ -378,7 +607,8 @@ class AzureChatModel(ChatModel):
         temperature=0.5,
         max_tokens=100,
         max_retry=4,
-        min_retry_wait_time=60,
+        min_retry_wait_time=5,
+        max_retry_wait_time=60,
     ):
         api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
         endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -396,6 +626,7 @@ class AzureChatModel(ChatModel):
             max_tokens=max_tokens,
             max_retry=max_retry,
             min_retry_wait_time=min_retry_wait_time,
+            max_retry_wait_time=max_retry_wait_time,
             client_class=AzureOpenAI,
             client_args=client_args,
             pricing_func=tracking.get_pricing_openai,
@@ -412,8 +643,9 @@ class HuggingFaceURLChatModel(HFBaseChatModel):
         temperature: Optional[int] = 1e-1,
         max_new_tokens: Optional[int] = 512,
         n_retry_server: Optional[int] = 4,
+        max_concurrency: Optional[int] = 4,
     ):
-        super().__init__(model_name, base_model_name, n_retry_server)
+        super().__init__(model_name, base_model_name, n_retry_server, max_concurrency)
         if temperature < 1e-3:
             logging.warning("Models might behave weirdly when temperature is too low.")
         self.temperature = temperature
@@ -423,3 +655,6 @@ class HuggingFaceURLChatModel(HFBaseChatModel):
 
         client = InferenceClient(model=model_url, token=token)
         self.llm = partial(client.text_generation, max_new_tokens=max_new_tokens)
+        # the samples of a call are generated concurrently
+        async_client = AsyncInferenceClient(model=model_url, token=token)
+        self.async_llm = partial(async_client.text_generation, max_new_tokens=max_new_tokens)
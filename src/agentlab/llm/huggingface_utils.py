@@ -1,5 +1,7 @@
+import asyncio
 import logging
-import time
+import random
+import threading
 from typing import Any, List, Optional, Union
 
 from pydantic import Field
@@ -22,11 +24,18 @@ class HFBaseChatModel(AbstractChatModel):
     Attributes:
         llm (Any): The HuggingFaceHub model instance.
         prompt_template (Any): Template for the prompt to be used for the model's input sequence.
+        async_llm (Any): Optional coroutine function generating a response, used instead of llm.
         tokenizer (Any): The tokenizer to use for the model.
         n_retry_server (int): Number of times to retry on server failure.
+        max_concurrency (int): Maximum number of samples generated concurrently.
+        retry_wait_time (float): Base wait time of the exponential backoff between retries, in seconds.
     """
 
     llm: Any = Field(description="The HuggingFaceHub model instance")
+    async_llm: Any = Field(
+        default=None,
+        description="Coroutine function generating a response, used instead of llm if provided",
+    )
     tokenizer: Any = Field(
         default=None,
         description="The tokenizer to use for the model",
@@ -39,10 +48,23 @@ class HFBaseChatModel(AbstractChatModel):
         default=4,
         description="The number of times to retry the server if it fails to respond",
     )
+    max_concurrency: int = Field(
+        default=4,
+        description="The maximum number of samples generated concurrently",
+    )
+    retry_wait_time: float = Field(
+        default=1.0,
+        description="The base wait time of the exponential backoff between retries, in seconds",
+    )
 
-    def __init__(self, model_name, base_model_name, n_retry_server):
+    def __init__(
+        self, model_name, base_model_name, n_retry_server, max_concurrency=4, retry_wait_time=1.0
+    ):
         super().__init__()
         self.n_retry_server = n_retry_server
+        self.max_concurrency = max_concurrency
+        self.retry_wait_time = retry_wait_time
+        self.async_llm = None
 
         if base_model_name is None:
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -94,31 +116,69 @@ class HFBaseChatModel(AbstractChatModel):
         elif self.prompt_template:
             prompt = self.prompt_template.construct_prompt(messages)
 
-        responses = []
-        for _ in range(n_samples):
-            itr = 0
-            while True:
-                try:
-                    temperature = temperature if temperature is not None else self.temperature
-                    response = AIMessage(self.llm(prompt, temperature=temperature))
-                    responses.append(response)
-                    break
-                except Exception as e:
-                    if itr == self.n_retry_server - 1:
-                        raise e
-                    logging.warning(
-                        f"Failed to get a response from the server: \n{e}\n"
-                        f"Retrying... ({itr+1}/{self.n_retry_server})"
-                    )
-                    time.sleep(5)
-                    itr += 1
+        temperature = temperature if temperature is not None else self.temperature
+        responses = _run_coroutine(self._sample(prompt, n_samples, temperature))
 
         return responses[0] if n_samples == 1 else responses
 
+    async def _sample(self, prompt: str, n_samples: int, temperature: float) -> List[AIMessage]:
+        """Generate the samples concurrently, with at most max_concurrency pending requests."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def sample():
+            async with semaphore:
+                return AIMessage(await self._generate(prompt, temperature))
+
+        return list(await asyncio.gather(*(sample() for _ in range(n_samples))))
+
+    async def _generate(self, prompt: str, temperature: float) -> str:
+        """Generate one response, retrying with a jittered exponential backoff."""
+        itr = 0
+        while True:
+            try:
+                if self.async_llm is not None:
+                    return await self.async_llm(prompt, temperature=temperature)
+                # synchronous clients are run in a thread to not block the other samples
+                return await asyncio.to_thread(self.llm, prompt, temperature=temperature)
+            except Exception as e:
+                if itr == self.n_retry_server - 1:
+                    raise e
+                logging.warning(
+                    f"Failed to get a response from the server: \n{e}\n"
+                    f"Retrying... ({itr+1}/{self.n_retry_server})"
+                )
+                # full jitter, so concurrent samples don't retry all at once
+                await asyncio.sleep(random.uniform(0, self.retry_wait_time * 2**itr))
+                itr += 1
+
     def _llm_type(self):
         return "huggingface"
 
 
+def _run_coroutine(coroutine):
+    """Run a coroutine to completion, even if the caller is already inside an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # e.g. in a notebook, run the coroutine in its own loop in a separate thread
+    result = {}
+
+    def run():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
 def _prepend_system_to_first_user(messages, column_remap={}):
     # Initialize an index for the system message
     system_index = None
@@ -6,8 +6,7 @@ import logging
 import os
 import re
 import time
-from copy import deepcopy
-from functools import cache
+from functools import cache, partial
 from typing import TYPE_CHECKING, Any, Union
 from warnings import warn
 
@@ -19,6 +18,8 @@ from langchain_community.adapters.openai import convert_message_to_dict
 from PIL import Image
 from transformers import AutoModel, AutoTokenizer
 
+from agentlab.llm.tokenizer_registry import get_tokenizer
+
 if TYPE_CHECKING:
     from agentlab.llm.chat_api import ChatModel
 
@@ -47,6 +48,7 @@ def retry(
     n_retry: int,
     parser: callable,
     log: bool = True,
+    early_stop_tag: str = None,
 ):
     """Retry querying the chat models with the response from the parser until it
     returns a valid value.
@@ -66,6 +68,8 @@ def retry(
         parser (callable): a function taking a message and retruning a parsed value,
             or raising a ParseError
         log (bool): whether to log the retry messages.
+        early_stop_tag (str): if set and the chat model supports streaming, the generation is
+            stopped as soon as this tag is closed and the answer so far is parsed successfully.
 
     Returns:
         dict: the parsed value, with a string at key "action".
@@ -75,7 +79,12 @@ def retry(
     """
     tries = 0
     while tries < n_retry:
-        answer = chat(messages)
+        if early_stop_tag is not None and hasattr(chat, "complete_until"):
+            answer = chat.complete_until(
+                messages, should_stop=partial(_is_parsable, tag=early_stop_tag, parser=parser)
+            )
+        else:
+            answer = chat(messages)
         # TODO: could we change this to not use inplace modifications ?
         messages.append(answer)
         try:
@@ -90,6 +99,17 @@ def retry(
     raise ParseError(f"Could not parse a valid value after {n_retry} retries.")
 
 
+def _is_parsable(answer: str, closed_tags: list[str], tag: str, parser: callable) -> bool:
+    """Whether the tag was just closed and the answer so far is valid for the parser."""
+    if tag not in closed_tags:
+        return False
+    try:
+        parser(answer)
+        return True
+    except ParseError:
+        return False
+
+
 def retry_multiple(
     chat: "ChatModel",
     messages: "Discussion",
@@ -155,7 +175,7 @@ def retry_multiple(
 
 def truncate_tokens(text, max_tokens=8000, start=0, model_name="gpt-4"):
     """Use tiktoken to truncate a text to a maximum number of tokens."""
-    enc = tiktoken.encoding_for_model(model_name)
+    enc = get_tokenizer(model_name)
     tokens = enc.encode(text)
     if len(tokens) - start > max_tokens:
         return enc.decode(tokens[start : (start + max_tokens)])
@@ -180,19 +200,6 @@ def get_tokenizer_old(model_name="openai/gpt-4"):
         return AutoTokenizer.from_pretrained(model_name)
 
 
-@cache
-def get_tokenizer(model_name="gpt-4"):
-    try:
-        return tiktoken.encoding_for_model(model_name)
-    except KeyError:
-        logging.info(f"Could not find a tokenizer for model {model_name}. Trying HuggingFace.")
-    try:
-        return AutoTokenizer.from_pretrained(model_name)
-    except OSError:
-        logging.info(f"Could not find a tokenizer for model {model_name}. Defaulting to gpt-4.")
-    return tiktoken.encoding_for_model("gpt-4")
-
-
 def count_tokens(text, model="openai/gpt-4"):
     enc = get_tokenizer(model)
     return len(enc.encode(text))
@@ -304,6 +311,32 @@ class ParseError(Exception):
     pass
 
 
+class StreamingTagParser:
+    """Incrementally detects the closing HTML-like tags (e.g. </action>) of a streamed text."""
+
+    CLOSING_TAG = re.compile(r"</(\w+)>")
+    MAX_TAG_LENGTH = 64
+
+    def __init__(self):
+        self.text = ""
+        self.closed_tags = []
+
+    def feed(self, chunk: str) -> list[str]:
+        """Add a chunk of text and return the tags closed in it, in order."""
+        # a tag can be split across chunks, rescan the end of the previous text
+        previous_length = len(self.text)
+        start = max(0, previous_length - self.MAX_TAG_LENGTH)
+        self.text += chunk
+
+        closed = [
+            match.group(1)
+            for match in self.CLOSING_TAG.finditer(self.text, start)
+            if match.end() > previous_length
+        ]
+        self.closed_tags.extend(closed)
+        return closed
+
+
 def extract_code_blocks(text) -> list[tuple[str, str]]:
     pattern = re.compile(r"```(\w*\n)?(.*?)```", re.DOTALL)
 
@@ -367,9 +400,30 @@ def download_and_save_model(model_name: str, save_dir: str = "."):
     print(f"Model downloaded and saved to {save_dir}")
 
 
+# urls of the last encoded images, with the images so that their ids are not reused
+_IMAGE_URL_CACHE_SIZE = 16
+_image_url_cache: collections.OrderedDict = collections.OrderedDict()
+
+
 def image_to_jpg_base64_url(image: np.ndarray | Image.Image):
-    """Convert a numpy array to a base64 encoded image url."""
+    """Convert a numpy array to a base64 encoded image url.
 
+    The prompt is rendered several times per step (e.g. when shrinking it), the urls of the last
+    images are cached to encode each screenshot only once. The images should not be modified in
+    place after being encoded.
+    """
+    key = id(image)
+    if key in _image_url_cache and _image_url_cache[key][0] is image:
+        _image_url_cache.move_to_end(key)
+        return _image_url_cache[key][1]
+    image_url = _encode_jpg_base64_url(image)
+    _image_url_cache[key] = (image, image_url)
+    if len(_image_url_cache) > _IMAGE_URL_CACHE_SIZE:
+        _image_url_cache.popitem(last=False)
+    return image_url
+
+
+def _encode_jpg_base64_url(image: np.ndarray | Image.Image):
     if isinstance(image, np.ndarray):
         image = Image.fromarray(image)
     if image.mode in ("RGBA", "LA"):
@@ -382,9 +436,19 @@ def image_to_jpg_base64_url(image: np.ndarray | Image.Image):
 
 
 class BaseMessage(dict):
+    """A chat message, in the format of the OpenAI API.
+
+    The content parts are shared with the content given at creation and with the other messages
+    (e.g. the base64 urls of the images are stored once), only the list of parts is copied. Hence,
+    the methods of this class never modify a content part in place, they replace it.
+    """
+
+    # (id, length) of the content list when it was last merged
+    _merged_key = None
+
     def __init__(self, role: str, content: Union[str, list[dict]]):
         self["role"] = role
-        self["content"] = deepcopy(content)
+        self["content"] = content if isinstance(content, str) else list(content)
 
     def __str__(self, warn_if_image=False) -> str:
         if isinstance(self["content"], str):
@@ -435,22 +499,77 @@ class BaseMessage(dict):
                 res.append(f"![image]({img_str})")
         return "\n".join(res)
 
-    def merge(self):
-        """Merges content elements of type 'text' if they are adjacent."""
+    def add_cache_breakpoint(self):
+        """Mark the end of the content as a prompt cache breakpoint.
+
+        Providers supporting explicit prompt caching (e.g. Anthropic models through OpenRouter) cache
+        the prefix of the prompt up to here, so it should be followed by the parts of the prompt that
+        change between calls. The marks are removed for the other providers, see
+        strip_cache_breakpoints.
+        """
         if isinstance(self["content"], str):
+            self["content"] = [{"type": "text", "text": self["content"]}]
+        self["content"][-1] = {**self["content"][-1], "cache_control": {"type": "ephemeral"}}
+
+    def merge(self):
+        """Merges content elements of type 'text' if they are adjacent.
+
+        Text is not merged past a cache breakpoint, so that the cached prefix stays the same. The
+        merged form is kept until content is added, so merging again is free.
+        """
+        content = self["content"]
+        if isinstance(content, str) or self._merged_key == (id(content), len(content)):
             return
         new_content = []
-        for elem in self["content"]:
-            if elem["type"] == "text":
-                if new_content and new_content[-1]["type"] == "text":
-                    new_content[-1]["text"] += "\n" + elem["text"]
-                else:
-                    new_content.append(elem)
-            else:
-                new_content.append(elem)
-        self["content"] = new_content
-        if len(self["content"]) == 1:
-            self["content"] = self["content"][0]["text"]
+        # texts of the text part being built, joined once at the end
+        texts = None
+        for elem in content:
+            if (
+                elem["type"] == "text"
+                and new_content
+                and new_content[-1]["type"] == "text"
+                and "cache_control" not in new_content[-1]
+            ):
+                if texts is None:
+                    texts = [new_content[-1]["text"]]
+                    new_content[-1] = dict(new_content[-1])
+                texts.append(elem["text"])
+                if "cache_control" in elem:
+                    new_content[-1]["cache_control"] = elem["cache_control"]
+                continue
+            if texts is not None:
+                new_content[-1]["text"] = "\n".join(texts)
+                texts = None
+            new_content.append(elem)
+        if texts is not None:
+            new_content[-1]["text"] = "\n".join(texts)
+
+        if (
+            len(new_content) == 1
+            and new_content[0]["type"] == "text"
+            and "cache_control" not in new_content[0]
+        ):
+            self["content"] = new_content[0]["text"]
+        else:
+            self["content"] = new_content
+            self._merged_key = (id(new_content), len(new_content))
+
+
+def strip_cache_breakpoints(messages: list[dict]) -> list[dict]:
+    """Remove the prompt cache breakpoints, for providers that don't support them.
+
+    Messages without breakpoints are returned as is, the others are copied.
+    """
+    stripped = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list) and any("cache_control" in elem for elem in content):
+            message = dict(message)
+            message["content"] = [
+                {k: v for k, v in elem.items() if k != "cache_control"} for elem in content
+            ]
+        stripped.append(message)
+    return stripped
 
 
 class SystemMessage(BaseMessage):
@@ -495,6 +614,10 @@ class Discussion:
         self.merge()
         return self.messages
 
+    def copy(self) -> "Discussion":
+        """Copy the list of messages, the messages themselves are shared."""
+        return Discussion(list(self.messages))
+
     def add_message(
         self,
         message: BaseMessage | dict = None,
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+from pathlib import Path
+
+# Set this environment variable to a path to enable the response cache of all chat models
+RESPONSE_CACHE_ENV_VAR = "AGENTLAB_LLM_CACHE"
+
+
+class ResponseCache:
+    """Persistent cache of chat completions, stored in SQLite.
+
+    Responses are keyed on a hash of (model, messages, temperature, max_tokens, n), so relaunching a
+    study with byte-identical prompts replays the same answers without calling the API. Note that
+    with a non-zero temperature, the first sampled answer is replayed as well.
+
+    The least recently used responses are evicted when the cache exceeds max_entries or max_size_mb,
+    or when they are older than ttl. The file can be shared by several processes.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = 100_000,
+        max_size_mb: float = 1024,
+        ttl: float = None,
+        evict_every: int = 100,
+    ):
+        """
+        Args:
+            path: Path of the SQLite database.
+            max_entries: Maximum number of cached responses.
+            max_size_mb: Maximum total size of the cached responses, in MB.
+            ttl: Responses older than this number of seconds are evicted. None means never.
+            evict_every: Number of insertions between two evictions.
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_size_mb = max_size_mb
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._n_puts = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @staticmethod
+    def key(model_name: str, messages, temperature: float, max_tokens: int, n: int) -> str:
+        """Hash of everything that determines the response of the API."""
+        payload = json.dumps(
+            {
+                "model": model_name,
+                "messages": [dict(message) for message in messages],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "n": n,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # connections can't be shared with forked processes
+        if self._connection is None or self._connection_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, size INTEGER, created_at REAL, accessed_at REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> dict | None:
+        """Return the cached response, or None if it is missing or expired.
+
+        The response is a dict with the "contents" of the choices, and the "input_tokens" and
+        "output_tokens" of the original call.
+        """
+        with self._lock:
+            connection = self._get_connection()
+            row = connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                return None
+
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            connection.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, contents: list[str], input_tokens: int = 0, output_tokens: int = 0):
+        """Store the contents of the choices of a response."""
+        response = json.dumps(
+            {"contents": contents, "input_tokens": input_tokens, "output_tokens": output_tokens}
+        )
+        now = time.time()
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response), now, now),
+            )
+            connection.commit()
+
+            self._n_puts += 1
+            if self._n_puts % self.evict_every == 0:
+                self._evict(connection)
+
+    def evict(self):
+        """Remove the expired responses and the least recently used ones above the size caps."""
+        with self._lock:
+            self._evict(self._get_connection())
+
+    def _evict(self, connection: sqlite3.Connection):
+        if self.ttl is not None:
+            connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+
+        n_entries, total_size = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        max_size = self.max_size_mb * 1024 * 1024
+        if n_entries > self.max_entries or total_size > max_size:
+            # walk the responses from the most recently used, and delete those above the caps
+            n_kept, kept_size, threshold = 0, 0, None
+            for size, accessed_at in connection.execute(
+                "SELECT size, accessed_at FROM responses ORDER BY accessed_at DESC"
+            ):
+                if n_kept + 1 > self.max_entries or kept_size + size > max_size:
+                    threshold = accessed_at
+                    break
+                n_kept += 1
+                kept_size += size
+            if threshold is not None:
+                connection.execute("DELETE FROM responses WHERE accessed_at <= ?", (threshold,))
+                logging.info(f"Evicted LLM responses from the cache, {n_kept} responses left.")
+
+        connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._get_connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+@cache
+def _get_response_cache(path: str) -> ResponseCache:
+    return ResponseCache(path)
+
+
+def get_response_cache_from_env() -> ResponseCache | None:
+    """Return the process-wide response cache if AGENTLAB_LLM_CACHE is set, None otherwise."""
+    path = os.getenv(RESPONSE_CACHE_ENV_VAR)
+    if not path:
+        return None
+    return _get_response_cache(path)
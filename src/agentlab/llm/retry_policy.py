@@ -0,0 +1,194 @@
+import email.utils
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import openai
+
+
+@dataclass
+class RetryPolicy:
+    """Backoff policy for one class of API errors, using decorrelated jitter.
+
+    The n-th wait time is drawn uniformly between base_wait_time and 3 times the previous wait
+    time, capped at max_wait_time. If the server says when to retry (Retry-After headers or a
+    "try again in Xs" message), that delay is used instead, within the same bounds.
+
+    Args:
+        base_wait_time: Minimum wait time between two attempts, in seconds.
+        max_wait_time: Maximum wait time between two attempts, in seconds.
+        retryable: If False, errors of this class are raised without retrying.
+    """
+
+    base_wait_time: float = 1.0
+    max_wait_time: float = 60.0
+    retryable: bool = True
+
+    def wait_time(self, previous_wait_time: float, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return min(self.max_wait_time, max(self.base_wait_time, retry_after))
+        upper = max(self.base_wait_time, previous_wait_time * 3)
+        return min(self.max_wait_time, random.uniform(self.base_wait_time, upper))
+
+
+NO_RETRY = RetryPolicy(retryable=False)
+
+
+def default_retry_policies(
+    min_retry_wait_time: float = 5, max_retry_wait_time: float = 60
+) -> dict[type, RetryPolicy]:
+    """The retry policies of ChatModel, from the most to the least specific error class.
+
+    Transient server and connection errors are retried within seconds, rate limits follow the
+    delay given by the server, and client errors that would fail again are not retried.
+
+    Args:
+        min_retry_wait_time: Minimum wait time for rate limits and unknown errors, in seconds.
+        max_retry_wait_time: Maximum wait time for rate limits and unknown errors, in seconds.
+    """
+    return {
+        CircuitOpenError: RetryPolicy(base_wait_time=1, max_wait_time=max_retry_wait_time),
+        openai.RateLimitError: RetryPolicy(
+            base_wait_time=min_retry_wait_time, max_wait_time=max_retry_wait_time
+        ),
+        openai.InternalServerError: RetryPolicy(base_wait_time=0.5, max_wait_time=30),
+        openai.APIConnectionError: RetryPolicy(base_wait_time=0.5, max_wait_time=30),
+        openai.AuthenticationError: NO_RETRY,
+        openai.PermissionDeniedError: NO_RETRY,
+        openai.NotFoundError: NO_RETRY,
+        openai.BadRequestError: NO_RETRY,
+        openai.UnprocessableEntityError: NO_RETRY,
+        openai.OpenAIError: RetryPolicy(
+            base_wait_time=min_retry_wait_time, max_wait_time=max_retry_wait_time
+        ),
+    }
+
+
+def get_retry_policy(error: Exception, retry_policies: dict[type, RetryPolicy]) -> RetryPolicy:
+    for error_class, policy in retry_policies.items():
+        if isinstance(error, error_class):
+            return policy
+    return NO_RETRY
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """Return the delay requested by the server before retrying, if any.
+
+    Looks at the retry-after-ms and Retry-After headers of the response, then at the
+    "try again in Xs" hint of the error message.
+    """
+    if isinstance(error, CircuitOpenError):
+        return error.retry_after
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(
+                    0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+                )
+            except (TypeError, ValueError):
+                pass
+
+    message = error.args[0] if error.args and isinstance(error.args[0], str) else str(error)
+    match = re.search(r"try again in (\d+(\.\d+)?)s", message)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class CircuitOpenError(openai.OpenAIError):
+    """Raised instead of sending a request to an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Circuit breaker open for {endpoint}, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint that keeps failing.
+
+    After failure_threshold consecutive server or connection errors, the circuit opens and
+    requests fail immediately with CircuitOpenError for reset_timeout seconds. Then a single
+    request is let through: if it succeeds the circuit closes, if the endpoint fails it opens
+    again, and if it fails for another reason (e.g. a rate limit) the next request probes again.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.n_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_request(self) -> bool:
+        """Raise CircuitOpenError if the circuit is open, return True if the request is the probe."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(self.endpoint, max(remaining, 1.0))
+            # half-open: let this request probe the endpoint
+            self.probing = True
+            return True
+
+    def release_probe(self):
+        """End a probe that failed for a reason unrelated to the health of the endpoint."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f"Circuit breaker closed for {self.endpoint}.")
+            self.n_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.n_failures += 1
+            if self.probing or self.n_failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    logging.warning(
+                        f"Circuit breaker opened for {self.endpoint} after {self.n_failures} failures."
+                    )
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+# errors showing that the endpoint itself is unhealthy
+ENDPOINT_FAILURES = (openai.InternalServerError, openai.APIConnectionError)
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the circuit breaker of an endpoint, shared by all the models of the process."""
+    with _circuit_breakers_lock:
+        if endpoint not in _circuit_breakers:
+            _circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        return _circuit_breakers[endpoint]
@@ -0,0 +1,157 @@
+"""
+Registry of the tokenizers used to count the tokens of the prompts.
+
+Model names are resolved to a tiktoken encoding with an explicit mapping, after stripping the
+provider prefixes (e.g. aicore/gpt-4o or openai/gpt-4o-mini), so that no HuggingFace lookup is made
+for models served through an API. Only the other names are looked up on HuggingFace.
+
+The registry also provides a fast estimate of the number of tokens, from the number of bytes of the
+text and a ratio of bytes per token calibrated on the exact counts of each model.
+"""
+
+import logging
+import math
+import threading
+from functools import cache
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# prefixes of the model names giving the provider serving the model
+PROVIDER_PREFIXES = ("aicore", "openai", "azure", "openrouter", "test")
+
+# vendors whose models have no public tokenizer, their tokens are counted with the default encoding
+APPROXIMATED_VENDORS = ("anthropic", "google", "reka", "x-ai", "cohere")
+
+# prefix of the model name -> tiktoken encoding, the longest matching prefix is used
+MODEL_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "chatgpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "gpt-4.5": "o200k_base",
+    "gpt-5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-35": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+    "text-embedding-3": "cl100k_base",
+    "text-embedding-ada-002": "cl100k_base",
+    "claude": DEFAULT_ENCODING,
+    "gemini": DEFAULT_ENCODING,
+    "reka": DEFAULT_ENCODING,
+}
+
+# average number of bytes per token of each encoding, before calibration
+BYTES_PER_TOKEN = {
+    "o200k_base": 4.2,
+    "cl100k_base": 4.0,
+}
+DEFAULT_BYTES_PER_TOKEN = 4.0
+
+_calibrated_bytes_per_token: dict[str, float] = {}
+_calibration_lock = threading.Lock()
+
+
+def register_tokenizer(model_prefix: str, encoding: str):
+    """Count the tokens of the models starting with model_prefix with a tiktoken encoding."""
+    MODEL_ENCODINGS[model_prefix] = encoding
+    resolve_encoding.cache_clear()
+    get_tokenizer.cache_clear()
+
+
+def _strip_provider(model_name: str) -> tuple[str, bool]:
+    """Remove the provider prefixes of a model name, e.g. aicore/openai/gpt-4o -> gpt-4o."""
+    has_provider = False
+    while "/" in model_name and model_name.split("/", 1)[0].lower() in PROVIDER_PREFIXES:
+        model_name = model_name.split("/", 1)[1]
+        has_provider = True
+    return model_name, has_provider
+
+
+@cache
+def resolve_encoding(model_name: str) -> str | None:
+    """Return the tiktoken encoding of a model, or None if it should be looked up on HuggingFace."""
+    name, has_provider = _strip_provider(model_name)
+    lower_name = name.lower()
+
+    vendor, _, short_name = lower_name.rpartition("/")
+    if vendor in APPROXIMATED_VENDORS:
+        return DEFAULT_ENCODING
+
+    for prefix in sorted(MODEL_ENCODINGS, key=len, reverse=True):
+        if short_name.startswith(prefix):
+            return MODEL_ENCODINGS[prefix]
+    try:
+        return tiktoken.encoding_name_for_model(short_name)
+    except KeyError:
+        pass
+
+    if has_provider:
+        logging.info(
+            f"No tokenizer registered for model {model_name}. Defaulting to {DEFAULT_ENCODING}."
+        )
+        return DEFAULT_ENCODING
+    return None
+
+
+@cache
+def get_tokenizer(model_name="gpt-4"):
+    encoding = resolve_encoding(model_name)
+    if encoding is not None:
+        return tiktoken.get_encoding(encoding)
+
+    from transformers import AutoTokenizer
+
+    try:
+        return AutoTokenizer.from_pretrained(model_name)
+    except OSError:
+        logging.info(f"Could not find a tokenizer for model {model_name}. Defaulting to gpt-4.")
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def warm_up_tokenizers(model_names: list[str]):
+    """Load the tokenizers of the models, e.g. when a worker starts, so that the first prompt of
+    the first episode doesn't wait for it. Failures are logged and ignored."""
+    for model_name in model_names:
+        if not model_name:
+            continue
+        try:
+            get_tokenizer(model_name).encode("warm up")
+        except Exception as e:
+            logging.warning(f"Could not load the tokenizer of {model_name}: {e}")
+
+
+def _bytes_per_token(model_name: str) -> float:
+    ratio = _calibrated_bytes_per_token.get(model_name)
+    if ratio is None:
+        ratio = BYTES_PER_TOKEN.get(resolve_encoding(model_name), DEFAULT_BYTES_PER_TOKEN)
+    return ratio
+
+
+def estimate_tokens(text: str, model_name="gpt-4") -> int:
+    """Fast estimate of the number of tokens of a text, without tokenizing it.
+
+    The estimate is the number of bytes divided by the bytes per token of the model, which is
+    calibrated on the exact counts given to calibrate_estimate.
+    """
+    return math.ceil(len(text.encode("utf-8")) / _bytes_per_token(model_name))
+
+
+def calibrate_estimate(model_name: str, text: str, n_tokens: int, weight: float = 0.5):
+    """Update the bytes per token of the model from an exact count.
+
+    Args:
+        model_name: The name of the model.
+        text: The text that was tokenized.
+        n_tokens: Its exact number of tokens.
+        weight: Weight of this count in the moving average of the ratio.
+    """
+    n_bytes = len(text.encode("utf-8"))
+    if n_tokens <= 0 or n_bytes == 0:
+        return
+    with _calibration_lock:
+        ratio = _bytes_per_token(model_name)
+        _calibrated_bytes_per_token[model_name] = (1 - weight) * ratio + weight * n_bytes / n_tokens
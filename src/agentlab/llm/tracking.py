@@ -14,14 +14,22 @@ class LLMTracker:
         self.input_tokens = 0
         self.output_tokens = 0
         self.cost = 0.0
+        # input tokens served from the prompt cache of the provider, included in input_tokens
+        self.cached_input_tokens = 0
         self.input_tokens_key = "input_tokens_" + suffix if suffix else "input_tokens"
         self.output_tokens_key = "output_tokens_" + suffix if suffix else "output_tokens"
         self.cost_key = "cost_" + suffix if suffix else "cost"
+        self.cached_input_tokens_key = (
+            "cached_input_tokens_" + suffix if suffix else "cached_input_tokens"
+        )
 
-    def __call__(self, input_tokens: int, output_tokens: int, cost: float):
+    def __call__(
+        self, input_tokens: int, output_tokens: int, cost: float, cached_input_tokens: int = 0
+    ):
         self.input_tokens += input_tokens
         self.output_tokens += output_tokens
         self.cost += cost
+        self.cached_input_tokens += cached_input_tokens
 
     @property
     def stats(self):
@@ -29,13 +37,14 @@ class LLMTracker:
             self.input_tokens_key: self.input_tokens,
             self.output_tokens_key: self.output_tokens,
             self.cost_key: self.cost,
+            self.cached_input_tokens_key: self.cached_input_tokens,
         }
 
     def add_tracker(self, tracker: "LLMTracker"):
-        self(tracker.input_tokens, tracker.output_tokens, tracker.cost)
+        self(tracker.input_tokens, tracker.output_tokens, tracker.cost, tracker.cached_input_tokens)
 
     def __repr__(self):
-        return f"LLMTracker(input_tokens={self.input_tokens}, output_tokens={self.output_tokens}, cost={self.cost})"
+        return f"LLMTracker(input_tokens={self.input_tokens}, output_tokens={self.output_tokens}, cost={self.cost}, cached_input_tokens={self.cached_input_tokens})"
 
 
 @contextmanager
@@ -17,17 +17,21 @@ class GenericAgentArgsWithSleep(GenericAgentArgs):
 
     def make_agent(self):
         return GenericAgentWithSleepAndExtractedMainPrompt(
-            chat_model_args=self.chat_model_args, flags=self.flags, max_retry=self.max_retry, sleep_time=self.sleep_time
+            chat_model_args=self.chat_model_args,
+            flags=self.flags,
+            max_retry=self.max_retry,
+            sleep_time=self.sleep_time,
+            early_stop_on_action=self.early_stop_on_action,
         )
 
 class GenericAgentWithSleepAndExtractedMainPrompt(GenericAgent):
     """
-    Overrides the GenericAgent to include a sleep time before getting the action.
-    This is useful to avoid hitting the rate limit of the AI core.
+    Overrides the GenericAgent to include an optional sleep time before getting the action.
+    Rate limits of the AI core are handled by the chat model, see aicore.rate_limiter.
     
     It also extracts the get_main_prompt method to allow subclasses to override it if needed.
     
-    Without any overrides, it behaves like the GenericAgent, but with a sleep time before calling the implementation.
+    Without any overrides, it behaves like the GenericAgent.
     """
 
     def __init__(
@@ -36,21 +40,31 @@ class GenericAgentWithSleepAndExtractedMainPrompt(GenericAgent):
         flags: GenericPromptFlags,
         max_retry: int = 4,
         sleep_time: int = 0,
+        early_stop_on_action: bool = False,
     ):
-        super().__init__(chat_model_args, flags, max_retry)
+        super().__init__(chat_model_args, flags, max_retry, early_stop_on_action)
         self.sleep_time = sleep_time
 
     def get_action(self, obs):
 
         """
-        Get the action from the agent, with a sleep time to avoid hitting the rate limit of the AI core.
-        This method overrides the base class method to include a sleep time before calling the implementation.
+        Get the action from the agent, with an optional sleep time before calling the implementation.
+
+        Rate limits of the AI core are enforced by the chat model itself (see aicore.rate_limiter),
+        so the sleep time defaults to 0 and is only kept for backward compatibility.
         """
 
-        print(f"Sleeping for {self.sleep_time} seconds to avoid AI core rate limit")
-        sleep(self.sleep_time)
+        if self.sleep_time > 0:
+            print(f"Sleeping for {self.sleep_time} seconds to avoid AI core rate limit")
+            sleep(self.sleep_time)
         return self._get_action_impl(obs)
 
+    def get_extra_stats(self) -> dict:
+        """
+        Additional statistics added to agent_info.stats at each step. Override in subclasses.
+        """
+        return {}
+
     def get_main_prompt(self) -> MainPrompt:
         return MainPrompt(
             action_set=self.action_set,
@@ -94,6 +108,7 @@ class GenericAgentWithSleepAndExtractedMainPrompt(GenericAgent):
                 chat_messages,
                 n_retry=self.max_retry,
                 parser=main_prompt._parse_answer,
+                early_stop_tag="action" if self.early_stop_on_action else None,
             )
             ans_dict["busted_retry"] = 0
             # inferring the number of retries, TODO: make this less hacky
@@ -108,6 +123,7 @@ class GenericAgentWithSleepAndExtractedMainPrompt(GenericAgent):
         stats = self.chat_llm.get_stats()
         stats["n_retry"] = ans_dict["n_retry"]
         stats["busted_retry"] = ans_dict["busted_retry"]
+        stats.update(self.get_extra_stats())
 
         self.plan = ans_dict.get("plan", self.plan)
         self.plan_step = ans_dict.get("step", self.plan_step)
@@ -8,5 +8,8 @@ EXTENDED_CHAT_MODEL_ARGS_DICT.update({
         max_total_tokens=16_384,
         max_input_tokens=16_384,
         max_new_tokens=4096,
+        # budgets of the deployment, shared by all workers. Adjust to your AI Core quota.
+        requests_per_minute=60,
+        tokens_per_minute=200_000,
     ),
 })
@@ -1,17 +1,42 @@
+from dataclasses import dataclass
+
 from gen_ai_hub.proxy.native.openai import OpenAI as AiCoreOpenAI
 
 from agentlab.llm import tracking
-from agentlab.llm.chat_api import ChatModel, OpenAIModelArgs
+from agentlab.llm.chat_api import ChatModel, OpenAIModelArgs, estimate_prompt_tokens
+from agentlab.llm.response_cache import ResponseCache
+from aicore.rate_limiter import RateLimit, TokenBucketRateLimiter, get_rate_limiter
 
+@dataclass
 class AiCoreOpenAIModelArgs(OpenAIModelArgs):
     """Serializable object for instantiating a generic chat model with an OpenAI
-    model."""
+    model.
+
+    The rate limits are shared by every worker using the same model and deployment, agents
+    only wait when the budget of the deployment is exhausted.
+    """
+
+    deployment_id: str = "default"
+    requests_per_minute: int = None
+    tokens_per_minute: int = None
 
     def make_model(self) -> ChatModel:
         return AiCoreOpenAiChatModel(
             model_name=self.model_name,
             temperature=self.temperature,
             max_tokens=self.max_new_tokens,
+            rate_limiter=self.make_rate_limiter(),
+        )
+
+    def make_rate_limiter(self) -> TokenBucketRateLimiter:
+        """The rate limiter of the deployment, to share its budget with other clients of it."""
+        return get_rate_limiter(
+            self.model_name,
+            self.deployment_id,
+            RateLimit(
+                requests_per_minute=self.requests_per_minute,
+                tokens_per_minute=self.tokens_per_minute,
+            ),
         )
 
 class AiCoreOpenAiOverrideClient(AiCoreOpenAI):
@@ -26,7 +51,10 @@ class AiCoreOpenAiChatModel(ChatModel):
         temperature=0.5,
         max_tokens=100,
         max_retry=4,
-        min_retry_wait_time=60,
+        min_retry_wait_time=5,
+        max_retry_wait_time=60,
+        rate_limiter: TokenBucketRateLimiter = None,
+        response_cache: ResponseCache = None,
     ):
         super().__init__(
             model_name=model_name,
@@ -34,6 +62,27 @@ class AiCoreOpenAiChatModel(ChatModel):
             max_tokens=max_tokens,
             max_retry=max_retry,
             min_retry_wait_time=min_retry_wait_time,
+            max_retry_wait_time=max_retry_wait_time,
             client_class=AiCoreOpenAiOverrideClient,
             pricing_func=tracking.get_pricing_openai,
+            response_cache=response_cache,
         )
+        self.rate_limiter = rate_limiter
+
+    def _reset_stats(self):
+        # reset at each request, streamed or not
+        super()._reset_stats()
+        self.rate_limit_wait_time = 0.0
+
+    def _create_completion(self, messages, n_samples: int, temperature: float, **kwargs):
+        # only requests sent to the deployment count against its budget, not cached responses
+        if self.rate_limiter is not None:
+            # the deployment reserves max_tokens for each sample, count them as used
+            tokens = estimate_prompt_tokens(messages, self.model_name) + n_samples * self.max_tokens
+            self.rate_limit_wait_time += self.rate_limiter.acquire(tokens=tokens)
+        return super()._create_completion(messages, n_samples, temperature, **kwargs)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["rate_limit_wait_time"] = self.rate_limit_wait_time
+        return stats
@@ -0,0 +1,196 @@
+"""
+Token-bucket rate limiting for AI Core deployments.
+
+Each (model, deployment) pair owns two buckets: one for requests per minute and one for tokens
+per minute. The bucket levels live in a small JSON file guarded by an exclusive file lock, so
+every worker process on the host (ray, joblib, ...) draws from the same budget. Callers only
+wait when a budget is actually exhausted.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DIR = Path(
+    os.getenv("AGENTLAB_RATE_LIMIT_DIR", Path(tempfile.gettempdir()) / "agentlab_rate_limits")
+)
+
+
+@dataclass
+class RateLimit:
+    """Per-minute budgets of a deployment. None disables the corresponding bucket."""
+
+    requests_per_minute: int = None
+    tokens_per_minute: int = None
+
+    @property
+    def is_unlimited(self) -> bool:
+        return self.requests_per_minute is None and self.tokens_per_minute is None
+
+
+class InProcessBackend:
+    """Keeps bucket levels in memory. Only shared between threads of the same process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @contextmanager
+    def locked_state(self, key: str):
+        with self._lock:
+            state = self._states.setdefault(key, {})
+            yield state
+
+
+class FileLockBackend:
+    """Keeps bucket levels in a JSON file per key, guarded by an exclusive `flock`.
+
+    All processes pointing to the same directory share the budget.
+    """
+
+    def __init__(self, directory: str | Path = None):
+        self.directory = Path(directory) if directory is not None else RATE_LIMIT_DIR
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (re.sub(r"[^\w.-]", "_", key) + ".json")
+
+    @contextmanager
+    def locked_state(self, key: str):
+        path = self._path(key)
+        with open(path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    logger.warning(f"Corrupted rate limit state in {path}, resetting it.")
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class TokenBucketRateLimiter:
+    """Request and token budgets of one deployment, shared through a backend.
+
+    Buckets start full and refill continuously at `budget / 60` units per second.
+
+    Args:
+        key: str
+            Identifier of the budget, typically "<model>@<deployment>".
+        rate_limit: RateLimit
+            The per-minute budgets.
+        backend: FileLockBackend | InProcessBackend
+            Where the bucket levels are stored. Defaults to a FileLockBackend in RATE_LIMIT_DIR.
+    """
+
+    def __init__(self, key: str, rate_limit: RateLimit, backend=None):
+        self.key = key
+        self.rate_limit = rate_limit
+        self.backend = backend if backend is not None else FileLockBackend()
+
+    def _buckets(self, tokens: int):
+        """Yield (name, capacity, amount) for every enabled bucket."""
+        if self.rate_limit.requests_per_minute is not None:
+            yield "requests", self.rate_limit.requests_per_minute, 1
+        if self.rate_limit.tokens_per_minute is not None:
+            yield "tokens", self.rate_limit.tokens_per_minute, tokens
+
+    @staticmethod
+    def _refill(state: dict, name: str, capacity: float, now: float) -> float:
+        level, last = state.get(name, (capacity, now))
+        level = min(capacity, level + (now - last) * capacity / 60)
+        state[name] = (level, now)
+        return level
+
+    def _try_acquire(self, state: dict, tokens: int, now: float) -> float:
+        """Take from all buckets if they all have enough, otherwise return the time to wait."""
+        wait_time = 0.0
+        levels = {}
+        for name, capacity, amount in self._buckets(tokens):
+            levels[name] = self._refill(state, name, capacity, now)
+            if levels[name] < amount:
+                wait_time = max(wait_time, (amount - levels[name]) * 60 / capacity)
+
+        if wait_time > 0:
+            return wait_time
+
+        for name, _, amount in self._buckets(tokens):
+            state[name] = (levels[name] - amount, now)
+        return 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request of `tokens` tokens fits in the budgets.
+
+        Args:
+            tokens: int
+                Estimated number of tokens (prompt + completion) of the request.
+
+        Returns:
+            float: the number of seconds spent waiting.
+        """
+        if self.rate_limit.is_unlimited:
+            return 0.0
+
+        tpm = self.rate_limit.tokens_per_minute
+        if tpm is not None and tokens > tpm:
+            logger.warning(
+                f"Request of {tokens} tokens exceeds the budget of {tpm} tokens per minute for "
+                f"{self.key}. Waiting for a full bucket instead."
+            )
+            tokens = tpm
+
+        waited = 0.0
+        while True:
+            with self.backend.locked_state(self.key) as state:
+                wait_time = self._try_acquire(state, tokens, time.time())
+            if wait_time == 0:
+                if waited > 0:
+                    logger.info(f"Waited {waited:.1f}s for the rate limit of {self.key}.")
+                return waited
+            time.sleep(wait_time)
+            waited += wait_time
+
+
+# Budgets of the AI Core deployments called outside of a chat model (e.g. the LLM and embeddings of
+# graph grounding), by model. Adjust to your AI Core quota.
+DEPLOYMENT_RATE_LIMITS = {
+    "gpt-4o": RateLimit(requests_per_minute=60, tokens_per_minute=200_000),
+    "text-embedding-3-small": RateLimit(requests_per_minute=600, tokens_per_minute=1_000_000),
+}
+
+
+def get_rate_limiter(
+    model_name: str, deployment_id: str = "default", rate_limit: RateLimit = None
+) -> TokenBucketRateLimiter:
+    """Rate limiter of a deployment, drawing from the same buckets as every other limiter of it.
+
+    Args:
+        model_name: str
+            The model of the deployment.
+        deployment_id: str
+            The AI Core deployment.
+        rate_limit: RateLimit
+            The per-minute budgets. Defaults to DEPLOYMENT_RATE_LIMITS, unlimited if the model is
+            not listed.
+    """
+    if rate_limit is None:
+        rate_limit = DEPLOYMENT_RATE_LIMITS.get(model_name, RateLimit())
+    return TokenBucketRateLimiter(key=f"{model_name}@{deployment_id}", rate_limit=rate_limit)
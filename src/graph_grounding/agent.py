@@ -1,36 +1,99 @@
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 from agentlab.agents.generic_agent.generic_agent_prompt import MainPrompt
 from agentlab_ext.genericagent_ext import GenericAgentWithSleepAndExtractedMainPrompt
-from graph_grounding.embeddings import Vectorizer
 from graph_grounding.prompt.main_prompt import MainPromptWithGraph
 
 from .constant import POCIterations
+from .embeddings import EMBEDDING_MODEL_NAME, Vectorizer
+from .graph_store import GRAPH_STORE_PATH, load_graph_store
 from .retriever import NavigationGraphGroundingRetrieverFactory
+from .retriever.retrieval_cache import RetrievalCache, RetrievalCacheScope, get_shared_retrieval_cache
 from .llm import LLM
 from .navigation_graph import create_navigation_graph_client
 from .state_abstraction import StateAbstractorFactory
 
-from time import sleep
-
 POC_ITERATION = POCIterations.FOUR
+GRAPH_GROUNDING_LLM_NAME = "gpt-4o"
+USE_LOCAL_VECTOR_INDEX = True
+# Run the retrieval in the background while the observation is preprocessed
+PREFETCH_GRAPH_GROUNDING = True
+
+_NOT_CACHED = object()
 
 class GraphGroundingAgent(GenericAgentWithSleepAndExtractedMainPrompt):
     """
     Graph Grounding Agent
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        retrieval_cache_scope: RetrievalCacheScope = RetrievalCacheScope.EPISODE,
+        **kwargs,
+    ):
+        """
+        :param retrieval_cache_scope: Lifetime of the cached retrieval results, the current episode
+            or all the episodes of the process.
+        """
+        # created before super().__init__, which calls reset()
+        self.retrieval_cache_scope = retrieval_cache_scope
+        if retrieval_cache_scope == RetrievalCacheScope.EPISODE:
+            self.retrieval_cache = RetrievalCache()
+        else:
+            self.retrieval_cache = get_shared_retrieval_cache()
+        self.retrieval_cache_hits = 0
+        self.retrieval_cache_misses = 0
+        self.retrieval_wait_time = 0.0
+
         super().__init__(*args, **kwargs)
 
-        self.navigation_graph = create_navigation_graph_client()
-        self.llm = LLM("gpt-4o")
+        if GRAPH_STORE_PATH:
+            # retrieve from the exported snapshot of the navigation graph, without Neo4j
+            self.navigation_graph = None
+            self.graph_store = load_graph_store(GRAPH_STORE_PATH)
+            self.embeddings = Vectorizer(model_name=EMBEDDING_MODEL_NAME)
+        else:
+            self.navigation_graph = create_navigation_graph_client()
+            self.graph_store = None
+            # share the vectorizer (and its embedding cache) with the navigation graph
+            self.embeddings = self.navigation_graph.embeddings
+        self.llm = LLM(GRAPH_GROUNDING_LLM_NAME, rate_limiter=self._make_llm_rate_limiter())
 
-        self.embeddings = Vectorizer(model_name="text-embedding-3-small")
         self.state_abstractor = StateAbstractorFactory(POC_ITERATION, self.llm).create()
         self.retriever = NavigationGraphGroundingRetrieverFactory(
             POC_ITERATION,
             self.navigation_graph,
-            self.embeddings
+            self.embeddings,
+            use_vector_index=USE_LOCAL_VECTOR_INDEX,
+            graph_store=self.graph_store,
         ).create()
+        # a single worker keeps the retrievals of an agent sequential
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="graph-grounding")
+        # the loop drops the agent at the end of the episode without closing it
+        self._shutdown_retrieval_executor = weakref.finalize(
+            self, self.retrieval_executor.shutdown, wait=False
+        )
+
+    def close(self):
+        """
+        Shut down the retrieval thread. Otherwise, it is shut down when the agent is garbage
+        collected at the end of the episode.
+        """
+        self._shutdown_retrieval_executor()
+
+    def _make_llm_rate_limiter(self):
+        """
+        Share the budget of the chat model when graph grounding calls the same AI Core model,
+        otherwise the LLM uses the default budget of its model.
+        """
+        make_rate_limiter = getattr(self.chat_model_args, "make_rate_limiter", None)
+        same_model = self.chat_model_args.model_name == GRAPH_GROUNDING_LLM_NAME
+        if make_rate_limiter is not None and same_model:
+            return make_rate_limiter()
+        return None
 
     def _get_graph_grounding(self, current_observation: dict):
         """
@@ -38,11 +101,43 @@ class GraphGroundingAgent(GenericAgentWithSleepAndExtractedMainPrompt):
         """
         try:
             current_state_repr = self.state_abstractor.abstract_state(current_observation)
-            return self.retriever.retrieve(current_state_repr, current_observation["goal"])
+            goal = current_observation["goal"]
+            key = (current_state_repr, goal, type(self.retriever).__name__)
+
+            grounding = self.retrieval_cache.get(key, _NOT_CACHED)
+            if grounding is not _NOT_CACHED:
+                self.retrieval_cache_hits += 1
+                return grounding
+
+            self.retrieval_cache_misses += 1
+            grounding = self.retriever.retrieve(current_state_repr, goal)
+            self.retrieval_cache.put(key, grounding)
+            return grounding
         except Exception as e:
+            # failed retrievals are not cached, they will be retried at the next step
             print(f"Error retrieving graph grounding: {e}")
             return None
 
+    def reset(self, seed=None):
+        super().reset(seed=seed)
+        if self.retrieval_cache_scope == RetrievalCacheScope.EPISODE:
+            self.retrieval_cache.clear()
+
+    def get_extra_stats(self) -> dict:
+        """
+        Report the retrieval cache hits and misses of the current step, and the time spent
+        waiting for the retrieval after the observation was preprocessed.
+        """
+        stats = {
+            "n_retrieval_cache_hit": self.retrieval_cache_hits,
+            "n_retrieval_cache_miss": self.retrieval_cache_misses,
+            "retrieval_wait_time": self.retrieval_wait_time,
+        }
+        self.retrieval_cache_hits = 0
+        self.retrieval_cache_misses = 0
+        self.retrieval_wait_time = 0.0
+        return stats
+
     def get_main_prompt(self) -> MainPrompt:
         return MainPromptWithGraph(
             action_set=self.action_set,
@@ -56,18 +151,24 @@ class GraphGroundingAgent(GenericAgentWithSleepAndExtractedMainPrompt):
         )
 
     def obs_preprocessor(self, obs):
-        # sleep to avoid AI core rate limit
-        print(f"Sleeping for 5 seconds to avoid AI core rate limit")
-        sleep(5)
-
-        obs = super().obs_preprocessor(obs)
-
         if not self.flags.obs.use_graph:
-            return obs
+            return super().obs_preprocessor(obs)
 
         #######################################################
         # Inference Time: Query the navigation graph to get   #
         # possible next actions to take.                      #
         #######################################################
-        obs["graph_grounding"] = self._get_graph_grounding(obs)
+        if not PREFETCH_GRAPH_GROUNDING:
+            obs = super().obs_preprocessor(obs)
+            obs["graph_grounding"] = self._get_graph_grounding(obs)
+            return obs
+
+        # the goal and the url are known from the raw observation, so the goal embedding and the
+        # graph query overlap with the DOM / AXTree flattening of the preprocessing
+        grounding = self.retrieval_executor.submit(self._get_graph_grounding, dict(obs))
+        obs = super().obs_preprocessor(obs)
+
+        start = time.time()
+        obs["graph_grounding"] = grounding.result()
+        self.retrieval_wait_time += time.time() - start
         return obs
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from agentlab.agents.dynamic_prompting import ObsFlags
 from agentlab.agents.generic_agent.generic_agent_prompt import GenericPromptFlags
 from graph_grounding.agent import GraphGroundingAgent
+from graph_grounding.retriever.retrieval_cache import RetrievalCacheScope
 
 from ..agentlab_ext.genericagent_ext import GenericAgentArgsWithSleep
 
@@ -29,7 +30,14 @@ class GraphGroundingPromptFlags(GenericPromptFlags):
     """
     obs: GraphGroundingObsFlags
 
+@dataclass
 class GraphGroundingAgentArgs(GenericAgentArgsWithSleep):
+    """
+    Attributes:
+        retrieval_cache_scope (RetrievalCacheScope): Lifetime of the cached retrieval results.
+    """
+    retrieval_cache_scope: RetrievalCacheScope = RetrievalCacheScope.EPISODE
+
     def __post_init__(self):
         try:  # some attributes might be temporarily args.CrossProd for hyperparameter generation
             self.agent_name = f"GraphGroundingAgent-{self.chat_model_args.model_name}".replace("/", "_")
@@ -41,5 +49,7 @@ class GraphGroundingAgentArgs(GenericAgentArgsWithSleep):
             chat_model_args=self.chat_model_args,
             flags=self.flags,
             max_retry=self.max_retry,
-            sleep_time=self.sleep_time
+            sleep_time=self.sleep_time,
+            early_stop_on_action=self.early_stop_on_action,
+            retrieval_cache_scope=self.retrieval_cache_scope,
         )
@@ -0,0 +1,122 @@
+"""
+Benchmark of the superset path pruning used by the graph grounding retrievers.
+
+Paths are generated by expanding every path of a random DAG from its root, like the
+`MATCH path=(n)-[*..25]->(m)` expansion of the retrievers. They are pruned with:
+
+- prune_dominated_paths (Python, sorted prefixes and relationship bitsets)
+- a naive Python port of the Cypher pruning (cubic)
+- the Cypher pruning itself, run in Neo4j on the same relationship IDs (with --neo4j)
+
+Usage:
+    python -m graph_grounding.benchmark_path_pruning [--branching 2 3] [--depth 4 6 8] [--neo4j]
+"""
+
+import argparse
+import random
+import time
+
+from .retriever.path_pruning import prune_dominated_paths
+
+CYPHER_PRUNING_STATEMENT = """
+WITH $paths AS paths
+UNWIND paths as p1
+WITH p1, [x IN paths WHERE x <> p1 AND all(r IN p1 WHERE r IN x)] AS supersets
+WHERE size(supersets) = 0
+RETURN count(p1) AS kept
+"""
+
+
+def generate_paths(branching: int, depth: int, seed: int = 0) -> list[list[str]]:
+    """
+    Expand all paths from the root of a random DAG, as lists of relationship IDs.
+
+    :param branching: Maximum number of outgoing relationships per node.
+    :param depth: Maximum number of relationships per path.
+    """
+    rng = random.Random(seed)
+    paths = []
+    frontier = [[]]
+    next_rel = 0
+    for _ in range(depth):
+        expanded = []
+        for path in frontier:
+            for _ in range(rng.randint(1, branching)):
+                expanded.append(path + [f"r{next_rel}"])
+                next_rel += 1
+        paths.extend(expanded)
+        frontier = expanded
+    rng.shuffle(paths)
+    return paths
+
+
+def naive_prune(paths: list[list[str]]) -> list[int]:
+    """
+    Python port of the Cypher pruning, kept as the reference implementation.
+    """
+    return [
+        i
+        for i, p1 in enumerate(paths)
+        if not any(x != p1 and all(r in x for r in p1) for x in paths)
+    ]
+
+
+def _timed(fn, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--branching", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--depth", type=int, nargs="+", default=[4, 6, 8])
+    parser.add_argument(
+        "--naive-max-paths", type=int, default=5_000, help="Skip the naive pruning above this size."
+    )
+    parser.add_argument(
+        "--neo4j", action="store_true", help="Also time the Cypher pruning in Neo4j."
+    )
+    args = parser.parse_args()
+
+    navigation_graph = None
+    if args.neo4j:
+        from .navigation_graph import create_navigation_graph_client
+
+        navigation_graph = create_navigation_graph_client()
+
+    print(
+        f"{'branching':>9} {'depth':>5} {'paths':>8} {'kept':>6} {'python':>10} {'naive':>10} {'cypher':>10}"
+    )
+    for branching in args.branching:
+        for depth in args.depth:
+            paths = generate_paths(branching, depth)
+            python_time, kept = _timed(prune_dominated_paths, paths)
+
+            naive_time = None
+            if len(paths) <= args.naive_max_paths:
+                naive_time, naive_kept = _timed(naive_prune, paths)
+                assert (
+                    naive_kept == kept
+                ), "prune_dominated_paths disagrees with the reference pruning"
+
+            cypher_time = None
+            if navigation_graph is not None:
+                cypher_time, records = _timed(
+                    navigation_graph.run_statement, CYPHER_PRUNING_STATEMENT, paths=paths
+                )
+                assert records[0]["kept"] == len(
+                    kept
+                ), "prune_dominated_paths disagrees with the Cypher pruning"
+
+            fmt = lambda t: f"{t * 1000:8.1f}ms" if t is not None else f"{'-':>10}"
+            print(
+                f"{branching:>9} {depth:>5} {len(paths):>8} {len(kept):>6} "
+                f"{fmt(python_time)} {fmt(naive_time)} {fmt(cypher_time)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,11 @@
 import os
 AUTH = (os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD"))
+URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+
+# Connection pool of the process-wide driver, see driver_registry.get_driver
+MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", 50))
+CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60))
+# Idle connections older than this are checked before being reused
+LIVENESS_CHECK_TIMEOUT = float(os.getenv("NEO4J_LIVENESS_CHECK_TIMEOUT", 30))
+# Minimum delay between two connectivity checks of a shared driver
+HEALTH_CHECK_INTERVAL = float(os.getenv("NEO4J_HEALTH_CHECK_INTERVAL", 300))
@@ -0,0 +1,107 @@
+import atexit
+import os
+import threading
+import time
+
+from neo4j import Driver, GraphDatabase
+
+from .database import (
+    CONNECTION_ACQUISITION_TIMEOUT,
+    HEALTH_CHECK_INTERVAL,
+    LIVENESS_CHECK_TIMEOUT,
+    MAX_CONNECTION_POOL_SIZE,
+)
+
+
+class _RegisteredDriver:
+    def __init__(self, driver: Driver):
+        self.driver = driver
+        self.last_health_check = time.monotonic()
+
+
+_drivers: dict[tuple, _RegisteredDriver] = {}
+_lock = threading.Lock()
+
+
+def get_driver(
+    uri: str,
+    auth: tuple[str, str],
+    max_connection_pool_size: int = MAX_CONNECTION_POOL_SIZE,
+    connection_acquisition_timeout: float = CONNECTION_ACQUISITION_TIMEOUT,
+    liveness_check_timeout: float | None = LIVENESS_CHECK_TIMEOUT,
+    health_check_interval: float = HEALTH_CHECK_INTERVAL,
+) -> Driver:
+    """
+    Return the driver of this process for the given database, creating it on first use.
+
+    Drivers are shared by every navigation graph client, repository and retriever of a process
+    (e.g. all episodes run by a ray worker), so the connection pool and the connectivity check
+    are not paid again for each agent. The connectivity is checked again every
+    health_check_interval seconds, and a driver that fails the check is replaced.
+
+    :param uri: The URI of the database.
+    :param auth: The (user, password) credentials.
+    :param max_connection_pool_size: Maximum number of connections in the pool.
+    :param connection_acquisition_timeout: Seconds to wait for a connection from the pool.
+    :param liveness_check_timeout: Idle connections older than this are checked before being used.
+    :param health_check_interval: Seconds between two connectivity checks of the driver.
+    """
+    # drivers can't be shared with forked processes
+    key = (
+        os.getpid(),
+        uri,
+        auth,
+        max_connection_pool_size,
+        connection_acquisition_timeout,
+        liveness_check_timeout,
+    )
+
+    with _lock:
+        registered = _drivers.get(key)
+
+        if (
+            registered is not None
+            and time.monotonic() - registered.last_health_check > health_check_interval
+        ):
+            try:
+                registered.driver.verify_connectivity()
+                registered.last_health_check = time.monotonic()
+            except Exception as e:
+                print(f"******Neo4j driver failed its health check, reconnecting: {e} ******")
+                _close(registered.driver)
+                del _drivers[key]
+                registered = None
+
+        if registered is None:
+            driver = GraphDatabase.driver(
+                uri,
+                auth=auth,
+                max_connection_pool_size=max_connection_pool_size,
+                connection_acquisition_timeout=connection_acquisition_timeout,
+                liveness_check_timeout=liveness_check_timeout,
+            )
+            try:
+                driver.verify_connectivity()
+            except Exception:
+                _close(driver)
+                raise
+            registered = _drivers[key] = _RegisteredDriver(driver)
+
+        return registered.driver
+
+
+def _close(driver: Driver):
+    try:
+        driver.close()
+    except Exception as e:
+        print(f"******Failed to close Neo4j driver: {e} ******")
+
+
+@atexit.register
+def close_all_drivers():
+    """
+    Close the drivers created by this process.
+    """
+    with _lock:
+        for key in [key for key in _drivers if key[0] == os.getpid()]:
+            _close(_drivers.pop(key).driver)
@@ -0,0 +1,115 @@
+"""
+Offline pipeline that (re)computes the `embedding` property of the Task and GOAL nodes of the
+navigation graph in bulk.
+
+Node descriptions are embedded with batched, concurrent requests (see Vectorizer.vectorize_many)
+and written back with one UNWIND statement per chunk, instead of one round trip per node.
+
+Usage:
+    python -m graph_grounding.embed_navigation_graph [--all] [--batch-size 64]
+"""
+
+import argparse
+
+from .embeddings import Vectorizer
+from .navigation_graph import NavigationGraph, create_navigation_graph_client
+
+FETCH_NODES_STATEMENT = """
+MATCH (n)
+WHERE any(label IN labels(n) WHERE label IN $labels)
+  AND n[$text_property] IS NOT NULL
+  AND (NOT $only_missing OR n.embedding IS NULL)
+RETURN elementId(n) AS id, n[$text_property] AS text
+"""
+
+WRITE_EMBEDDINGS_STATEMENT = """
+UNWIND $rows AS row
+MATCH (n) WHERE elementId(n) = row.id
+SET n.embedding = row.embedding
+"""
+
+
+def embed_navigation_graph(
+    navigation_graph: NavigationGraph,
+    vectorizer: Vectorizer,
+    labels: tuple[str, ...] = ("Task", "GOAL"),
+    text_property: str = "description",
+    only_missing: bool = True,
+    batch_size: int | None = None,
+    max_concurrency: int | None = None,
+    write_chunk_size: int = 500,
+) -> int:
+    """
+    Embed the description of every node with one of the given labels and store it in the
+    `embedding` property of the node.
+
+    :param navigation_graph: The navigation graph to update.
+    :param vectorizer: The vectorizer used to compute the embeddings.
+    :param labels: The labels of the nodes to embed.
+    :param text_property: The node property holding the text to embed.
+    :param only_missing: If True, only embed nodes that have no embedding yet.
+    :param batch_size: Number of texts per embedding request.
+    :param max_concurrency: Number of concurrent embedding requests.
+    :param write_chunk_size: Number of nodes updated per write statement.
+    :return: The number of updated nodes.
+    """
+    nodes = navigation_graph.run_statement(
+        FETCH_NODES_STATEMENT,
+        labels=list(labels),
+        text_property=text_property,
+        only_missing=only_missing,
+    )
+    print(f"******Embedding {len(nodes)} nodes ******")
+    if not nodes:
+        return 0
+
+    matrix = vectorizer.vectorize_many(
+        [node["text"] for node in nodes],
+        batch_size=batch_size,
+        max_concurrency=max_concurrency,
+    )
+
+    rows = [
+        {"id": node["id"], "embedding": embedding.tolist()}
+        for node, embedding in zip(nodes, matrix)
+    ]
+    for i in range(0, len(rows), write_chunk_size):
+        navigation_graph.run_statement(
+            WRITE_EMBEDDINGS_STATEMENT, rows=rows[i : i + write_chunk_size]
+        )
+
+    print(f"******Updated the embedding of {len(rows)} nodes ******")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--labels", nargs="+", default=["Task", "GOAL"], help="Labels of the nodes to embed."
+    )
+    parser.add_argument("--text-property", default="description", help="Node property to embed.")
+    parser.add_argument(
+        "--all", action="store_true", help="Re-embed nodes that already have an embedding."
+    )
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embedding request.")
+    parser.add_argument(
+        "--max-concurrency", type=int, default=4, help="Concurrent embedding requests."
+    )
+    args = parser.parse_args()
+
+    navigation_graph = create_navigation_graph_client()
+    embed_navigation_graph(
+        navigation_graph,
+        navigation_graph.embeddings,
+        labels=tuple(args.labels),
+        text_property=args.text_property,
+        only_missing=not args.all,
+        batch_size=args.batch_size,
+        max_concurrency=args.max_concurrency,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+
+EMBEDDING_CACHE_PATH = Path(
+    os.getenv(
+        "GRAPH_GROUNDING_EMBEDDING_CACHE",
+        Path.home() / ".cache" / "graph_grounding" / "embeddings.sqlite",
+    )
+)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings, keyed by (model_name, text).
+
+    Lookups go through an in-memory LRU first and then through a persistent SQLite store,
+    which is shared by every process pointing to the same file (e.g. all ray workers of a host).
+    Embeddings are stored as float32.
+    """
+
+    def __init__(
+        self, path: str | Path | None = EMBEDDING_CACHE_PATH, max_memory_entries: int = 10_000
+    ):
+        """
+        Initialize the cache.
+
+        :param path: Path of the SQLite store. If None, the cache only lives in memory.
+        :param max_memory_entries: Maximum number of embeddings kept in the in-memory LRU.
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _get_connection(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        # connections can't be shared with forked processes
+        if self._connection is None or self._connection_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model_name TEXT, vector BLOB)"
+            )
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key: str, embedding: list[float]):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model_name: str, text: str) -> list[float] | None:
+        """
+        Return the cached embedding of the text, or None if it was never computed.
+        """
+        key = self.key(model_name, text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return list(self._memory[key])
+
+            connection = self._get_connection()
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            embedding = array("f")
+            embedding.frombytes(row[0])
+            embedding = embedding.tolist()
+            self._remember(key, embedding)
+            return list(embedding)
+
+    def get_many(self, model_name: str, texts: list[str]) -> dict[str, list[float]]:
+        """
+        Return the cached embeddings of the texts, as a dict from text to embedding.
+        Texts that were never computed are missing from the dict.
+        """
+        return {
+            text: embedding
+            for text in set(texts)
+            if (embedding := self.get(model_name, text)) is not None
+        }
+
+    def put(self, model_name: str, text: str, embedding: list[float]):
+        """
+        Store the embedding of the text in memory and in the persistent store.
+        """
+        self.put_many(model_name, {text: embedding})
+
+    def put_many(self, model_name: str, embeddings: dict[str, list[float]]):
+        """
+        Store several embeddings at once, in a single transaction of the persistent store.
+
+        :param embeddings: A dict from text to embedding.
+        """
+        rows = []
+        with self._lock:
+            for text, embedding in embeddings.items():
+                key = self.key(model_name, text)
+                self._remember(key, list(embedding))
+                rows.append((key, model_name, array("f", embedding).tobytes()))
+
+            connection = self._get_connection()
+            if connection is None:
+                return
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model_name, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+            connection.commit()
+
+
+@cache
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Process-wide embedding cache, shared by every Vectorizer and retriever.
+    """
+    return EmbeddingCache()
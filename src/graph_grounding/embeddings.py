@@ -1,15 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from gen_ai_hub.proxy.native.openai import embeddings
 
+from agentlab.llm.tokenizer_registry import estimate_tokens
+from aicore.rate_limiter import TokenBucketRateLimiter, get_rate_limiter
+
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+
+EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+
 class Vectorizer:
-    def __init__(self, model_name: str):
+    def __init__(
+        self,
+        model_name: str,
+        cache: EmbeddingCache | None = None,
+        batch_size: int = 64,
+        max_concurrency: int = 4,
+        rate_limiter: TokenBucketRateLimiter | None = None,
+    ):
+        """
+        :param model_name: The embedding model to use.
+        :param cache: The embedding cache to use. Defaults to the process-wide cache, which
+            is backed by a persistent store shared between workers.
+        :param batch_size: Default number of texts sent per request by vectorize_many.
+        :param max_concurrency: Default number of concurrent requests of vectorize_many.
+        :param rate_limiter: The rate limiter of the deployment. Defaults to the one of the model,
+            shared with every worker, see aicore.rate_limiter.DEPLOYMENT_RATE_LIMITS.
+        """
         self.model_name = model_name
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        if rate_limiter is None:
+            rate_limiter = get_rate_limiter(model_name)
+        self.rate_limiter = rate_limiter
 
     def __call__(self, text: str) -> list[float]:
         return self.vectorize(text)
 
     def vectorize(self, text: str) -> list[float]:
+        embedding = self.cache.get(self.model_name, text)
+        if embedding is not None:
+            return embedding
+
+        self.rate_limiter.acquire(tokens=estimate_tokens(text, self.model_name))
         response = embeddings.create(
             input=text,
             model_name=self.model_name
         )
-        return response.data[0].embedding
+        embedding = response.data[0].embedding
+        self.cache.put(self.model_name, text, embedding)
+        return embedding
+
+    def vectorize_many(
+        self,
+        texts: list[str],
+        batch_size: int | None = None,
+        max_concurrency: int | None = None,
+    ) -> np.ndarray:
+        """
+        Embed many texts with batched, concurrent requests. Cached and duplicated texts are
+        only embedded once.
+
+        :param texts: The texts to embed.
+        :param batch_size: Number of texts per request, defaults to self.batch_size.
+        :param max_concurrency: Number of concurrent requests, defaults to self.max_concurrency.
+        :return: A float32 matrix of shape (len(texts), embedding_dim).
+        """
+        batch_size = batch_size or self.batch_size
+        max_concurrency = max_concurrency or self.max_concurrency
+
+        known = self.cache.get_many(self.model_name, texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+
+        if batches:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                for batch_embeddings in executor.map(self._vectorize_batch, batches):
+                    self.cache.put_many(self.model_name, batch_embeddings)
+                    known.update(batch_embeddings)
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.array([known[text] for text in texts], dtype=np.float32)
+
+    def _vectorize_batch(self, batch: list[str]) -> dict[str, list[float]]:
+        tokens = sum(estimate_tokens(text, self.model_name) for text in batch)
+        self.rate_limiter.acquire(tokens=tokens)
+        response = embeddings.create(
+            input=batch,
+            model_name=self.model_name
+        )
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return {text: item.embedding for text, item in zip(batch, ordered)}
@@ -0,0 +1,76 @@
+"""
+Export the navigation graph from Neo4j to a graph store file, so the graph grounding can be
+retrieved in-process without a database (see graph_store.GraphStore).
+
+Usage:
+    python -m graph_grounding.export_navigation_graph navigation_graph.navgraph
+
+Set GRAPH_GROUNDING_STORE_PATH to the exported file to make the agents use it.
+"""
+
+import argparse
+
+from .graph_store import read_graph_store, write_graph_store
+from .navigation_graph import NavigationGraph, create_navigation_graph_client
+
+FETCH_NODES_STATEMENT = """
+MATCH (n)
+WHERE any(label IN labels(n) WHERE label IN $labels)
+RETURN elementId(n) AS id, [label IN labels(n) WHERE label IN $labels][0] AS label, properties(n) AS properties
+"""
+
+FETCH_RELATIONSHIPS_STATEMENT = """
+MATCH (a)-[r]->(b)
+WHERE any(label IN labels(a) WHERE label IN $labels)
+  AND any(label IN labels(b) WHERE label IN $labels)
+RETURN elementId(r) AS id, type(r) AS type, elementId(a) AS source, elementId(b) AS target, properties(r) AS properties
+"""
+
+
+def export_navigation_graph(
+    navigation_graph: NavigationGraph,
+    path: str,
+    labels: tuple[str, ...] = ("URL", "STEP", "GOAL", "Task"),
+):
+    """
+    Snapshot the nodes with the given labels and the relationships between them into a graph store.
+
+    :param navigation_graph: The navigation graph to export.
+    :param path: The path of the graph store file.
+    :param labels: The labels of the exported nodes.
+    """
+    nodes = navigation_graph.run_statement(FETCH_NODES_STATEMENT, labels=list(labels))
+    for node in nodes:
+        node["embedding"] = node["properties"].pop("embedding", None)
+
+    relationships = navigation_graph.run_statement(
+        FETCH_RELATIONSHIPS_STATEMENT, labels=list(labels)
+    )
+
+    write_graph_store(path, nodes, relationships)
+    print(
+        f"******Exported {len(nodes)} nodes and {len(relationships)} relationships to {path} ******"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("path", help="Path of the graph store file to write.")
+    parser.add_argument(
+        "--labels",
+        nargs="+",
+        default=["URL", "STEP", "GOAL", "Task"],
+        help="Labels of the exported nodes.",
+    )
+    args = parser.parse_args()
+
+    export_navigation_graph(create_navigation_graph_client(), args.path, labels=tuple(args.labels))
+
+    store = read_graph_store(args.path)
+    print(f"******Graph store: {store.n_nodes} nodes, {store.n_relationships} relationships ******")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import json
+import os
+from collections import defaultdict
+from functools import cache, lru_cache
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+GRAPH_STORE_PATH = os.getenv("GRAPH_GROUNDING_STORE_PATH")
+
+MAGIC = b"NAVGRAPH"
+VERSION = 1
+ALIGNMENT = 64
+
+
+class StringTable:
+    """
+    Immutable list of strings stored as concatenated utf-8 bytes and their offsets.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    @staticmethod
+    def encode(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+
+def _json_decoder(table: StringTable, maxsize: int = 65536):
+    """
+    Decode the JSON strings of a table, keeping the last maxsize decoded ones.
+    The cache only refers to the table, so it is released along with its graph store.
+    """
+    return lru_cache(maxsize=maxsize)(lambda i: json.loads(table[i]))
+
+
+class GraphStore:
+    """
+    Read-only snapshot of the navigation graph in compressed sparse row (CSR) format, memory-mapped
+    from a single file (see write_graph_store and export_navigation_graph).
+
+    Nodes and relationships are identified by their index. The outgoing relationships of node i are
+    the relationships indptr[i] to indptr[i + 1], pointing to the nodes targets[indptr[i]:indptr[i + 1]].
+    Properties are stored as JSON and decoded on access, except the node embeddings, which are
+    stored as a float32 matrix.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray], labels: list[str], rel_types: list[str]):
+        self.labels = labels
+        self.rel_types = rel_types
+
+        self.node_labels = arrays["node_labels"]
+        self.node_ids = StringTable(arrays["node_ids.offsets"], arrays["node_ids.data"])
+        self.node_props = StringTable(arrays["node_props.offsets"], arrays["node_props.data"])
+        self.embeddings = arrays["embeddings"]
+        self.has_embedding = arrays["has_embedding"]
+
+        self.indptr = arrays["indptr"]
+        self.targets = arrays["targets"]
+        self.rel_type_ids = arrays["rel_types"]
+        self.rel_ids = StringTable(arrays["rel_ids.offsets"], arrays["rel_ids.data"])
+        self.rel_props = StringTable(arrays["rel_props.offsets"], arrays["rel_props.data"])
+
+        # source node of every relationship, to walk paths backwards from their relationships
+        self.sources = np.repeat(
+            np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr)
+        )
+
+        self._property_index = {}
+        self._node_properties = _json_decoder(self.node_props)
+        self._relationship_properties = _json_decoder(self.rel_props)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_labels)
+
+    @property
+    def n_relationships(self) -> int:
+        return len(self.targets)
+
+    def node_properties(self, node: int) -> dict:
+        """
+        The properties of a node, as a copy of the cached ones, which callers may modify.
+        """
+        return dict(self._node_properties(node))
+
+    def relationship_properties(self, rel: int) -> dict:
+        """
+        The properties of a relationship, as a copy of the cached ones, which callers may modify.
+        """
+        return dict(self._relationship_properties(rel))
+
+    def node_label(self, node: int) -> str:
+        return self.labels[self.node_labels[node]]
+
+    def relationship_type(self, rel: int) -> str:
+        return self.rel_types[self.rel_type_ids[rel]]
+
+    def nodes_with_label(self, label: str) -> np.ndarray:
+        if label not in self.labels:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.node_labels == self.labels.index(label))
+
+    def find_nodes(self, label: str, key: str, value) -> list[int]:
+        """
+        Find the nodes with the given label whose property key equals value.
+        The index of (label, key) is built on first use.
+        """
+        if (label, key) not in self._property_index:
+            index = defaultdict(list)
+            for node in self.nodes_with_label(label):
+                node = int(node)
+                index[json.dumps(self.node_properties(node).get(key))].append(node)
+            self._property_index[(label, key)] = index
+        return self._property_index[(label, key)].get(json.dumps(value), [])
+
+    def outgoing(self, node: int, rel_type: str | None = None) -> range | list[int]:
+        """
+        The outgoing relationships of a node, optionally only those of the given type.
+        """
+        rels = range(self.indptr[node], self.indptr[node + 1])
+        if rel_type is None:
+            return rels
+        if rel_type not in self.rel_types:
+            return []
+        type_id = self.rel_types.index(rel_type)
+        return [rel for rel in rels if self.rel_type_ids[rel] == type_id]
+
+    def path_nodes(self, start: int, rels: tuple[int, ...]) -> list[int]:
+        return [start] + [int(self.targets[rel]) for rel in rels]
+
+    def expand_paths(
+        self,
+        start: int,
+        max_length: int = 25,
+        rel_type: str | None = None,
+        max_paths: int = 100_000,
+        maximal_only: bool = False,
+    ) -> list[tuple[int, ...]]:
+        """
+        All paths of 1 to max_length relationships starting at a node, without repeating a
+        relationship, like the Cypher pattern `(n)-[*..max_length]->(m)`.
+
+        :param max_paths: Maximum number of returned paths.
+        :param maximal_only: If True, only return the paths that can't be extended. The other paths
+            are prefixes of these ones, and would be pruned as dominated paths by the retrievers.
+        :return: The paths, as tuples of relationship indices.
+        """
+        paths = []
+        stack = [(start, ())]
+        while stack and len(paths) < max_paths:
+            node, path = stack.pop()
+            is_maximal = True
+            if len(path) < max_length:
+                for rel in self.outgoing(node, rel_type):
+                    if rel in path:
+                        continue
+                    extended = path + (rel,)
+                    is_maximal = False
+                    if not maximal_only:
+                        paths.append(extended)
+                    stack.append((int(self.targets[rel]), extended))
+            if maximal_only and is_maximal and path:
+                paths.append(path)
+        return paths[:max_paths]
+
+    def all_simple_paths(
+        self,
+        source: int,
+        targets: set[int] | None = None,
+        rel_type: str | None = None,
+        max_length: int = 10,
+        limit: int | None = None,
+    ) -> list[tuple[int, ...]]:
+        """
+        All paths following outgoing relationships from source to one of the targets, without
+        repeating a node, like `apoc.algo.allSimplePaths` with a directed relationship filter.
+
+        :param targets: The target nodes, defaults to every node other than source.
+        :param limit: Maximum number of returned paths.
+        :return: The paths, as tuples of relationship indices.
+        """
+        paths = []
+        stack = [(source, (), frozenset([source]))]
+        while stack and (limit is None or len(paths) < limit):
+            node, path, visited = stack.pop()
+            if path and (targets is None or node in targets):
+                paths.append(path)
+            if len(path) == max_length:
+                continue
+            for rel in self.outgoing(node, rel_type):
+                target = int(self.targets[rel])
+                if target not in visited:
+                    stack.append((target, path + (rel,), visited | {target}))
+        return paths
+
+    @staticmethod
+    def prime_paths(paths: list[tuple[int, ...]]) -> list[tuple[int, ...]]:
+        """
+        The paths that are not a sub-path (a contiguous part) of another path, like
+        `navgraph.getPrimePaths`. Duplicated paths are only returned once.
+        """
+        unique = list(dict.fromkeys(paths))
+        sub_paths = set()
+        for path in unique:
+            for i in range(len(path)):
+                for j in range(i + 1, len(path) + 1):
+                    if j - i < len(path):
+                        sub_paths.add(path[i:j])
+        return [path for path in unique if path not in sub_paths]
+
+    def path_data(self, start: int, rels: tuple[int, ...]) -> list:
+        """
+        A path in the format of `Record.data()`, alternating node properties and relationship types.
+        """
+        data = [self.node_properties(start)]
+        for rel in rels:
+            data.append(self.relationship_type(rel))
+            data.append(self.node_properties(int(self.targets[rel])))
+        return data
+
+    def relationship_data(self, rel: int) -> tuple:
+        """
+        A relationship in the format of `Record.data()`, i.e. (start properties, type, end properties).
+        """
+        return (
+            self.node_properties(int(self.sources[rel])),
+            self.relationship_type(rel),
+            self.node_properties(int(self.targets[rel])),
+        )
+
+
+def write_graph_store(
+    path: str | Path,
+    nodes: list[dict],
+    relationships: list[dict],
+):
+    """
+    Write a navigation graph snapshot to a single file.
+
+    :param nodes: Dicts with the id (element ID), label, properties and optional embedding of the nodes.
+    :param relationships: Dicts with the id, type, source and target (element IDs) and properties
+        of the relationships.
+    """
+    labels = sorted({node["label"] for node in nodes})
+    rel_types = sorted({rel["type"] for rel in relationships})
+    node_index = {node["id"]: i for i, node in enumerate(nodes)}
+
+    relationships = [
+        rel for rel in relationships if rel["source"] in node_index and rel["target"] in node_index
+    ]
+    relationships.sort(key=lambda rel: node_index[rel["source"]])
+
+    dim = max((len(node["embedding"]) for node in nodes if node.get("embedding")), default=0)
+    embeddings = np.zeros((len(nodes), dim), dtype=np.float32)
+    has_embedding = np.zeros(len(nodes), dtype=np.bool_)
+    for i, node in enumerate(nodes):
+        if node.get("embedding"):
+            embeddings[i] = node["embedding"]
+            has_embedding[i] = True
+
+    counts = np.bincount([node_index[rel["source"]] for rel in relationships], minlength=len(nodes))
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(counts)
+
+    arrays = {
+        "node_labels": np.array([labels.index(node["label"]) for node in nodes], dtype=np.uint16),
+        "embeddings": embeddings,
+        "has_embedding": has_embedding,
+        "indptr": indptr,
+        "targets": np.array([node_index[rel["target"]] for rel in relationships], dtype=np.int32),
+        "rel_types": np.array(
+            [rel_types.index(rel["type"]) for rel in relationships], dtype=np.uint16
+        ),
+    }
+    tables = {
+        "node_ids": [node["id"] for node in nodes],
+        "node_props": [json.dumps(node["properties"], default=str) for node in nodes],
+        "rel_ids": [rel["id"] for rel in relationships],
+        "rel_props": [json.dumps(rel["properties"], default=str) for rel in relationships],
+    }
+    for name, strings in tables.items():
+        arrays[f"{name}.offsets"], arrays[f"{name}.data"] = StringTable.encode(strings)
+
+    header = {"version": VERSION, "labels": labels, "rel_types": rel_types, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "offset": offset,
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_graph_store(path: str | Path) -> GraphStore:
+    """
+    Memory-map a graph store written by write_graph_store.
+    """
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if mm[: len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError(f"{path} is not a navigation graph store.")
+
+    header_length = int.from_bytes(mm[len(MAGIC) : len(MAGIC) + 8].tobytes(), "little")
+    header_end = len(MAGIC) + 8 + header_length
+    header = json.loads(mm[len(MAGIC) + 8 : header_end].tobytes())
+    if header["version"] != VERSION:
+        raise ValueError(
+            f"Unsupported graph store version {header['version']}, expected {VERSION}."
+        )
+
+    data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        start = data_start + spec["offset"]
+        size = int(np.prod(spec["shape"])) * dtype.itemsize
+        arrays[name] = mm[start : start + size].view(dtype).reshape(spec["shape"])
+
+    return GraphStore(arrays, header["labels"], header["rel_types"])
+
+
+@cache
+def load_graph_store(path: str | Path) -> GraphStore:
+    """
+    Process-wide graph store, memory-mapped once and shared by every retriever.
+    """
+    return read_graph_store(path)
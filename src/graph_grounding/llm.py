@@ -1,6 +1,9 @@
 from gen_ai_hub.proxy.native.openai import OpenAI
 from gen_ai_hub.proxy.core import get_proxy_client
 
+from agentlab.llm.chat_api import estimate_prompt_tokens
+from aicore.rate_limiter import TokenBucketRateLimiter, get_rate_limiter
+
 escape_url_system_prompt = """
 given the following URL, please provide a template for the URL.
 A template is a string with placeholders for the parts of the URL that are variable.
@@ -11,9 +14,17 @@ The placeholders should be in the format <placeholder_name>.
 """
 
 class LLM:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, rate_limiter: TokenBucketRateLimiter | None = None):
+        """
+        :param model_name: The model to use.
+        :param rate_limiter: The rate limiter of the deployment. Defaults to the one of the model,
+            shared with every worker, see aicore.rate_limiter.DEPLOYMENT_RATE_LIMITS.
+        """
         self.model_name = model_name
         self.client = OpenAI(proxy_client=get_proxy_client())
+        if rate_limiter is None:
+            rate_limiter = get_rate_limiter(model_name)
+        self.rate_limiter = rate_limiter
 
     def complete(self, conversation: list[dict]):
         messages = []
@@ -21,6 +32,7 @@ class LLM:
             role = message["role"]
             content = message["content"]
             messages.append({ "role": role, "content": content })
+        self.rate_limiter.acquire(tokens=estimate_prompt_tokens(messages, self.model_name))
         completion = self.client.chat.completions.create(model_name=self.model_name, messages=messages, temperature=0.0)
         content = completion.choices[0].message.content
         return content
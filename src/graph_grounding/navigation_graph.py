@@ -1,22 +1,17 @@
-from neo4j import GraphDatabase
-
-
-from .database import AUTH
-from .embeddings import Vectorizer
+from .database import AUTH, URI
+from .driver_registry import get_driver
+from .embeddings import EMBEDDING_MODEL_NAME, Vectorizer
 from .webpage_repository import WebpageRepository
 
 def create_navigation_graph_client():
-    return NavigationGraph("bolt://localhost:7687", AUTH)
+    return NavigationGraph(URI, AUTH)
 
 class NavigationGraph:
     def __init__(self, uri: str, auth: tuple[str, str]):
-        self.client = GraphDatabase.driver(uri, auth=auth)
-        self.client.verify_connectivity()
+        # the driver is shared by all clients of the process and closed at exit
+        self.client = get_driver(uri, auth)
         self.webpage_repository = WebpageRepository(self.client)
-        self.embeddings = Vectorizer(model_name="text-embedding-3-small")
-
-    def __del__(self):
-        self.client.close()
+        self.embeddings = Vectorizer(model_name=EMBEDDING_MODEL_NAME)
 
     def execute_query(self, query: str, **params):
         """
@@ -1,23 +1,31 @@
 from graph_grounding.retriever.url_task_based_retriever import UrlTaskBasedRetriever
 from ..embeddings import Vectorizer
 from ..constant import POCIterations
+from ..graph_store import GraphStore
 from ..navigation_graph import NavigationGraph
 from .base import NavigationGraphGroundingRetriever
 from .longest_path_based_retriever import LongestPathBasedRetriever
 from .hamming_distance_based_retriever import HammingDistanceBasedRetriever
-from .tak_embedding_based_retriever import TaskEmbeddingBasedRetriever
+from .graph_store_retriever import GraphStoreLongestPathBasedRetriever, GraphStoreTaskEmbeddingBasedRetriever
+from .tak_embedding_based_retriever import IndexedTaskEmbeddingBasedRetriever, TaskEmbeddingBasedRetriever
 
 class NavigationGraphGroundingRetrieverFactory:
-    def __init__(self, iteration: POCIterations, navigation_graph_client: NavigationGraph, embedding_client: Vectorizer):
+    def __init__(self, iteration: POCIterations, navigation_graph_client: NavigationGraph, embedding_client: Vectorizer, use_vector_index: bool = False, graph_store: GraphStore | None = None):
         """
         Initialize the factory with the POC iteration and a navigation graph client.
 
         :param iteration: The POC iteration to determine which retriever to create.
         :param navigation_graph_client: An instance of NavigationGraph to interact with the navigation graphs.
+        :param use_vector_index: If True, similar tasks are searched in an in-process vector index
+            instead of scanning every node embedding in Neo4j.
+        :param graph_store: An exported snapshot of the navigation graph. If given, the retrievers
+            that support it query the snapshot in-process instead of Neo4j.
         """
         self.iteration = iteration
         self.navigation_graph_client = navigation_graph_client
         self.embedding_client = embedding_client
+        self.use_vector_index = use_vector_index
+        self.graph_store = graph_store
 
     def create(self) -> NavigationGraphGroundingRetriever:
         """
@@ -25,13 +33,22 @@ class NavigationGraphGroundingRetrieverFactory:
 
         :return: An instance of the appropriate NavigationGraphGroundingRetriever subclass.
         """
+        if self.graph_store is not None:
+            if self.iteration == POCIterations.ONE:
+                return GraphStoreLongestPathBasedRetriever(self.graph_store, self.embedding_client)
+            elif self.iteration == POCIterations.FOUR:
+                return GraphStoreTaskEmbeddingBasedRetriever(self.graph_store, self.embedding_client)
+            raise ValueError(f"POC iteration {self.iteration} is not supported with a graph store.")
+
         if self.iteration == POCIterations.ONE:
-            return LongestPathBasedRetriever(self.navigation_graph_client)
+            return LongestPathBasedRetriever(self.navigation_graph_client, self.embedding_client)
         elif self.iteration == POCIterations.TWO:
             return UrlTaskBasedRetriever(self.navigation_graph_client, self.navigation_graph_client.embeddings)
         elif self.iteration == POCIterations.THREE:
-            return HammingDistanceBasedRetriever(self.navigation_graph_client)
+            return HammingDistanceBasedRetriever(self.navigation_graph_client, self.embedding_client)
         elif self.iteration == POCIterations.FOUR:
+            if self.use_vector_index:
+                return IndexedTaskEmbeddingBasedRetriever(self.navigation_graph_client, self.embedding_client)
             return TaskEmbeddingBasedRetriever(self.navigation_graph_client, self.embedding_client)
 
         raise ValueError(f"Unsupported POC iteration: {self.iteration}. Supported iterations are: {list(POCIterations)}")
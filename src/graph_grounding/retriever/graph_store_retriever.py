@@ -0,0 +1,133 @@
+import weakref
+
+from ..embeddings import Vectorizer
+from ..graph_store import GraphStore
+from .longest_path_based_retriever import LongestPathBasedRetriever
+from .tak_embedding_based_retriever import TaskEmbeddingBasedRetriever, select_paths
+from .vector_index import VectorIndex, build_vector_index
+
+
+# label: VectorIndex of each graph store, released along with the store
+_store_vector_indexes = weakref.WeakKeyDictionary()
+
+
+def _store_vector_index(store: GraphStore, label: str) -> VectorIndex:
+    indexes = _store_vector_indexes.setdefault(store, {})
+    if label not in indexes:
+        nodes = [int(node) for node in store.nodes_with_label(label) if store.has_embedding[node]]
+        print(f"******Indexed {len(nodes)} {label} embeddings ******")
+        indexes[label] = build_vector_index(nodes, store.embeddings[nodes])
+    return indexes[label]
+
+
+class GraphStoreLongestPathBasedRetriever(LongestPathBasedRetriever):
+    """
+    LongestPathBasedRetriever on an exported graph store instead of Neo4j.
+    """
+
+    MAX_PATH_LENGTH = 10
+    MAX_PATHS = 200
+
+    def __init__(self, graph_store: GraphStore, embedding_client: Vectorizer | None = None):
+        super().__init__(None, embedding_client)
+        self.graph_store = graph_store
+
+    def _retrieve(self, state: str, goal: str) -> list:
+        nodes = self.graph_store.find_nodes("URL", "url", state)
+        if len(nodes) == 0:
+            raise ValueError(f"No webpage found with abstract URL: {state}")
+        return self._infer_actions_at_position(nodes[0])
+
+    def _infer_actions_at_position(self, node_id: int) -> list:
+        """
+        The nodeEdgeArray of the Cypher query of LongestPathBasedRetriever, for the same prompt.
+        Like the REDUCE over RANGE(0, pathLength - 2), the last step before the end URL is left
+        out, and a missing action or target line makes the action description null.
+        """
+        store = self.graph_store
+        targets = {int(node) for node in store.nodes_with_label("URL")} - {node_id}
+
+        paths = store.all_simple_paths(
+            node_id,
+            targets,
+            rel_type="ACTION",
+            max_length=self.MAX_PATH_LENGTH,
+            limit=self.MAX_PATHS,
+        )
+        paths = sorted(store.prime_paths(paths), key=len, reverse=True)
+
+        node_edge_arrays = []
+        for path in paths:
+            nodes = store.path_nodes(node_id, path)
+            node_edge_array = []
+            for node, rel in zip(nodes[:-2], path[:-1]):
+                properties = store.relationship_properties(rel)
+                action, target_line = properties.get("action"), properties.get("target_line")
+                node_edge_array.append(store.node_properties(node).get("url"))
+                node_edge_array.append(
+                    None if action is None or target_line is None else f"{action}: {target_line}"
+                )
+            node_edge_array.append(store.node_properties(nodes[-1]).get("url"))
+            node_edge_arrays.append(node_edge_array)
+        return node_edge_arrays
+
+
+class GraphStoreTaskEmbeddingBasedRetriever(TaskEmbeddingBasedRetriever):
+    """
+    TaskEmbeddingBasedRetriever on an exported graph store instead of Neo4j: similar tasks are
+    searched in the stored embeddings and their paths are expanded in-process.
+    """
+
+    def __init__(
+        self,
+        graph_store: GraphStore,
+        embedding_client: Vectorizer,
+        top_k: int = 50,
+        min_score: float = 0.75,
+        max_length: int = 25,
+        max_paths: int = 10_000,
+    ):
+        """
+        :param graph_store: The graph store to retrieve the paths from.
+        :param top_k: Maximum number of similar tasks whose paths are expanded.
+        :param min_score: Minimum normalized cosine similarity of the similar tasks.
+        :param max_length: Maximum number of relationships of the expanded paths.
+        :param max_paths: Maximum number of paths expanded per similar task.
+        """
+        super().__init__(None, embedding_client)
+        self.graph_store = graph_store
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_length = max_length
+        self.max_paths = max_paths
+
+    def _retrieve(self, state: str, goal: str) -> list:
+        store = self.graph_store
+        index = _store_vector_index(store, "Task")
+
+        print(f"******Task description: {goal} ******")
+        embedding = self.embedding_client(goal)
+
+        # only the maximal paths and their relationship IDs, the other paths are pruned anyway
+        records = []
+        for node, score in index.search(embedding, k=self.top_k, min_score=self.min_score):
+            if score <= self.min_score:
+                continue
+            description = store.node_properties(node).get("description")
+            paths = store.expand_paths(
+                node, self.max_length, max_paths=self.max_paths, maximal_only=True
+            )
+            records.extend(
+                {"goal": description, "score": score, "seed": node, "rel_ids": path}
+                for path in paths
+            )
+        result = select_paths(records)
+
+        # the details are only built for the selected paths
+        for r in result:
+            r["path"] = store.path_data(r["seed"], r["rel_ids"])
+            r["rels"] = [store.relationship_data(rel) for rel in r["rel_ids"]]
+            r["properties"] = [store.relationship_properties(rel) for rel in r["rel_ids"]]
+
+        print(f"******Number of result records: {len(result)} ******")
+        return [(r["path"], r["rels"], r["properties"], r["score"]) for r in result]
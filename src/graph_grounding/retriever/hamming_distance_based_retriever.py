@@ -1,9 +1,8 @@
-from abc import abstractmethod
 from .base import NavigationGraphGroundingRetriever
+from .path_pruning import RELATIONSHIP_IDS, fetch_paths, prune_dominated_records
 
 class HammingDistanceBasedRetriever(NavigationGraphGroundingRetriever):
 
-    @abstractmethod
     def _retrieve(self, state: str, goal: str) -> list:
         """
         Retrieve a list of navigation graphs based on the current state.
@@ -11,7 +10,7 @@ class HammingDistanceBasedRetriever(NavigationGraphGroundingRetriever):
         :param state: The current state or query string to search for in the navigation graphs.
         :return: A list of navigation graphs that match the query.
         """
-        stmt = """
+        stmt = f"""
         MATCH (t:Task) WITH t.goal as goal
         WITH goal, apoc.text.distance(goal, $task) as hammingDistance
         ORDER BY hammingDistance ASC
@@ -19,22 +18,19 @@ class HammingDistanceBasedRetriever(NavigationGraphGroundingRetriever):
 
         WITH goal, hammingDistance
 
-        MATCH path=(t:Task { goal: goal })-[*..25]->(n)
+        MATCH path=(t:Task {{ goal: goal }})-[*..25]->(n)
 
-        WITH COLLECT(path) as paths, goal, hammingDistance
-
-        UNWIND paths as p1
-        WITH goal, hammingDistance, p1, [x IN paths WHERE x <> p1 AND all(r IN relationships(p1) WHERE r IN relationships(x))] AS supersets
-        WHERE size(supersets) = 0
-
-        RETURN goal, p1 as path, hammingDistance
-        ORDER BY hammingDistance ASC
+        RETURN goal, hammingDistance, {RELATIONSHIP_IDS}
         """
 
         result = self.navigation_graph_client.run_statement(stmt, task=goal)
+        # paths contained in another path of the same goal are removed, then only the details of
+        # the kept paths are fetched
+        result = prune_dominated_records(result, group_by=lambda r: (r['goal'], r['hammingDistance']))
+        result = sorted(result, key=lambda r: r['hammingDistance'])
+        result = fetch_paths(self.navigation_graph_client, result)
         return [ r['path'] for r in result ]
 
-    @abstractmethod
     def _verbalize(self, graphs: list) -> str:
         """
         Convert the retrieved navigation graphs into a human-readable string format.
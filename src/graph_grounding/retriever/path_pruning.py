@@ -0,0 +1,119 @@
+from collections import defaultdict
+from typing import Callable, Hashable, Sequence
+
+# Cypher expression returning the relationship IDs of a matched `path`, to be pruned in Python
+RELATIONSHIP_IDS = "[r IN relationships(path) | elementId(r)] AS rel_ids"
+
+# Returns the nodes and relationships of the paths given by their relationship IDs, in the format of
+# the paths returned by the driver: the start node, then the type and end node of each relationship.
+FETCH_PATHS = """
+        UNWIND range(0, size($rel_ids) - 1) AS i
+        UNWIND range(0, size($rel_ids[i]) - 1) AS j
+        MATCH ()-[r]->() WHERE elementId(r) = $rel_ids[i][j]
+        WITH i, j, r ORDER BY i, j
+        WITH i, collect(r) AS rels
+        RETURN i,
+            [properties(startNode(rels[0]))]
+                + reduce(path = [], r IN rels | path + [type(r), properties(endNode(r))]) AS path,
+            rels,
+            [r IN rels | properties(r)] AS properties
+        ORDER BY i
+        """
+
+
+def prune_dominated_paths(paths: Sequence[Sequence[Hashable]]) -> list[int]:
+    """
+    Find the paths whose relationships are not all contained in another path.
+
+    This is the Python equivalent of the Cypher pruning
+    `[x IN paths WHERE x <> p1 AND all(r IN relationships(p1) WHERE r IN relationships(x))]`,
+    which is cubic in the number of paths. Here:
+
+    1. Identical paths are deduplicated, the first occurrence is kept.
+    2. Paths are sorted, so a path that is a prefix of another one (the bulk of the paths returned
+       by a variable length expansion) is directly followed by a path it is a prefix of.
+    3. The remaining candidates are checked against each other with relationship bitsets, only
+       comparing paths that share the rarest relationship of the candidate.
+
+    :param paths: The paths, each given as its sequence of relationship IDs.
+    :return: The indices of the kept paths, in their original order.
+    """
+    first_index = {}
+    for i, path in enumerate(paths):
+        first_index.setdefault(tuple(path), i)
+
+    ordered = sorted(first_index)
+    candidates = [
+        path
+        for path, successor in zip(ordered, ordered[1:] + [None])
+        if successor is None or successor[: len(path)] != path
+    ]
+
+    bit = {}
+    masks = []
+    for path in candidates:
+        mask = 0
+        for rel in path:
+            mask |= 1 << bit.setdefault(rel, len(bit))
+        masks.append(mask)
+
+    containing = defaultdict(list)
+    for i, path in enumerate(candidates):
+        for rel in set(path):
+            containing[rel].append(i)
+
+    kept = []
+    for i, path in enumerate(candidates):
+        mask = masks[i]
+        rarest = min(path, key=lambda rel: len(containing[rel]), default=None)
+        others = containing[rarest] if rarest is not None else range(len(candidates))
+        if not any(j != i and masks[j] & mask == mask for j in others):
+            kept.append(first_index[path])
+
+    return sorted(kept)
+
+
+def prune_dominated_records(
+    records: list[dict],
+    group_by: Callable[[dict], Hashable],
+    rel_ids_key: str = "rel_ids",
+) -> list[dict]:
+    """
+    Remove the records whose path is dominated by the path of another record of the same group.
+
+    :param records: The records, each holding the relationship IDs of its path (see RELATIONSHIP_IDS).
+    :param group_by: Returns the group of a record, paths are only compared within a group.
+    :param rel_ids_key: The key of the relationship IDs in the records.
+    :return: The kept records, in their original order.
+    """
+    groups = defaultdict(list)
+    for i, record in enumerate(records):
+        groups[group_by(record)].append(i)
+
+    kept = []
+    for indices in groups.values():
+        group_kept = prune_dominated_paths([records[i][rel_ids_key] for i in indices])
+        kept.extend(indices[i] for i in group_kept)
+
+    return [records[i] for i in sorted(kept)]
+
+
+def fetch_paths(navigation_graph_client, records: list[dict]) -> list[dict]:
+    """
+    Add the path, relationships and relationship properties of the records kept after pruning.
+
+    :param navigation_graph_client: The NavigationGraph to run FETCH_PATHS on.
+    :param records: The records of the kept paths, with their relationship IDs.
+    :return: The records with their path details, in the same order.
+    """
+    if not records:
+        return records
+    paths = navigation_graph_client.run_statement(
+        FETCH_PATHS, rel_ids=[r["rel_ids"] for r in records]
+    )
+    for path in paths:
+        record = records[path["i"]]
+        record["path"] = path["path"]
+        record["rels"] = path["rels"]
+        record["properties"] = path["properties"]
+    return records
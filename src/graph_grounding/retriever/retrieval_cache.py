@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from functools import cache
+
+
+class RetrievalCacheScope(Enum):
+    """
+    Lifetime of the cached retrieval results
+    """
+
+    EPISODE = "episode"
+    CROSS_EPISODE = "cross-episode"
+
+
+_MISSING = object()
+
+
+class RetrievalCache:
+    """
+    LRU cache of graph grounding retrieval results with an optional time-to-live.
+    The hits and misses are counted by the agents, per step (see GraphGroundingAgent).
+
+    Keys are typically (abstracted state, goal, retriever type). With goal based state
+    abstraction the key never changes within an episode, so the graph is only queried once.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float | None = None):
+        """
+        :param max_entries: Maximum number of results to keep, least recently used are evicted first.
+        :param ttl: Time-to-live of a result in seconds. None means results never expire.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached result for the key, or default if it is missing or expired.
+        """
+        with self._lock:
+            value, expires_at = self._entries.get(key, (_MISSING, None))
+            if value is not _MISSING and expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                value = _MISSING
+
+            if value is _MISSING:
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            _, expires_at = self._entries[key]
+            return expires_at is None or expires_at >= time.monotonic()
+
+    def put(self, key, value):
+        """
+        Store a retrieval result, evicting the least recently used entries if needed.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@cache
+def get_shared_retrieval_cache() -> RetrievalCache:
+    """
+    Process-wide retrieval cache, shared by all agents of a worker for cross-episode caching.
+    """
+    return RetrievalCache(max_entries=4096, ttl=60 * 60)
@@ -1,30 +1,34 @@
-from abc import abstractmethod
 from .base import NavigationGraphGroundingRetriever
+from .path_pruning import RELATIONSHIP_IDS, fetch_paths, prune_dominated_records
+from .vector_index import VectorIndex, load_node_vector_index
+
+# Expands the paths of the seed nodes `n` (with their `score`), only returning relationship IDs.
+# Dominated paths are pruned in Python, then FETCH_PATHS returns the details of the kept paths.
+EXPAND_SEED_PATHS = f"""
+        MATCH path=(n)-[*..25]->(m)
+        RETURN n.description as goal, score, {RELATIONSHIP_IDS}
+        """
+
+# Number of paths returned by the retrievers
+MAX_PATHS = 3
+
+
+def select_paths(records: list[dict]) -> list[dict]:
+    """
+    Remove the paths that are contained in another path of the same goal and keep the 3 best results.
+    """
+    records = prune_dominated_records(records, group_by=lambda r: (r['goal'], r['score']))
+    return sorted(records, key=lambda r: r['score'])[:MAX_PATHS]
+
 
 class TaskEmbeddingBasedRetriever(NavigationGraphGroundingRetriever):
 
-    @abstractmethod
     def _retrieve(self, state: str, goal: str) -> list:
         stmt = """
         MATCH (n)
         WITH n, vector.similarity.cosine(n.embedding, $embedding) AS score
         WHERE score > 0.75
-
-        MATCH path=(n)-[*..25]->(m)
-
-        WITH COLLECT(path) as paths, n.description as goal, score
-
-        UNWIND paths as p1
-        WITH goal, score, p1, [x IN paths WHERE x <> p1 AND all(r IN relationships(p1) WHERE r IN relationships(x))] AS supersets
-        WHERE size(supersets) = 0
-
-        WITH goal, p1 as path, relationships(p1) as rels, score
-        UNWIND rels as rel
-        WITH goal, path, collect(rel) as rels, collect(properties(rel)) as properties, score
-        RETURN goal, path, rels, properties, score
-        ORDER BY score ASC
-        LIMIT 3
-        """
+        """ + EXPAND_SEED_PATHS
 
         print(f"******Task description: {goal} ******")
         embedding = self.embedding_client(goal)
@@ -32,11 +36,12 @@ class TaskEmbeddingBasedRetriever(NavigationGraphGroundingRetriever):
             stmt,
             embedding=embedding
         )
+        result = fetch_paths(self.navigation_graph_client, select_paths(result))
 
         print(f"******Number of result records: {len(result)} ******")
         return [(r['path'], r['rels'], r['properties'], r['score']) for r in result]
 
-    @abstractmethod
+
     def _verbalize(self, graphs: list) -> str:
         """
         Convert the retrieved navigation graphs into a human-readable string format.
@@ -72,3 +77,50 @@ class TaskEmbeddingBasedRetriever(NavigationGraphGroundingRetriever):
 
         return "\n".join(result)
 
+
+
+class IndexedTaskEmbeddingBasedRetriever(TaskEmbeddingBasedRetriever):
+    """
+    Same retrieval as TaskEmbeddingBasedRetriever, but the similar tasks are found with an
+    in-process vector index over the Task node embeddings instead of scoring every node of
+    the database. Neo4j only expands the paths of the candidate seeds.
+    """
+
+    def __init__(self, navigation_graph_client, embedding_client, index: VectorIndex | None = None, top_k: int = 50, min_score: float = 0.75):
+        """
+        :param index: The vector index to search. Defaults to the shared index of the Task nodes,
+            built on first use.
+        :param top_k: Maximum number of seed nodes passed to Neo4j.
+        :param min_score: Minimum normalized cosine similarity of the seed nodes.
+        """
+        super().__init__(navigation_graph_client, embedding_client)
+        self.index = index
+        self.top_k = top_k
+        self.min_score = min_score
+
+    def _retrieve(self, state: str, goal: str) -> list:
+        stmt = """
+        UNWIND $seeds AS seed
+        MATCH (n) WHERE elementId(n) = seed.id
+        WITH n, seed.score AS score
+        """ + EXPAND_SEED_PATHS
+
+        if self.index is None:
+            self.index = load_node_vector_index(self.navigation_graph_client, label="Task")
+
+        print(f"******Task description: {goal} ******")
+        embedding = self.embedding_client(goal)
+        seeds = [
+            {"id": node_id, "score": score}
+            for node_id, score in self.index.search(embedding, k=self.top_k, min_score=self.min_score)
+            if score > self.min_score
+        ]
+        print(f"******Number of seed tasks: {len(seeds)} ******")
+        if not seeds:
+            return []
+
+        result = self.navigation_graph_client.run_statement(stmt, seeds=seeds)
+        result = fetch_paths(self.navigation_graph_client, select_paths(result))
+
+        print(f"******Number of result records: {len(result)} ******")
+        return [(r['path'], r['rels'], r['properties'], r['score']) for r in result]
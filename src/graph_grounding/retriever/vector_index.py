@@ -0,0 +1,156 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+from ..navigation_graph import NavigationGraph
+
+logger = logging.getLogger(__name__)
+
+# Above this number of vectors, an HNSW index is used when hnswlib is installed.
+BRUTE_FORCE_MAX_SIZE = 20_000
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex(ABC):
+    """
+    In-process nearest neighbour index over node embeddings.
+
+    Scores follow Neo4j's `vector.similarity.cosine`, i.e. the cosine similarity
+    normalized to [0, 1] as (1 + cos) / 2, so thresholds can be shared with Cypher queries.
+    """
+
+    def __init__(self, ids: list[str], vectors: np.ndarray):
+        """
+        :param ids: The element IDs of the nodes, one per row of vectors.
+        :param vectors: A matrix of shape (len(ids), embedding_dim).
+        """
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors.")
+        self.ids = list(ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @abstractmethod
+    def search(
+        self, query: list[float], k: int = 10, min_score: float = 0.0
+    ) -> list[tuple[str, float]]:
+        """
+        Find the nodes most similar to the query.
+
+        :param query: The query embedding.
+        :param k: Maximum number of nodes to return.
+        :param min_score: Minimum normalized cosine similarity of returned nodes.
+        :return: A list of (element ID, score) sorted by decreasing score.
+        """
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+
+class BruteForceVectorIndex(VectorIndex):
+    """
+    Exact search with a single matrix-vector product. Fast enough for small graphs.
+    """
+
+    def __init__(self, ids: list[str], vectors: np.ndarray):
+        super().__init__(ids, vectors)
+        self.vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def search(self, query, k=10, min_score=0.0):
+        if len(self) == 0:
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        scores = (1 + self.vectors @ query) / 2
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if scores[i] >= min_score]
+
+
+class HNSWVectorIndex(VectorIndex):
+    """
+    Approximate search with an HNSW graph (requires hnswlib). Latency stays flat as the
+    number of recorded trajectories grows.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        vectors: np.ndarray,
+        ef_construction: int = 200,
+        m: int = 16,
+        ef: int = 100,
+    ):
+        if hnswlib is None:
+            raise ImportError(
+                "hnswlib is required for HNSWVectorIndex, install it with `pip install hnswlib`."
+            )
+        super().__init__(ids, vectors)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+        self.index.init_index(max_elements=len(vectors), ef_construction=ef_construction, M=m)
+        self.index.add_items(vectors, np.arange(len(vectors)))
+        self.index.set_ef(ef)
+
+    def search(self, query, k=10, min_score=0.0):
+        if len(self) == 0:
+            return []
+        k = min(k, len(self))
+        labels, distances = self.index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        # hnswlib returns the cosine distance, i.e. 1 - cos
+        scores = (2 - distances[0]) / 2
+        return [
+            (self.ids[i], float(score)) for i, score in zip(labels[0], scores) if score >= min_score
+        ]
+
+
+def build_vector_index(ids: list[str], vectors: np.ndarray) -> VectorIndex:
+    """
+    Build the most appropriate index for the number of vectors.
+    """
+    if len(ids) > BRUTE_FORCE_MAX_SIZE:
+        if hnswlib is not None:
+            return HNSWVectorIndex(ids, vectors)
+        logger.warning(
+            f"{len(ids)} vectors to index but hnswlib is not installed. Falling back to brute force search."
+        )
+    return BruteForceVectorIndex(ids, vectors)
+
+
+_shared_indices: dict[str, VectorIndex] = {}
+_shared_indices_lock = threading.Lock()
+
+
+def load_node_vector_index(
+    navigation_graph: NavigationGraph, label: str = "Task", refresh: bool = False
+) -> VectorIndex:
+    """
+    Build a vector index from the embeddings of all nodes with the given label.
+
+    The index is built once per process and label, and shared by every retriever.
+
+    :param navigation_graph: The navigation graph to read the embeddings from.
+    :param label: The label of the indexed nodes.
+    :param refresh: Rebuild the index even if it was already loaded.
+    """
+    with _shared_indices_lock:
+        if refresh or label not in _shared_indices:
+            records = navigation_graph.execute_query(
+                f"MATCH (n:`{label}`) WHERE n.embedding IS NOT NULL RETURN elementId(n) AS id, n.embedding AS embedding"
+            )
+            ids = [r["id"] for r in records]
+            vectors = np.array([r["embedding"] for r in records], dtype=np.float32)
+            print(f"******Indexed {len(ids)} {label} embeddings ******")
+            _shared_indices[label] = build_vector_index(ids, vectors)
+        return _shared_indices[label]
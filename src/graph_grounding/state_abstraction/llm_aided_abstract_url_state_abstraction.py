@@ -1,4 +1,5 @@
 from .abstract_url_state_abstraction import AbstractUrlStateAbstractor
+from ..urls import UrlTemplateEngine, get_url_template_engine
 
 from ..llm import (
     LLM,
@@ -12,10 +13,17 @@ class LLMAidedAbstractUrlStateAbstractor(AbstractUrlStateAbstractor):
     """
     Uses an LLM to abstract the state of the navigation graph to a more general form.
     This is used to create a more general representation of the state of the navigation graph.
+
+    The templates returned by the LLM are learned, so the LLM is only called for URLs of an unseen shape.
     """
 
-    def __init__(self, llm: LLM):
+    def __init__(self, llm: LLM, template_engine: UrlTemplateEngine | None = None):
+        """
+        :param llm: The LLM used to escape the URLs.
+        :param template_engine: The learned URL templates. Defaults to the process-wide engine.
+        """
         self.llm = llm
+        self.template_engine = template_engine if template_engine is not None else get_url_template_engine()
 
     def abstract_state(self, state: dict) -> str:
         """
@@ -23,6 +31,10 @@ class LLMAidedAbstractUrlStateAbstractor(AbstractUrlStateAbstractor):
         """
         url = super().abstract_state(state)
 
+        template = self.template_engine.match(url)
+        if template is not None:
+            return template
+
         escaped_url = self.llm.complete([
             system_message(escape_url_system_prompt),
             user_message("https://www.example.com/products/12345"),
@@ -53,4 +65,5 @@ class LLMAidedAbstractUrlStateAbstractor(AbstractUrlStateAbstractor):
             user_message(url),
         ])
         print(f"URL {url} escaped to {escaped_url}")
+        self.template_engine.learn(url, escaped_url)
         return escaped_url
@@ -1,35 +1,19 @@
-
+import fcntl
+import json
+import os
+import re
+import threading
+from functools import cache, lru_cache
+from pathlib import Path
 from urllib.parse import urlparse
 
+@lru_cache(maxsize=4096)
 def build_abstract_url(url: str) -> str:
-    # first, we need to parse the URL
     parsed_url = urlparse(url)
-    query = parsed_url.query
-
-    # convert the query into a dictionary
-    query_parts = query.split("&")
-    query_dict = {}
-
-    for part in query_parts:
-        if (part == ""):
-            continue
-        split_parts = part.split("=")
-        if (len(split_parts) == 0):
-            continue
-
-        if (len(split_parts) == 1):
-            key, value = part, ""
-        else:
-            key = split_parts[0]
-            value = "=".join(split_parts[1:])
-            query_dict[key] = value
-
-    # replace the values with placeholders
-    for key in query_dict:
-        query_dict[key] = f"<{key}>"
-
-    # convert the dictionary back into a query string
-    query = "&".join([f"{key}={value}" for key, value in query_dict.items()]) if len(query_dict.items()) > 0 else ""
+
+    # replace the values of the query parameters with placeholders, parameters without a value are dropped
+    keys = dict.fromkeys(part.split("=", 1)[0] for part in parsed_url.query.split("&") if "=" in part)
+    query = "&".join(f"{key}=<{key}>" for key in keys)
     fragment = "#<fragment>" if parsed_url.fragment else ""
 
     # rebuild the URL
@@ -46,8 +30,174 @@ _to_replace = [
     ("https://dev275528.service-now.com", "https://servicenow.test"),
 ]
 
+@lru_cache(maxsize=16)
+def _compile_replacements(to_replace: tuple[tuple[str, str], ...]) -> tuple[re.Pattern, dict[str, str]]:
+    replacements = dict(to_replace)
+    pattern = re.compile("|".join(re.escape(old) for old, _ in to_replace))
+    return pattern, replacements
+
 def replace_urls(url, to_replace = _to_replace):
-    for old, new in to_replace:
-        url = url.replace(old, new)
-    return url
+    if not to_replace:
+        return url
+    pattern, replacements = _compile_replacements(tuple(to_replace))
+    return pattern.sub(lambda match: replacements[match.group(0)], url)
+
+
+URL_TEMPLATES_PATH = Path(
+    os.getenv(
+        "GRAPH_GROUNDING_URL_TEMPLATES",
+        Path.home() / ".cache" / "graph_grounding" / "url_templates.json",
+    )
+)
+
+_PLACEHOLDER = re.compile(r"<[^<>]*>")
+# a placeholder matches one path segment or query value
+_PLACEHOLDER_PATTERN = r"[^/?#&]+"
+
+
+def induce_url_pattern(template: str) -> str:
+    """
+    Turn a URL template like https://shopping.com/products/<product_id> into a regex pattern,
+    where each placeholder matches one path segment or query value.
+    """
+    parts = _PLACEHOLDER.split(template)
+    return _PLACEHOLDER_PATTERN.join(re.escape(part) for part in parts)
+
+
+class UrlTemplateEngine:
+    """
+    Per-host table of URL templates learned from the LLM aided URL abstraction.
+
+    A template is learned from an (abstract URL, template) pair, e.g. from the URL
+    https://shopping.com/products/12345 escaped to https://shopping.com/products/<product_id>,
+    and then applied to every URL of the same shape without calling the LLM again.
+    Shapes that were escaped to different templates (e.g. <category>.html and <product_name>.html)
+    are ambiguous and never matched.
+    """
+
+    def __init__(self, path: str | Path | None = URL_TEMPLATES_PATH, max_templates_per_host: int = 1000, cache_size: int = 4096):
+        """
+        :param path: JSON file the templates are loaded from and saved to. If None, templates only live in memory.
+        :param max_templates_per_host: Maximum number of templates learned per host.
+        :param cache_size: Number of URLs whose match is cached.
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_templates_per_host = max_templates_per_host
+        # host -> pattern -> template, or None if the pattern is ambiguous
+        self.templates: dict[str, dict[str, str | None]] = {}
+        self._compiled: dict[str, list[tuple[re.Pattern, str | None]]] = {}
+        self._lock = threading.Lock()
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+        if self.path is not None:
+            self.templates = self._load()
+            for host in self.templates:
+                self._compile(host)
+
+    def _compile(self, host: str):
+        # the most specific patterns (with the most literal characters) are tried first
+        patterns = sorted(
+            self.templates[host].items(),
+            key=lambda item: len(item[0].replace(_PLACEHOLDER_PATTERN, "")),
+            reverse=True,
+        )
+        self._compiled[host] = [(re.compile(pattern), template) for pattern, template in patterns]
+
+    def _match(self, url: str) -> str | None:
+        """
+        Return the template matching the URL, or None if the URL has an unseen or ambiguous shape.
+        """
+        for pattern, template in self._compiled.get(urlparse(url).netloc, []):
+            if pattern.fullmatch(url):
+                return template
+        return None
+
+    def learn(self, url: str, template: str) -> bool:
+        """
+        Learn the template of a URL.
+
+        :return: True if the template was added.
+        """
+        pattern = induce_url_pattern(template)
+        if not re.fullmatch(pattern, url):
+            # the template does not describe the URL, e.g. the LLM rewrote more than the variable parts
+            return False
+
+        host = urlparse(url).netloc
+        with self._lock:
+            host_templates = self.templates.setdefault(host, {})
+            if pattern in host_templates:
+                if host_templates[pattern] in (template, None):
+                    return False
+                host_templates[pattern] = None
+            elif len(host_templates) >= self.max_templates_per_host:
+                return False
+            else:
+                host_templates[pattern] = template
+
+            self._compile(host)
+            for merged_host in self._save():
+                self._compile(merged_host)
+            self.match.cache_clear()
+        return host_templates[pattern] is not None
+
+    def _load(self) -> dict[str, dict[str, str | None]]:
+        if not self.path.exists():
+            return {}
+        with open(self.path) as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def _merge(self, saved: dict[str, dict[str, str | None]]) -> set[str]:
+        """
+        Add the templates saved by other engines, a pattern learned with different templates is
+        ambiguous.
+
+        :return: The hosts whose templates changed.
+        """
+        changed = set()
+        for host, saved_templates in saved.items():
+            host_templates = self.templates.setdefault(host, {})
+            for pattern, template in saved_templates.items():
+                if pattern in host_templates:
+                    if host_templates[pattern] in (template, None):
+                        continue
+                    host_templates[pattern] = None
+                elif len(host_templates) < self.max_templates_per_host:
+                    host_templates[pattern] = template
+                else:
+                    continue
+                changed.add(host)
+        return changed
+
+    def _save(self) -> set[str]:
+        """
+        Save the templates, merged with the ones saved by the other processes since they were
+        loaded. The file is re-read and replaced under an exclusive `flock` of a lock file.
+
+        :return: The hosts whose templates changed with the merge.
+        """
+        if self.path is None:
+            return set()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f"{self.path.name}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                changed = self._merge(self._load())
+                tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump(self.templates, f, indent=2)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return changed
+
 
+@cache
+def get_url_template_engine() -> UrlTemplateEngine:
+    """
+    Process-wide URL template engine, persisted to URL_TEMPLATES_PATH.
+    """
+    return UrlTemplateEngine()
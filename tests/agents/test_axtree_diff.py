@@ -0,0 +1,144 @@
+import time
+from copy import deepcopy
+
+from agentlab.agents import dynamic_prompting as dp
+from agentlab.agents.axtree_diff import diff_axtrees, index_axtree
+from agentlab.llm.tokenizer_registry import calibrate_estimate
+
+
+def make_node(node_id, role, name, child_ids=(), bid=None, value=None):
+    node = {
+        "nodeId": str(node_id),
+        "role": {"value": role},
+        "name": {"value": name},
+        "childIds": [str(child_id) for child_id in child_ids],
+    }
+    if bid is not None:
+        node["browsergym_id"] = bid
+    if value is not None:
+        node["value"] = {"value": value}
+    return node
+
+
+def make_axtree(n_items=3):
+    """A page with a search box and a list of items, each with a text child without bid."""
+    item_ids = list(range(10, 10 + 2 * n_items, 2))
+    nodes = [
+        make_node(0, "RootWebArea", "Page", [1, 2], bid="root"),
+        make_node(1, "textbox", "Search", bid="search", value=""),
+        make_node(2, "list", "", item_ids, bid="list"),
+    ]
+    for i, item_id in enumerate(item_ids):
+        nodes.append(make_node(item_id, "listitem", "", [item_id + 1], bid=f"item{i}"))
+        nodes.append(make_node(item_id + 1, "StaticText", f"Item {i}"))
+    return {"nodes": nodes}
+
+
+def find_node(axtree, bid):
+    return next(node for node in axtree["nodes"] if node.get("browsergym_id") == bid)
+
+
+def test_index_axtree():
+    index = index_axtree(make_axtree())
+    assert index.roots == ["root"]
+    assert index.nodes["root"].children == ["search", "list"]
+    assert index.nodes["list"].children == ["item0", "item1", "item2"]
+    # the text without bid is folded in the list item
+    assert index.nodes["item1"].lines == ["[item1] listitem ''", "StaticText 'Item 1'"]
+    assert index.nodes["list"].subtree_size == 4
+
+
+def test_identical():
+    diff = diff_axtrees(make_axtree(), make_axtree())
+    assert diff.is_empty
+    assert diff.n_unchanged == 6
+    assert diff.to_str() == "Identical"
+
+
+def test_diff():
+    previous = make_axtree()
+    current = deepcopy(previous)
+    find_node(current, "search")["value"] = {"value": "shoes"}
+    # change the text of item 1, remove item 2 and add item 3
+    next(node for node in current["nodes"] if node["nodeId"] == "13")["name"]["value"] = "Changed"
+    find_node(current, "list")["childIds"] = ["10", "12", "16"]
+    current["nodes"].append(make_node(16, "listitem", "New item", bid="item3"))
+
+    diff = diff_axtrees(previous, current)
+    assert [node.bid for node in diff.added] == ["item3"]
+    assert [node.bid for node in diff.removed] == ["item2"]
+    assert [(old.bid, new.bid) for old, new in diff.changed] == [
+        ("search", "search"),
+        ("item1", "item1"),
+    ]
+    # root and list have the same content, item0 is an unchanged subtree
+    assert diff.n_unchanged == 3
+
+    diff_str = diff.to_str()
+    assert "+ [search] textbox 'Search' value='shoes'" in diff_str
+    assert "StaticText 'Changed'" in diff_str
+    assert "Item 0" not in diff_str
+    assert "Diff truncated" in diff.to_str(max_lines=2)
+
+
+def test_large_tree():
+    previous = make_axtree(n_items=5000)
+    current = deepcopy(previous)
+    find_node(current, "search")["value"] = {"value": "shoes"}
+
+    start = time.time()
+    diff = diff_axtrees(previous, current)
+    assert time.time() - start < 2
+    assert diff.n_changes == 1
+    assert diff.n_unchanged == 5002
+
+
+def test_history_step_diff():
+    flags = dp.ObsFlags(use_ax_tree=True, use_history=True, use_diff=True)
+    previous_obs = {"axtree_object": make_axtree(), "last_action_error": ""}
+    current_obs = {"axtree_object": make_axtree(n_items=4), "last_action_error": ""}
+    step = dp.HistoryStep(previous_obs, current_obs, "click('a')", None, "thought", flags)
+    assert "### AXTree changes since the previous step:" in step.prompt
+    assert "[item3] listitem" in step.prompt
+
+    flags.use_diff = False
+    assert "AXTree changes" not in step.prompt
+
+
+def test_fit_tokens_plans_diff_shrinks(monkeypatch):
+    counted_texts = []
+
+    def mock_count_tokens(text, model="openai/gpt-4"):
+        counted_texts.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(dp, "count_tokens", mock_count_tokens)
+
+    def make_history():
+        flags = dp.ObsFlags(use_ax_tree=True, use_history=True, use_diff=True)
+        history_obs = [
+            {"axtree_object": make_axtree(n_items=n_items), "last_action_error": ""}
+            for n_items in [1, 40, 80, 120]
+        ]
+        return dp.History(history_obs, ["noop()"] * 3, None, ["thought"] * 3, flags)
+
+    history = make_history()
+    n_tokens = mock_count_tokens(history.prompt)
+    max_prompt_tokens = n_tokens // 3
+
+    # reference: shrink one iteration at a time, counting the whole prompt every time
+    reference = make_history()
+    for _ in range(20):
+        if mock_count_tokens(reference.prompt) <= max_prompt_tokens:
+            break
+        reference.shrink()
+
+    # the history has no Trunkater, its diffs are planned with their own estimates
+    calibrate_estimate("test", history.prompt, n_tokens, weight=1)
+    counted_texts.clear()
+    prompt = dp.fit_tokens(
+        history, max_prompt_tokens=max_prompt_tokens, model_name="test", additional_prompts=[]
+    )
+    assert prompt == reference.prompt
+    # the whole prompt is tokenized before the exact planning and to confirm the result
+    assert sum(text.startswith("# History") for text in counted_texts) == 2
@@ -1,3 +1,4 @@
+import re
 from copy import deepcopy
 
 import bgym
@@ -10,6 +11,7 @@ from agentlab.agents.generic_agent.generic_agent_prompt import (
     MainPrompt,
 )
 from agentlab.llm.llm_utils import count_tokens
+from agentlab.llm.tokenizer_registry import calibrate_estimate
 
 html_template = """
 <html>
@@ -192,6 +194,151 @@ def test_shrinking_observation():
     assert "</html>" not in new_prompt
 
 
+def test_fit_tokens_incremental(monkeypatch):
+    counted_texts = []
+
+    def mock_count_tokens(text, model="openai/gpt-4"):
+        counted_texts.append(text)
+        return len(re.findall(r"\w+|[^\w\s]|\n", text))
+
+    monkeypatch.setattr(dp, "count_tokens", mock_count_tokens)
+
+    def make_prompt():
+        flags = deepcopy(FLAGS_GPT_3_5)
+        flags.obs.use_html = True
+        obs_history = deepcopy(OBS_HISTORY)
+        obs_history[-1]["pruned_html"] = "\n".join(f"<div>line {i}</div>" for i in range(1000))
+        return MainPrompt(
+            action_set=bgym.HighLevelActionSet(),
+            obs_history=obs_history,
+            actions=ACTIONS,
+            memories=MEMORIES,
+            thoughts=THOUGHTS,
+            previous_plan="1- think\n2- do it",
+            step=2,
+            flags=flags,
+        )
+
+    prompt_maker = make_prompt()
+    prompt = str(prompt_maker.prompt)
+    n_tokens = mock_count_tokens(prompt)
+    max_prompt_tokens = n_tokens // 3
+
+    # reference: shrink one iteration at a time, counting the whole prompt every time
+    reference = make_prompt()
+    for _ in range(20):
+        if mock_count_tokens(str(reference.prompt)) <= max_prompt_tokens:
+            break
+        reference.shrink()
+
+    # estimates calibrated on a previous step
+    calibrate_estimate("test", prompt, n_tokens, weight=1)
+    counted_texts.clear()
+    new_prompt = dp.fit_tokens(
+        prompt_maker, max_prompt_tokens=max_prompt_tokens, model_name="test", additional_prompts=[]
+    )
+    assert str(new_prompt) == str(reference.prompt)
+    assert prompt_maker.obs.html.shrink_calls == reference.obs.html.shrink_calls
+
+    # the early iterations are planned on estimates, the whole prompt is only tokenized once
+    assert sum(text.startswith("# Instructions") for text in counted_texts) == 1
+    assert len(counted_texts) <= 3
+
+
+def test_cache_friendly_prompt():
+    flags = deepcopy(ALL_TRUE_FLAGS)
+    flags.use_prompt_caching = True
+
+    def make_prompt(n_steps):
+        return MainPrompt(
+            action_set=flags.action.action_set.make_action_set(),
+            obs_history=OBS_HISTORY[: n_steps + 1],
+            actions=ACTIONS[:n_steps],
+            memories=MEMORIES[:n_steps],
+            thoughts=THOUGHTS[:n_steps],
+            previous_plan="1- think\n2- do it",
+            step=n_steps,
+            flags=flags,
+        ).prompt
+
+    prompt = make_prompt(2)
+    for _, expected_prompts in FLAG_EXPECTED_PROMPT:
+        for expected in expected_prompts:
+            assert expected in str(prompt)
+
+    # the static parts and the instructions come first, followed by cache breakpoints
+    breakpoints = [i for i, elem in enumerate(prompt["content"]) if "cache_control" in elem]
+    assert len(breakpoints) == 2
+    prefix = prompt["content"][: breakpoints[-1] + 1]
+    assert "# Concrete Example" in prefix[breakpoints[0]]["text"]
+    assert "## Goal:" in prefix[breakpoints[0] + 1]["text"]
+    assert "Step 3." not in str(prefix)
+
+    # identical prefix from one step to the next, also after merging
+    next_prompt = make_prompt(1)
+    assert next_prompt["content"][: breakpoints[-1] + 1] == prefix
+    prompt.merge()
+    next_prompt.merge()
+    assert prompt["content"][:2] == next_prompt["content"][:2]
+    assert all("cache_control" in elem for elem in prompt["content"][:2])
+
+
+def test_obs_preprocessor(monkeypatch):
+    calls = []
+
+    def mock_flatten(name):
+        def flatten(obj, **kwargs):
+            calls.append(name)
+            return f"{name} of {obj}"
+
+        return flatten
+
+    monkeypatch.setattr(dp, "flatten_dom_to_str", mock_flatten("dom"))
+    monkeypatch.setattr(dp, "flatten_axtree_to_str", mock_flatten("axtree"))
+    monkeypatch.setattr(dp, "prune_html", mock_flatten("prune"))
+    monkeypatch.setattr(dp, "overlay_som", mock_flatten("som"))
+
+    raw_obs = {
+        "dom_object": {"page": 1},
+        "axtree_object": {"page": 1},
+        "extra_element_properties": {},
+        "screenshot": "screenshot",
+    }
+    flags = dp.ObsFlags(use_html=False, use_ax_tree=True, use_screenshot=True, use_som=False)
+    preprocessor = dp.make_obs_preprocessor(flags)
+
+    # only the fields consumed by the flags are computed
+    obs = preprocessor(raw_obs)
+    assert obs["axtree_txt"] == "axtree of {'page': 1}"
+    assert "pruned_html" not in obs and "screenshot_som" not in obs
+    assert calls == ["axtree"]
+
+    # same page, the previous AXTree is reused
+    preprocessor(dict(raw_obs, axtree_object={"page": 1}))
+    assert calls == ["axtree"]
+
+    obs = preprocessor(dict(raw_obs, axtree_object={"page": 2}))
+    assert obs["axtree_txt"] == "axtree of {'page': 2}"
+    assert calls == ["axtree", "axtree"]
+
+    # the flags are read at each call
+    flags.use_html = True
+    obs = preprocessor(raw_obs)
+    assert obs["pruned_html"] == "prune of dom of {'page': 1}"
+    assert calls == ["axtree", "axtree", "dom", "prune", "axtree"]
+
+    # same page, but the fields are computed with other flags (the mocked dom_txt is the same, the
+    # pruned HTML is reused)
+    flags.extract_coords = "center"
+    preprocessor(raw_obs)
+    assert calls[5:] == ["dom", "axtree"]
+    flags.filter_visible_elements_only = True
+    preprocessor(raw_obs)
+    assert calls[7:] == ["dom", "axtree"]
+    preprocessor(raw_obs)
+    assert len(calls) == 9
+
+
 @pytest.mark.parametrize("flag_name, expected_prompts", FLAG_EXPECTED_PROMPT)
 def test_main_prompt_elements_gone_one_at_a_time(flag_name: str, expected_prompts):
 
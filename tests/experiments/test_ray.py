@@ -1,7 +1,14 @@
+import functools
+import os
+import time
+
 import bgym
 import pytest
 import ray
-from agentlab.experiments.graph_execution_ray import execute_task_graph
+from agentlab.experiments.graph_execution_ray import (
+    execute_task_graph,
+    execute_task_graph_with_pool,
+)
 from agentlab.experiments.exp_utils import MockedExpArgs, add_dependencies
 
 TASK_TIME = 3
@@ -40,6 +47,90 @@ def test_execute_task_graph():
     )  # Since the critical path involves at least 1.5 seconds of work
 
 
+def test_timeout():
+    exp_args_list = [
+        MockedExpArgs(exp_id="task1", depends_on=[]),
+        MockedExpArgs(exp_id="task2", depends_on=[]),
+        MockedExpArgs(exp_id="task3", depends_on=["task2"]),
+    ]
+    exp_args_list[1].episode_timeout = 1
+
+    ray.init(num_cpus=4)
+    results = execute_task_graph(exp_args_list)
+    end_time = time.time()
+    ray.shutdown()
+
+    task1 = results["task1"]
+    assert task1.end_time is not None
+    # task2 is cancelled shortly after its deadline and task3 never runs
+    assert isinstance(results["task2"], ray.exceptions.TaskCancelledError)
+    assert isinstance(results["task3"], Exception)
+    # task2 has no result, the times are measured from the start of task1, which started along
+    # task2 once Ray was up
+    assert end_time - task1.start_time < TASK_TIME * 2
+
+
+def test_worker_pool():
+    exp_args_list = [
+        MockedExpArgs(exp_id="task1", depends_on=[]),
+        MockedExpArgs(exp_id="task2", depends_on=["task1"]),
+        MockedExpArgs(exp_id="task3", depends_on=["task1"]),
+        MockedExpArgs(exp_id="task4", depends_on=["task2", "task3"]),
+    ]
+
+    ray.init(num_cpus=2)
+    results = execute_task_graph_with_pool(exp_args_list, n_workers=2)
+    ray.shutdown()
+
+    task1, task2, task3, task4 = [results[f"task{i}"] for i in range(1, 5)]
+    assert task1.end_time < task2.start_time
+    assert task1.end_time < task3.start_time
+    assert abs(task2.start_time - task3.start_time) < 2
+    assert max(task2.end_time, task3.end_time) < task4.start_time
+
+
+def test_worker_pool_timeout():
+    exp_args_list = [
+        MockedExpArgs(exp_id="task1", depends_on=[]),
+        MockedExpArgs(exp_id="task2", depends_on=["task1"]),
+        MockedExpArgs(exp_id="task3", depends_on=[]),
+    ]
+    exp_args_list[0].episode_timeout = 1
+
+    # a single worker, task3 runs on the worker replacing the one killed by the timeout
+    ray.init(num_cpus=1)
+    results = execute_task_graph_with_pool(exp_args_list, n_workers=1)
+    ray.shutdown()
+
+    assert isinstance(results["task1"], TimeoutError)
+    assert results["task2"] is results["task1"]
+    assert results["task3"].end_time is not None
+
+    with pytest.raises(ValueError):
+        execute_task_graph_with_pool([MockedExpArgs(exp_id="task1", depends_on=["task0"])], 1)
+
+
+def test_worker_pool_dead_worker():
+    exp_args_list = [
+        MockedExpArgs(exp_id="task1", depends_on=[]),
+        MockedExpArgs(exp_id="task2", depends_on=["task1"]),
+        MockedExpArgs(exp_id="task3", depends_on=[]),
+        MockedExpArgs(exp_id="task4", depends_on=[]),
+    ]
+    # the worker process dies while running task1, e.g. killed by the OOM killer
+    exp_args_list[0].run = functools.partial(os._exit, 1)
+
+    # a single worker, task3 and task4 run on the worker replacing the dead one
+    ray.init(num_cpus=1)
+    results = execute_task_graph_with_pool(exp_args_list, n_workers=1)
+    ray.shutdown()
+
+    assert isinstance(results["task1"], ray.exceptions.RayActorError)
+    assert results["task2"] is results["task1"]
+    assert results["task3"].end_time is not None
+    assert results["task4"].end_time is not None
+
+
 def test_add_dependencies():
     # Prepare a simple list of ExpArgs
 
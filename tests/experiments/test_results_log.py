@@ -0,0 +1,91 @@
+import json
+import pickle
+
+import bgym
+
+from agentlab.experiments.exp_utils import MockedExpArgs
+from agentlab.experiments.launch_exp import find_incomplete_from_log
+from agentlab.experiments.results_log import RESULTS_LOG_NAME, ResultsLog, append_result
+
+
+def make_exp_dir(study_dir, exp_id, summary_info, name=None):
+    exp_dir = study_dir / (name or f"exp_{exp_id}")
+    exp_dir.mkdir()
+    exp_args = bgym.ExpArgs(
+        agent_args=None, env_args=bgym.EnvArgs(task_name=f"task{exp_id}"), exp_id=exp_id
+    )
+    exp_args.exp_dir = exp_dir
+    with open(exp_dir / "exp_args.pkl", "wb") as f:
+        pickle.dump(exp_args, f)
+    if summary_info is not None:
+        (exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+    return exp_args
+
+
+def test_results_log(tmp_path):
+    done = {"cum_reward": 1, "n_steps": 3, "err_msg": None, "terminated": True, "truncated": False}
+    error = {**done, "cum_reward": 0, "err_msg": "Error", "terminated": False}
+    exp_args_1 = make_exp_dir(tmp_path, "1", done)
+    exp_args_2 = make_exp_dir(tmp_path, "2", error)
+    exp_args_3 = MockedExpArgs(exp_id="3")
+    exp_args_3.exp_dir = tmp_path / "exp_3"
+    append_result(exp_args_1.exp_dir)
+    append_result(exp_args_2.exp_dir)
+
+    results_log = ResultsLog(tmp_path)
+    assert results_log.update() == 2
+    assert results_log.status(exp_args_1) == "done"
+    assert results_log.status(exp_args_2) == "error"
+    assert results_log.status(exp_args_3) == "incomplete"
+
+    # only the new lines are read, an incomplete line is kept for the next update
+    exp_args_2.exp_dir = tmp_path / "exp_2b"
+    with open(tmp_path / RESULTS_LOG_NAME, "a") as f:
+        f.write(json.dumps({"exp_id": "2", "exp_dir": str(exp_args_2.exp_dir), **done}) + "\n")
+        f.write('{"exp_id": "3", ')
+    assert results_log.update() == 1
+    assert results_log.status(exp_args_2) == "done"
+    with open(tmp_path / RESULTS_LOG_NAME, "a") as f:
+        f.write(f'"exp_dir": "{exp_args_3.exp_dir}", "err_msg": null}}\n')
+    assert results_log.update() == 1
+    assert results_log.status(exp_args_3) == "incomplete"
+
+    result_df = results_log.result_df(set_index=False)
+    assert set(result_df["exp_id"]) == {"1", "2", "3"}
+    assert result_df.set_index("exp_id").loc["1", "env.task_name"] == "task1"
+
+
+def test_relaunched_experiment_ignores_previous_records(tmp_path):
+    error = {"cum_reward": 0, "n_steps": 1, "err_msg": "Error", "terminated": False}
+    exp_args = make_exp_dir(tmp_path, "1", error)
+    append_result(exp_args.exp_dir)
+    results_log = ResultsLog(tmp_path)
+    results_log.update()
+    assert results_log.status(exp_args) == "error"
+
+    # relaunched in a new directory, and killed before logging its result
+    exp_args = make_exp_dir(tmp_path, "1", None, name="exp_1_relaunched")
+    assert results_log.get_record(exp_args) is None
+    assert results_log.status(exp_args) == "incomplete"
+    result_df = results_log.result_df([exp_args], set_index=False)
+    assert result_df["exp_dir"][0] == exp_args.exp_dir
+
+
+def test_find_incomplete_from_log(tmp_path):
+    results_log = ResultsLog(tmp_path)
+    exp_args_list = [MockedExpArgs(exp_id=exp_id) for exp_id in ["1", "2", "3"]]
+    for exp_args in exp_args_list:
+        exp_args.exp_dir = tmp_path / exp_args.exp_name
+    with open(tmp_path / RESULTS_LOG_NAME, "a") as f:
+        f.write(json.dumps({"exp_id": "1", "exp_dir": str(tmp_path / "exp_1"), "terminated": True}))
+        f.write("\n")
+        f.write(json.dumps({"exp_id": "2", "exp_dir": str(tmp_path / "exp_2"), "err_msg": "Error"}))
+        f.write("\n")
+    results_log.update()
+
+    exp_args_list = find_incomplete_from_log(exp_args_list, results_log, include_errors=True)
+    assert [exp_args.is_dummy for exp_args in exp_args_list] == [True, False, False]
+    assert [exp_args.status for exp_args in exp_args_list] == ["done", "error", "incomplete"]
+
+    exp_args_list = find_incomplete_from_log(exp_args_list, results_log, include_errors=False)
+    assert [exp_args.is_dummy for exp_args in exp_args_list] == [True, True, False]
@@ -0,0 +1,109 @@
+import bgym
+import pytest
+
+from agentlab.experiments.exp_utils import MockedExpArgs
+from agentlab.experiments.scheduling import (
+    ServerDispatcher,
+    WorkUnit,
+    critical_path_priorities,
+    estimate_durations,
+    expected_makespan,
+    make_work_units,
+    plan_schedule,
+    split_components,
+)
+
+
+def make_exp_args_list():
+    # a chain of 3 experiments and 3 independent ones
+    return [
+        MockedExpArgs(exp_id="d", depends_on=[]),
+        MockedExpArgs(exp_id="e", depends_on=[]),
+        MockedExpArgs(exp_id="f", depends_on=[]),
+        MockedExpArgs(exp_id="a", depends_on=[]),
+        MockedExpArgs(exp_id="b", depends_on=["a"]),
+        MockedExpArgs(exp_id="c", depends_on=["b"]),
+    ]
+
+
+def test_critical_path_priorities():
+    exp_args_list = make_exp_args_list()
+    durations = estimate_durations(exp_args_list)
+    priorities = critical_path_priorities(exp_args_list, durations)
+    assert priorities == {"a": 3, "b": 2, "c": 1, "d": 1, "e": 1, "f": 1}
+
+    # starting the chain first, it runs along the independent experiments
+    assert expected_makespan(exp_args_list, durations, priorities, n_workers=2) == 3
+    assert plan_schedule(exp_args_list, n_workers=2) == priorities
+
+    with pytest.raises(ValueError):
+        critical_path_priorities([MockedExpArgs(exp_id="a", depends_on=["b"])], {"a": 1})
+    cycle = [
+        MockedExpArgs(exp_id="a", depends_on=["b"]),
+        MockedExpArgs(exp_id="b", depends_on=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        critical_path_priorities(cycle, {"a": 1, "b": 1})
+
+
+def test_estimate_durations():
+    exp_args_list = [
+        bgym.ExpArgs(agent_args=None, env_args=bgym.EnvArgs(task_name=name), exp_id=name)
+        for name in ["task1", "task2", "task3", "task4"]
+    ]
+    exp_args_list[3].is_dummy = True
+    durations = estimate_durations(exp_args_list, {"task1": 10, "task2": 30, "task5": 100})
+    # task3 has no past duration and gets the median
+    assert durations == {"task1": 10, "task2": 30, "task3": 30, "task4": 0}
+
+
+def test_make_work_units():
+    exp_args_list = make_exp_args_list()
+    components = split_components(exp_args_list)
+    assert [[e.exp_id for e in component] for component in components] == [
+        ["d"],
+        ["e"],
+        ["f"],
+        ["a", "b", "c"],
+    ]
+
+    units = make_work_units(exp_args_list, n_units=2)
+    # the chain is kept together, the independent experiments balance the other unit
+    assert [[e.exp_id for e in unit.exp_args_list] for unit in units] == [
+        ["a", "b", "c"],
+        ["d", "e", "f"],
+    ]
+    assert [unit.work for unit in units] == [3, 3]
+    assert [unit.priority for unit in units] == [3, 1]
+
+
+def test_server_dispatcher():
+    def make_units(study_idx, works):
+        return [WorkUnit(study_idx, [], work, work) for work in works]
+
+    dispatcher = ServerDispatcher([make_units(0, [5, 1]), make_units(1, [3, 2, 2, 2])], n_servers=3)
+    assignments = [dispatcher.next_unit(server_idx) for server_idx in range(3)]
+    # each study gets a server, the third server steals from the study with the most work left
+    assert [(unit.study_idx, unit.work, reset) for unit, reset in assignments] == [
+        (0, 5, True),
+        (1, 3, True),
+        (1, 2, True),
+    ]
+
+    # a server keeps running its study without reset, then steals after a reset
+    unit, reset = dispatcher.next_unit(0)
+    assert (unit.study_idx, reset) == (0, False)
+    unit, reset = dispatcher.next_unit(0)
+    assert (unit.study_idx, reset) == (1, True)
+    assert dispatcher.next_unit(1)[1] is False
+    assert dispatcher.next_unit(2) is None
+
+    # a relaunched unit goes first after a reset, a cancelled study has nothing left
+    dispatcher = ServerDispatcher([make_units(0, [5, 1])], n_servers=1)
+    unit, _ = dispatcher.next_unit(0)
+    dispatcher.requeue(unit)
+    assert dispatcher.next_unit(0) == (unit, True)
+    assert dispatcher.next_unit(0)[1] is False
+    dispatcher.requeue(unit)
+    dispatcher.cancel(0)
+    assert dispatcher.next_unit(0) is None
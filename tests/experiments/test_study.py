@@ -1,9 +1,13 @@
+import json
+
+import bgym
 import pytest
 from agentlab.agents.generic_agent.agent_configs import FLAGS_GPT_4o
 from agentlab.agents.generic_agent.generic_agent import GenericAgentArgs
 from agentlab.llm.chat_api import CheatMiniWoBLLMArgs
+from agentlab.experiments.exp_utils import MockedAgentArgs, MockedEpisodeExpArgs
 from agentlab.experiments.study import ParallelStudies, make_study, Study
-from agentlab.experiments.multi_server import WebArenaInstanceVars
+from agentlab.experiments.multi_server import BaseServer, WebArenaInstanceVars
 import logging
 
 
@@ -62,6 +66,68 @@ def test_launch_parallel_study():
         assert n_completed == "4/4"
 
 
+class MockedBenchmark:
+    """Records the resets of the servers in a file, as they happen in the process of the server."""
+
+    def __init__(self, reset_log):
+        self.name = "mocked_benchmark"
+        self.reset_log = reset_log
+
+    def prepare_backends(self):
+        with open(self.reset_log, "a") as f:
+            f.write("reset\n")
+
+
+class MockedStudy:
+    def __init__(self, study_dir, exp_args_list):
+        self.dir = study_dir
+        self.name = study_dir.name
+        self.exp_args_list = exp_args_list
+        self.benchmark = MockedBenchmark(study_dir / "resets.txt")
+        self.avg_step_timeout = 60
+        self.past_study_dirs = None
+        self.comment = None
+
+    def set_reproducibility_info(self, strict_reproducibility=False, comment=None):
+        pass
+
+    def save(self):
+        pass
+
+    def get_results(self):
+        pass
+
+
+def test_parallel_studies_relaunch(tmp_path):
+    study_dir = tmp_path / "study"
+    study_dir.mkdir()
+    exp_args_list = [
+        MockedEpisodeExpArgs(
+            agent_args=MockedAgentArgs(),
+            env_args=bgym.EnvArgs(task_name=f"task{i}"),
+            exp_id=str(i),
+            fail_once=i == 0,
+        )
+        for i in range(4)
+    ]
+    study = ParallelStudies(
+        studies=[MockedStudy(study_dir, exp_args_list)],
+        parallel_servers=[BaseServer(), BaseServer()],
+        units_per_server=1,
+    )
+
+    study._run(n_jobs=2, n_relaunch=2)
+
+    # every experiment ran, the failed one again in a new directory
+    exp_dirs = sorted(path.name for path in study_dir.glob("exp_*"))
+    assert exp_dirs == ["exp_0_0", "exp_0_1", "exp_1_0", "exp_2_0", "exp_3_0"]
+    records = [json.loads(line) for line in open(study_dir / "results_log.jsonl")]
+    assert sorted(record["exp_id"] for record in records) == ["0", "0", "1", "2", "3"]
+    assert [record["err_msg"] for record in records if record["exp_id"] == "0"] == ["Error", None]
+    # each server is reset before its first unit, and again before the relaunch
+    assert (study_dir / "resets.txt").read_text().count("reset") == 3
+
+
 if __name__ == "__main__":
     # test_launch_parallel_study()
     manual_test_launch_parallel_study_webarena()
@@ -0,0 +1,144 @@
+import gc
+import weakref
+
+import numpy as np
+import pytest
+
+from graph_grounding.graph_store import GraphStore, read_graph_store, write_graph_store
+
+
+def make_graph():
+    # a task t with two branches a -> c and b -> c, then c -> d, plus a NEXT relationship c -> a
+    nodes = [
+        {"id": "t", "label": "Task", "properties": {"description": "buy"}, "embedding": [1.0, 0.0]},
+        {"id": "a", "label": "URL", "properties": {"url": "/a"}},
+        {"id": "b", "label": "URL", "properties": {"url": "/b"}},
+        {"id": "c", "label": "URL", "properties": {"url": "/c"}, "embedding": [0.0, 1.0]},
+        {"id": "d", "label": "URL", "properties": {"url": "/d", "tags": ["é", 1]}},
+    ]
+    relationships = [
+        {
+            "id": "c-d",
+            "type": "ACTION",
+            "source": "c",
+            "target": "d",
+            "properties": {"action": "x"},
+        },
+        {"id": "t-a", "type": "ACTION", "source": "t", "target": "a", "properties": {}},
+        {"id": "t-b", "type": "ACTION", "source": "t", "target": "b", "properties": {}},
+        {"id": "a-c", "type": "ACTION", "source": "a", "target": "c", "properties": {}},
+        {"id": "b-c", "type": "ACTION", "source": "b", "target": "c", "properties": {}},
+        {"id": "c-a", "type": "NEXT", "source": "c", "target": "a", "properties": {}},
+        # dropped, its target is not exported
+        {"id": "d-z", "type": "ACTION", "source": "d", "target": "z", "properties": {}},
+    ]
+    return nodes, relationships
+
+
+def rel_ids(store: GraphStore, paths) -> set[tuple[str, ...]]:
+    return {tuple(store.rel_ids[rel] for rel in path) for path in paths}
+
+
+@pytest.fixture
+def store(tmp_path) -> GraphStore:
+    path = tmp_path / "graph" / "store.bin"
+    write_graph_store(path, *make_graph())
+    return read_graph_store(path)
+
+
+def test_round_trip(store, tmp_path):
+    nodes, relationships = make_graph()
+    assert store.n_nodes == 5
+    assert store.n_relationships == 6
+    assert list(store.node_ids) == [node["id"] for node in nodes]
+    for i, node in enumerate(nodes):
+        assert store.node_label(i) == node["label"]
+        assert store.node_properties(i) == node["properties"]
+
+    assert store.has_embedding.tolist() == [True, False, False, True, False]
+    np.testing.assert_array_equal(store.embeddings[[0, 3]], [[1, 0], [0, 1]])
+    assert store.nodes_with_label("Task").tolist() == [0]
+    assert store.nodes_with_label("Unknown").tolist() == []
+    assert store.find_nodes("URL", "url", "/c") == [3]
+    assert store.find_nodes("URL", "url", "/z") == []
+
+    for rel in range(store.n_relationships):
+        source, target = store.rel_ids[rel].split("-")
+        assert store.node_ids[int(store.sources[rel])] == source
+        assert store.node_ids[int(store.targets[rel])] == target
+    c_d = list(store.rel_ids).index("c-d")
+    assert store.relationship_type(c_d) == "ACTION"
+    assert store.relationship_properties(c_d) == {"action": "x"}
+    assert store.relationship_data(c_d) == ({"url": "/c"}, "ACTION", nodes[4]["properties"])
+    assert [store.rel_ids[rel] for rel in store.outgoing(3)] == ["c-d", "c-a"]
+    assert [store.rel_ids[rel] for rel in store.outgoing(3, "NEXT")] == ["c-a"]
+    assert store.outgoing(3, "UNKNOWN") == []
+
+    (tmp_path / "other.bin").write_bytes(b"NOTAGRAPH")
+    with pytest.raises(ValueError):
+        read_graph_store(tmp_path / "other.bin")
+
+
+def test_properties_cache(tmp_path):
+    path = tmp_path / "store.bin"
+    write_graph_store(path, *make_graph())
+    store = read_graph_store(path)
+
+    # the callers get copies, the cached properties are not modified
+    store.node_properties(3)["url"] = "/z"
+    c_d = list(store.rel_ids).index("c-d")
+    store.relationship_properties(c_d)["action"] = "y"
+    assert store.node_properties(3) == {"url": "/c"}
+    assert store.relationship_properties(c_d) == {"action": "x"}
+
+    # the caches don't keep the store alive
+    store_ref = weakref.ref(store)
+    del store
+    gc.collect()
+    assert store_ref() is None
+
+
+def test_expand_paths(store):
+    paths = store.expand_paths(0)
+    # the relationships are not repeated, the cycle a -> c -> a is only followed once
+    assert rel_ids(store, paths) == {
+        ("t-a",),
+        ("t-a", "a-c"),
+        ("t-a", "a-c", "c-d"),
+        ("t-a", "a-c", "c-a"),
+        ("t-b",),
+        ("t-b", "b-c"),
+        ("t-b", "b-c", "c-d"),
+        ("t-b", "b-c", "c-a"),
+        ("t-b", "b-c", "c-a", "a-c"),
+        ("t-b", "b-c", "c-a", "a-c", "c-d"),
+    }
+    assert len(paths) == 10
+    assert rel_ids(store, store.expand_paths(0, max_length=1)) == {("t-a",), ("t-b",)}
+    assert rel_ids(store, store.expand_paths(0, rel_type="ACTION")) == {
+        ("t-a",),
+        ("t-a", "a-c"),
+        ("t-a", "a-c", "c-d"),
+        ("t-b",),
+        ("t-b", "b-c"),
+        ("t-b", "b-c", "c-d"),
+    }
+    assert len(store.expand_paths(0, max_paths=3)) == 3
+    assert store.expand_paths(4) == []
+
+    # the maximal paths are the ones that are not a prefix of another path
+    maximal = {path for path in paths if not any(p[: len(path)] == path != p for p in paths)}
+    assert set(store.expand_paths(0, maximal_only=True)) == maximal
+    assert rel_ids(store, store.expand_paths(0, max_length=2, maximal_only=True)) == {
+        ("t-a", "a-c"),
+        ("t-b", "b-c"),
+    }
+
+    path = store.expand_paths(0, max_length=2, rel_type="ACTION", maximal_only=True)[0]
+    assert store.path_data(0, path) == [
+        {"description": "buy"},
+        "ACTION",
+        store.node_properties(store.path_nodes(0, path)[1]),
+        "ACTION",
+        {"url": "/c"},
+    ]
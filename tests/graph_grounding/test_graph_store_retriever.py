@@ -0,0 +1,69 @@
+from graph_grounding.graph_store import read_graph_store, write_graph_store
+from graph_grounding.retriever import (
+    GraphStoreLongestPathBasedRetriever,
+    LongestPathBasedRetriever,
+)
+
+HOST = "http://shop"
+
+
+def make_graph():
+    # a -> b -> c -> d -> e, and a shortcut a -> d
+    nodes = [
+        {"id": name, "label": "URL", "properties": {"url": f"{HOST}/{name}?page=1"}}
+        for name in "abcde"
+    ]
+    actions = {
+        ("a", "b"): {"action": "click", "target_line": "[12] link 'B'"},
+        ("b", "c"): {"action": "fill", "target_line": "[3] textbox"},
+        ("c", "d"): {"action": "click"},
+        ("d", "e"): {"action": "click", "target_line": "[7] button 'E'"},
+        ("a", "d"): {"action": "click", "target_line": "[5] link 'D'"},
+    }
+    relationships = [
+        {"id": f"{s}-{t}", "type": "ACTION", "source": s, "target": t, "properties": properties}
+        for (s, t), properties in actions.items()
+    ]
+    return nodes, relationships
+
+
+class MockedNavigationGraph:
+    """Returns the records of the Cypher query of LongestPathBasedRetriever on make_graph."""
+
+    def get_page_node_id(self, state):
+        return "a"
+
+    def execute_query(self, query, source_id):
+        # the prime paths a-b-c-d-e and a-d-e, the last step before the end URL is left out and
+        # the missing target line of c -> d makes its description null
+        return [
+            {
+                "nodeEdgeArray": [
+                    f"{HOST}/a?page=1",
+                    "click: [12] link 'B'",
+                    f"{HOST}/b?page=1",
+                    "fill: [3] textbox",
+                    f"{HOST}/c?page=1",
+                    None,
+                    f"{HOST}/e?page=1",
+                ]
+            },
+            {"nodeEdgeArray": [f"{HOST}/a?page=1", "click: [5] link 'D'", f"{HOST}/e?page=1"]},
+        ]
+
+
+def test_longest_path_verbalization_matches_neo4j(tmp_path):
+    path = tmp_path / "store.bin"
+    write_graph_store(path, *make_graph())
+    store_retriever = GraphStoreLongestPathBasedRetriever(read_graph_store(path))
+    neo4j_retriever = LongestPathBasedRetriever(MockedNavigationGraph(), None)
+
+    state = f"{HOST}/a?page=1"
+    graphs = store_retriever._retrieve(state, goal=None)
+    assert graphs == neo4j_retriever._retrieve(state, goal=None)
+    assert store_retriever.retrieve(state, goal=None) == neo4j_retriever.retrieve(state, goal=None)
+    assert store_retriever.retrieve(state, goal=None) == (
+        "1. (/a?page=1, click: [12] link 'B') -> (/b?page=1, fill: [3] textbox) -> "
+        "(/c?page=1, None) -> (/e?page=1)\n\n"
+        "\t2. (/a?page=1, click: [5] link 'D') -> (/e?page=1)"
+    )
@@ -0,0 +1,88 @@
+import random
+
+from graph_grounding.benchmark_path_pruning import generate_paths, naive_prune
+from graph_grounding.retriever.hamming_distance_based_retriever import (
+    HammingDistanceBasedRetriever,
+)
+from graph_grounding.retriever.path_pruning import (
+    FETCH_PATHS,
+    prune_dominated_paths,
+    prune_dominated_records,
+)
+from graph_grounding.retriever.tak_embedding_based_retriever import select_paths
+
+
+def test_prune_dominated_paths():
+    paths = [["a", "b"], ["a"], ["a", "b", "c"], ["c", "b"], ["d"], ["d"], ["e", "f"], ["f", "e"]]
+    # only the first copy of identical paths is kept, paths with the same relationships dominate
+    # each other like in the Cypher pruning
+    assert prune_dominated_paths(paths) == [2, 4]
+    assert prune_dominated_paths([]) == []
+    assert prune_dominated_paths([[]]) == [0]
+
+
+def test_prune_dominated_paths_matches_reference():
+    for branching in [1, 2, 3]:
+        for depth in [1, 3, 5]:
+            paths = generate_paths(branching, depth, seed=branching * depth)
+            assert prune_dominated_paths(paths) == naive_prune(paths)
+
+    # random paths over few relationships, a path doesn't repeat a relationship
+    rng = random.Random(0)
+    rels = [f"r{i}" for i in range(6)]
+    for _ in range(200):
+        paths = [rng.sample(rels, k=rng.randint(1, 4)) for _ in range(rng.randint(1, 12))]
+        reference = naive_prune(paths)
+        # the reference keeps every copy of an undominated path, only the first one is kept here
+        reference = [i for i in reference if paths.index(paths[i]) == i]
+        assert prune_dominated_paths(paths) == reference
+
+
+def test_select_paths():
+    records = [
+        {"goal": "g1", "score": 0.9, "rel_ids": ["a"]},
+        {"goal": "g1", "score": 0.9, "rel_ids": ["a", "b"]},
+        {"goal": "g2", "score": 0.8, "rel_ids": ["a"]},
+        {"goal": "g3", "score": 0.95, "rel_ids": ["c"]},
+        {"goal": "g4", "score": 0.85, "rel_ids": ["d"]},
+    ]
+    # paths are only compared within the same goal
+    kept = prune_dominated_records(records, group_by=lambda r: r["goal"])
+    assert kept == records[1:]
+    assert [r["goal"] for r in select_paths(records)] == ["g2", "g4", "g1"]
+
+
+class MockedNavigationGraph:
+    """Returns the relationship IDs of the expanded paths, then the details of the fetched ones."""
+
+    def __init__(self, records):
+        self.records = records
+        self.fetched = []
+
+    def run_statement(self, statement, **params):
+        if statement != FETCH_PATHS:
+            return self.records
+        self.fetched.extend(params["rel_ids"])
+        return [
+            {
+                "i": i,
+                "path": [{"description": "goal"}, "ACTION", {"description": "/".join(ids)}],
+                "rels": [],
+                "properties": [],
+            }
+            for i, ids in enumerate(params["rel_ids"])
+        ]
+
+
+def test_hamming_fetches_kept_paths():
+    records = [
+        {"goal": "g1", "hammingDistance": 2, "rel_ids": ["a"]},
+        {"goal": "g1", "hammingDistance": 2, "rel_ids": ["a", "b"]},
+        {"goal": "g2", "hammingDistance": 1, "rel_ids": ["c"]},
+    ]
+    client = MockedNavigationGraph(records)
+    paths = HammingDistanceBasedRetriever(client, None)._retrieve(state=None, goal="buy")
+
+    # only the details of the kept paths are fetched, by increasing distance
+    assert client.fetched == [["c"], ["a", "b"]]
+    assert [path[-1]["description"] for path in paths] == ["c", "a/b"]
@@ -0,0 +1,20 @@
+from graph_grounding.urls import UrlTemplateEngine
+
+
+def test_engines_merge_their_templates(tmp_path):
+    path = tmp_path / "url_templates.json"
+    engine_1 = UrlTemplateEngine(path)
+    engine_2 = UrlTemplateEngine(path)
+
+    assert engine_1.learn("https://shop.com/products/1", "https://shop.com/products/<product_id>")
+    assert engine_2.learn("https://shop.com/users/7", "https://shop.com/users/<user_id>")
+    # engine_2 did not overwrite the template saved by engine_1, and now knows it too
+    assert engine_2.match("https://shop.com/products/2") == "https://shop.com/products/<product_id>"
+    engine_3 = UrlTemplateEngine(path)
+    assert engine_3.match("https://shop.com/products/3") == "https://shop.com/products/<product_id>"
+    assert engine_3.match("https://shop.com/users/8") == "https://shop.com/users/<user_id>"
+
+    # the same shape learned with another template by another engine is ambiguous
+    engine_1.learn("https://shop.com/a.html", "https://shop.com/<category>.html")
+    assert not engine_2.learn("https://shop.com/b.html", "https://shop.com/<product_name>.html")
+    assert UrlTemplateEngine(path).match("https://shop.com/c.html") is None
@@ -1,13 +1,18 @@
 import os
+from types import SimpleNamespace
 
 import pytest
 
+import agentlab.llm.tracking as tracking
 from agentlab.llm.chat_api import (
     AzureModelArgs,
+    ChatModel,
     OpenAIModelArgs,
+    estimate_prompt_tokens,
     make_system_message,
     make_user_message,
 )
+from agentlab.llm.llm_utils import HumanMessage
 
 # TODO(optimass): figure out a good model for all tests
 
@@ -59,3 +64,108 @@ def test_api_model_args_openai():
     answer = model(messages)
 
     assert "5" in answer.get("content")
+
+
+class MockStream:
+    def __init__(self, chunks, usage):
+        self.chunks = chunks
+        self.usage = usage
+        self.n_consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.n_consumed += 1
+            delta = SimpleNamespace(content=chunk)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        self.closed = True
+
+
+class MockStreamingCompletions:
+    def __init__(self):
+        self.streams = []
+
+    def create(self, stream=False, **kwargs):
+        assert stream
+        chunks = ["<think>I should", " click</think>", "<action>click('1", "2')</action>"]
+        chunks += [" and more"] * 50
+        self.streams.append(
+            MockStream(chunks, SimpleNamespace(prompt_tokens=10, completion_tokens=60))
+        )
+        return self.streams[-1]
+
+
+class MockStreamingClient:
+    def __init__(self, api_key=None):
+        self.chat = SimpleNamespace(completions=MockStreamingCompletions())
+
+
+def test_stream_early_stop():
+    model = ChatModel("model", client_class=MockStreamingClient)
+    messages = [make_user_message("click the button")]
+
+    full_answer = "".join(model.stream(messages))
+    assert full_answer.endswith(" and more")
+    assert model.client.chat.completions.streams[-1].closed
+
+    answer = model.complete_until(messages, should_stop=lambda text, tags: "action" in tags)
+    stream = model.client.chat.completions.streams[-1]
+    assert answer["content"] == "<think>I should click</think><action>click('12')</action>"
+    assert stream.n_consumed == 4
+    assert stream.closed
+    assert model.get_stats()["n_llm_early_stop"] == 1
+
+
+def test_estimate_prompt_tokens():
+    text_message = HumanMessage("click the button")
+    image_message = HumanMessage("click the button")
+    image_message.add_image("data:image/jpeg;base64," + "A" * 100_000)
+    assert estimate_prompt_tokens([text_message], "gpt-4o") > 0
+    assert estimate_prompt_tokens([image_message], "gpt-4o") == estimate_prompt_tokens(
+        [text_message], "gpt-4o"
+    )
+
+
+class MockCachingCompletions:
+    def __init__(self):
+        self.messages = None
+
+    def create(self, messages, **kwargs):
+        self.messages = messages
+        usage = SimpleNamespace(
+            prompt_tokens=100,
+            completion_tokens=5,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=80),
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="answer"))], usage=usage
+        )
+
+
+class MockCachingClient:
+    def __init__(self, api_key=None):
+        self.chat = SimpleNamespace(completions=MockCachingCompletions())
+
+
+def test_prompt_caching():
+    message = HumanMessage("static part")
+    message.add_cache_breakpoint()
+    message.add_text("dynamic part")
+
+    model = ChatModel("model", client_class=MockCachingClient)
+    with tracking.set_tracker() as tracker:
+        model([message])
+    assert tracker.stats["cached_input_tokens"] == 80
+    assert tracker.stats["input_tokens"] == 100
+
+    # the breakpoints are only sent to the APIs supporting them
+    sent_content = model.client.chat.completions.messages[0]["content"]
+    assert all("cache_control" not in elem for elem in sent_content)
+    assert "cache_control" in message["content"][0]
+
+    model.supports_cache_breakpoints = True
+    model([message])
+    assert "cache_control" in model.client.chat.completions.messages[0]["content"][0]
@@ -1,6 +1,11 @@
+import asyncio
+import time
+
 import pytest
 
+from agentlab.llm import huggingface_utils
 from agentlab.llm.chat_api import HuggingFaceURLChatModel, make_system_message, make_user_message
+from agentlab.llm.huggingface_utils import HFBaseChatModel
 from agentlab.llm.llm_utils import download_and_save_model
 from agentlab.llm.prompt_templates import STARCHAT_PROMPT_TEMPLATE
 
@@ -30,3 +35,65 @@ def test_download_and_save_model():
     save_dir = "test_models"
 
     download_and_save_model(model_path, save_dir)
+
+
+class MockTokenizer:
+    def apply_chat_template(self, messages, tokenize=False):
+        return "\n".join(m["content"] for m in messages)
+
+
+def make_mock_hf_model(monkeypatch, **kwargs):
+    monkeypatch.setattr(
+        huggingface_utils.AutoTokenizer, "from_pretrained", lambda name: MockTokenizer()
+    )
+    model = HFBaseChatModel("mock-model", None, **kwargs)
+    model.temperature = 0.5
+    return model
+
+
+def test_hf_concurrent_samples(monkeypatch):
+    model = make_mock_hf_model(monkeypatch, n_retry_server=1, max_concurrency=4)
+    pending = 0
+    max_pending = 0
+
+    async def async_llm(prompt, temperature):
+        nonlocal pending, max_pending
+        pending += 1
+        max_pending = max(max_pending, pending)
+        await asyncio.sleep(0.1)
+        pending -= 1
+        return f"{prompt} at {temperature}"
+
+    model.async_llm = async_llm
+    messages = [make_system_message("system"), make_user_message("user")]
+
+    start = time.time()
+    answers = model(messages, n_samples=8)
+    elapsed = time.time() - start
+
+    assert [a["content"] for a in answers] == ["system\nuser at 0.5"] * 8
+    assert max_pending == 4
+    # 2 waves of 4 concurrent samples instead of 8 sequential ones
+    assert elapsed < 0.5
+
+    assert model(messages)["content"] == "system\nuser at 0.5"
+
+
+def test_hf_retry_with_sync_llm(monkeypatch):
+    model = make_mock_hf_model(monkeypatch, n_retry_server=3, retry_wait_time=0.01)
+    n_calls = 0
+
+    def llm(prompt, temperature):
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls < 3:
+            raise ConnectionError("server not ready")
+        return "answer"
+
+    model.llm = llm
+    assert model([make_user_message("user")], temperature=0.1)["content"] == "answer"
+    assert n_calls == 3
+
+    n_calls = -10
+    with pytest.raises(ConnectionError):
+        model([make_user_message("user")])
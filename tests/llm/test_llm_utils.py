@@ -3,6 +3,7 @@ from typing import Literal
 from unittest.mock import Mock
 
 import httpx
+import numpy as np
 import pytest
 from openai import RateLimitError
 
@@ -270,6 +271,86 @@ def test_message_merge_text_image():
     assert message["content"][2]["text"] == "This is another test.\nGoodbye, world!"
 
 
+def test_message_parts_are_shared():
+    image = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,abc"}}
+    content = [{"type": "text", "text": "Hello"}, {"type": "text", "text": "world"}, image]
+    message = llm_utils.BaseMessage(role="user", content=content)
+    assert message["content"][2] is image
+
+    # the parts given by the caller are never modified
+    message.add_cache_breakpoint()
+    message.merge()
+    assert content == [{"type": "text", "text": "Hello"}, {"type": "text", "text": "world"}, image]
+    assert "cache_control" not in image
+    assert message["content"][0]["text"] == "Hello\nworld"
+    assert message["content"][1]["cache_control"] == {"type": "ephemeral"}
+
+    # merging again is a no-op until content is added
+    merged_content = message["content"]
+    message.merge()
+    assert message["content"] is merged_content
+    message.add_text("again")
+    message.merge()
+    assert len(message["content"]) == 3
+
+
+def test_discussion_copy():
+    discussion = llm_utils.Discussion([make_system_message("system")])
+    copied = discussion.copy()
+    copied.append(llm_utils.HumanMessage("hello"))
+    assert len(discussion.messages) == 1
+    assert copied.messages[0] is discussion.messages[0]
+
+
+def test_image_url_cache():
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    url = llm_utils.image_to_jpg_base64_url(image)
+    assert url.startswith("data:image/jpeg;base64,")
+    assert llm_utils.image_to_jpg_base64_url(image) is url
+    assert llm_utils.image_to_jpg_base64_url(image.copy()) == url
+
+
+def test_streaming_tag_parser():
+    parser = llm_utils.StreamingTagParser()
+    assert parser.feed("<think>I should click</th") == []
+    assert parser.feed("ink>\n<action>click('12')</action><me") == ["think", "action"]
+    assert parser.feed("mory>m</memory>") == ["memory"]
+    assert parser.closed_tags == ["think", "action", "memory"]
+
+
+class MockStreamingChat:
+    def __init__(self, answer):
+        self.answer = answer
+        self.n_streamed = None
+
+    def complete_until(self, messages, should_stop):
+        tag_parser = llm_utils.StreamingTagParser()
+        text = ""
+        for i, char in enumerate(self.answer):
+            text += char
+            self.n_streamed = i + 1
+            closed_tags = tag_parser.feed(char)
+            if closed_tags and should_stop(text, closed_tags):
+                break
+        return dict(role="assistant", content=text)
+
+
+def test_retry_early_stop():
+    answer = "<think>t</think><action>a</action>\n" + "blah " * 100
+    chat = MockStreamingChat(answer)
+    parser = lambda text: llm_utils.parse_html_tags_raise(text, keys=["think", "action"])
+    messages = [make_system_message("system")]
+
+    ans = llm_utils.retry(chat, messages, n_retry=1, parser=parser, early_stop_tag="action")
+    assert ans == {"think": "t", "action": "a"}
+    assert chat.n_streamed == answer.index("\n")
+
+    # the action is closed, but the think tag is missing: keep generating
+    chat = MockStreamingChat("<action>a</action><think>t</think> blah")
+    ans = llm_utils.retry(chat, messages, n_retry=1, parser=parser, early_stop_tag="action")
+    assert chat.n_streamed == len("<action>a</action><think>t</think> blah")
+
+
 if __name__ == "__main__":
     # test_retry_parallel()
     # test_rate_limit_max_wait_time()
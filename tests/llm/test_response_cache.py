@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+from agentlab.llm.chat_api import ChatModel, make_system_message, make_user_message
+from agentlab.llm.response_cache import ResponseCache
+
+
+class MockCompletions:
+    def __init__(self):
+        self.n_calls = 0
+
+    def create(self, model, messages, n, temperature, max_tokens):
+        self.n_calls += 1
+        choices = [
+            SimpleNamespace(message=SimpleNamespace(content=f"answer {self.n_calls}.{i}"))
+            for i in range(n)
+        ]
+        return SimpleNamespace(
+            choices=choices, usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+        )
+
+
+class MockClient:
+    def __init__(self, api_key=None):
+        self.chat = SimpleNamespace(completions=MockCompletions())
+
+
+MESSAGES = [
+    make_system_message("You are an helpful virtual assistant"),
+    make_user_message("Give the third prime number"),
+]
+
+
+def test_key():
+    key = ResponseCache.key("model", MESSAGES, 0.1, 100, 1)
+    assert key == ResponseCache.key("model", [dict(m) for m in MESSAGES], 0.1, 100, 1)
+    assert key != ResponseCache.key("other-model", MESSAGES, 0.1, 100, 1)
+    assert key != ResponseCache.key("model", MESSAGES, 0.5, 100, 1)
+    assert key != ResponseCache.key("model", MESSAGES, 0.1, 200, 1)
+    assert key != ResponseCache.key("model", MESSAGES, 0.1, 100, 2)
+    assert key != ResponseCache.key("model", MESSAGES[:1], 0.1, 100, 1)
+
+
+def test_put_get(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    assert cache.get("key") is None
+
+    cache.put("key", ["answer"], input_tokens=10, output_tokens=5)
+    assert cache.get("key") == {"contents": ["answer"], "input_tokens": 10, "output_tokens": 5}
+
+    # persisted across instances
+    assert ResponseCache(tmp_path / "cache.sqlite").get("key")["contents"] == ["answer"]
+
+
+def test_eviction(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_entries=3, evict_every=1)
+    for i in range(5):
+        cache.put(f"key{i}", [f"answer {i}"])
+        # make the order of the access times unambiguous
+        cache._get_connection().execute(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?", (i, f"key{i}")
+        )
+    cache.evict()
+
+    assert len(cache) == 3
+    assert cache.get("key0") is None
+    assert cache.get("key4") is not None
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", ttl=-1)
+    cache.put("key", ["answer"])
+    assert cache.get("key") is None
+
+
+def test_chat_model_cache(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    model = ChatModel("model", client_class=MockClient, response_cache=cache, temperature=0)
+    completions = model.client.chat.completions
+
+    answer = model(MESSAGES)
+    assert answer["content"] == "answer 1.0"
+    assert model.get_stats()["n_llm_cache_hit"] == 0
+
+    # identical prompt, served from the cache
+    assert model(MESSAGES)["content"] == "answer 1.0"
+    assert model.get_stats()["n_retry_llm"] == 0
+    assert model.get_stats()["n_llm_cache_hit"] == 1
+    assert completions.n_calls == 1
+
+    # different number of samples, not cached
+    answers = model(MESSAGES, n_samples=2)
+    assert [a["content"] for a in answers] == ["answer 2.0", "answer 2.1"]
+    assert [a["content"] for a in model(MESSAGES, n_samples=2)] == ["answer 2.0", "answer 2.1"]
+    assert completions.n_calls == 2
+
+
+def test_chat_model_cache_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENTLAB_LLM_CACHE", str(tmp_path / "cache.sqlite"))
+    model = ChatModel("model", client_class=MockClient)
+    assert model.response_cache is not None
+
+    monkeypatch.delenv("AGENTLAB_LLM_CACHE")
+    assert ChatModel("model", client_class=MockClient).response_cache is None
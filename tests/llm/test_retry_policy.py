@@ -0,0 +1,153 @@
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from agentlab.llm.chat_api import ChatModel, RetryError, make_user_message
+from agentlab.llm.retry_policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    default_retry_policies,
+    get_retry_after,
+    get_retry_policy,
+)
+
+
+def make_status_error(error_class, status_code, message="error", headers=None):
+    request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return error_class(message, response=response, body=None)
+
+
+def test_decorrelated_jitter():
+    policy = RetryPolicy(base_wait_time=1, max_wait_time=10)
+    wait_time = 0.0
+    for _ in range(100):
+        previous = wait_time
+        wait_time = policy.wait_time(previous)
+        assert 1 <= wait_time <= min(10, max(1, previous * 3))
+
+    assert policy.wait_time(5, retry_after=3.5) == 3.5
+    assert policy.wait_time(5, retry_after=0.1) == 1
+    assert policy.wait_time(5, retry_after=100) == 10
+
+
+def test_get_retry_after():
+    assert (
+        get_retry_after(make_status_error(openai.RateLimitError, 429, headers={"retry-after": "7"}))
+        == 7
+    )
+    assert (
+        get_retry_after(
+            make_status_error(openai.RateLimitError, 429, headers={"retry-after-ms": "1500"})
+        )
+        == 1.5
+    )
+    error = make_status_error(openai.RateLimitError, 429, message="Please try again in 2.5s.")
+    assert get_retry_after(error) == 2.5
+    assert get_retry_after(make_status_error(openai.InternalServerError, 502)) is None
+
+
+def test_policy_per_error_class():
+    policies = default_retry_policies(min_retry_wait_time=5, max_retry_wait_time=60)
+    assert (
+        get_retry_policy(make_status_error(openai.InternalServerError, 502), policies).max_wait_time
+        == 30
+    )
+    assert not get_retry_policy(make_status_error(openai.BadRequestError, 400), policies).retryable
+    rate_limit_policy = get_retry_policy(make_status_error(openai.RateLimitError, 429), policies)
+    assert rate_limit_policy.base_wait_time == 5
+    assert rate_limit_policy.max_wait_time == 60
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("endpoint", failure_threshold=2, reset_timeout=0.05)
+    breaker.before_request()
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # half-open after the timeout, a failed probe opens the circuit again
+    breaker.opened_at -= 0.1
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    breaker.opened_at -= 0.1
+    breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_request()
+
+
+class FailingCompletions:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.n_calls = 0
+
+    def create(self, **kwargs):
+        self.n_calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="answer"))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5),
+        )
+
+
+def make_model(errors, **kwargs):
+    class MockClient:
+        def __init__(self, api_key=None):
+            self.base_url = f"https://api.test/{id(self)}"
+            self.chat = SimpleNamespace(completions=FailingCompletions(errors))
+
+    policies = {openai.OpenAIError: RetryPolicy(base_wait_time=0.01, max_wait_time=0.01)}
+    return ChatModel("model", client_class=MockClient, retry_policies=policies, **kwargs)
+
+
+def test_chat_model_retries_transient_errors():
+    model = make_model([make_status_error(openai.InternalServerError, 502)] * 2)
+    assert model([make_user_message("hello")])["content"] == "answer"
+
+    stats = model.get_stats()
+    assert stats["n_retry_llm"] == 3
+    assert stats["llm_retry_wait_time"] == pytest.approx(0.02)
+    assert len(model.attempt_latencies) == 3
+
+
+def test_chat_model_does_not_retry_client_errors():
+    model = make_model([make_status_error(openai.BadRequestError, 400)], max_retry=3)
+    model.retry_policies = default_retry_policies()
+    with pytest.raises(openai.BadRequestError):
+        model([make_user_message("hello")])
+    assert model.client.chat.completions.n_calls == 1
+
+
+def test_chat_model_gives_up():
+    model = make_model([make_status_error(openai.InternalServerError, 502)] * 3, max_retry=3)
+    with pytest.raises(RetryError):
+        model([make_user_message("hello")])
+
+
+def test_probe_released_after_other_errors():
+    model = make_model([make_status_error(openai.RateLimitError, 429)], max_retry=1)
+    breaker = model.circuit_breaker
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+
+    # the probe is rate limited, the next request probes the endpoint again
+    with pytest.raises(RetryError):
+        model([make_user_message("hello")])
+    assert breaker.is_open and not breaker.probing
+
+    assert model([make_user_message("hello")])["content"] == "answer"
+    assert not breaker.is_open
@@ -0,0 +1,33 @@
+from agentlab.llm import tokenizer_registry
+from agentlab.llm.tokenizer_registry import calibrate_estimate, estimate_tokens, resolve_encoding
+
+
+def test_resolve_encoding():
+    assert resolve_encoding("gpt-4o") == "o200k_base"
+    assert resolve_encoding("aicore/gpt-4o") == "o200k_base"
+    assert resolve_encoding("openai/gpt-4o-mini-2024-07-18") == "o200k_base"
+    assert resolve_encoding("azure/gpt-4-turbo") == "cl100k_base"
+    assert resolve_encoding("openai/gpt-3.5-turbo") == "cl100k_base"
+    assert resolve_encoding("anthropic/claude-3.5-sonnet") == "cl100k_base"
+    # unknown models of a provider default to cl100k_base instead of a HuggingFace lookup
+    assert resolve_encoding("aicore/my-deployment") == "cl100k_base"
+    # HuggingFace models are still looked up on HuggingFace
+    assert resolve_encoding("meta-llama/Meta-Llama-3-8B-Instruct") is None
+
+
+def test_register_tokenizer(monkeypatch):
+    monkeypatch.setitem(tokenizer_registry.MODEL_ENCODINGS, "my-model", "o200k_base")
+    tokenizer_registry.resolve_encoding.cache_clear()
+    assert resolve_encoding("aicore/my-model-v2") == "o200k_base"
+    tokenizer_registry.resolve_encoding.cache_clear()
+
+
+def test_estimate_tokens():
+    text = "hello world " * 100
+    assert estimate_tokens(text, "calibration-test") == 300
+
+    # converges to the ratio of the exact counts
+    for _ in range(20):
+        calibrate_estimate("calibration-test", text, 200)
+    assert abs(estimate_tokens(text, "calibration-test") - 200) <= 1
+    assert estimate_tokens(text, "gpt-4o") < 300
@@ -21,6 +21,7 @@ def test_get_action_decorator():
         "input_tokens": 1,
         "output_tokens": 1,
         "cost": 1.0,
+        "cached_input_tokens": 0,
     }
 
 